@@ -14,16 +14,68 @@ import yaml
 import os
 import asyncio
 import dotenv
+import logging
+import time
+import functools
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
 import re
 import sys
 
-from scamdetect import scan_discord_attachments_for_scams
+from scamdetect import (
+    scan_discord_attachments_for_scams,
+    configure_ocr_executor,
+    configure_ocr_cache,
+    start_ocr_cache,
+    close_ocr_cache,
+    configure_attachment_limits,
+    configure_ocr_pipelines,
+    configure_scam_image_index,
+    configure_blacklist,
+    load_blacklist,
+    remember_scam_images,
+    ScamScanResult,
+    PatternListMatcher,
+    BLACKLIST_PATH,
+)
+from modtools import (
+    PRIORITY_ENFORCE,
+    PRIORITY_NAMES,
+    PRIORITY_NOTIFY,
+    PRIORITY_SCAN,
+    ActionCoalescer,
+    CommandSyncCache,
+    Counter,
+    EditIndex,
+    Evidence,
+    EvidenceStore,
+    FileWatcher,
+    Gauge,
+    Histogram,
+    LogEntry,
+    ModLogSink,
+    PurgeProgress,
+    RecentMessageIndex,
+    RoleActionQueue,
+    TimerScheduler,
+    WorkQueue,
+    delete_known_messages,
+    edit_roles,
+    purge_channels,
+    run_bounded,
+    setup_logging,
+    start_metrics_server,
+)
 
 
 dotenv.load_dotenv()
 
-with open("config.yaml", "r") as f:
+# Startup phases are logged with the seconds since this point
+STARTED_AT = time.perf_counter()
+
+CONFIG_PATH = "config.yaml"
+
+with open(CONFIG_PATH, "r") as f:
     config = yaml.safe_load(f)
 
 MODDELMSG_MAX_HOURS = config.get("moddelmsg", {}).get("max_hours", 24)
@@ -43,17 +95,202 @@ MODDELMSG_QUARANTINE_CHANNELID = config.get("moddelmsg", {}).get(
 MODDELMSG_QUARANTINE_WRITEPERMISSION_ROLEID = config.get("moddelmsg", {}).get(
     "quarantine_writepermission_roleid", 0
 )
+MODDELMSG_SCAN_CONCURRENCY = config.get("moddelmsg", {}).get("scan_concurrency", 4)
+MODDELMSG_PROGRESS_INTERVAL_SECONDS = config.get("moddelmsg", {}).get(
+    "progress_interval_seconds", 2
+)
+MODDELMSG_INDEX_MAX_MESSAGES_PER_USER = config.get("moddelmsg", {}).get(
+    "index_max_messages_per_user", 200
+)
+MODDELMSG_INDEX_MAX_MESSAGES = config.get("moddelmsg", {}).get(
+    "index_max_messages", 200000
+)
+MODQUARANTINE_CONCURRENCY = config.get("moddelmsg", {}).get("quarantine_concurrency", 4)
+AUTOMOD_COALESCE_SECONDS = config.get("moddelmsg", {}).get(
+    "automod_coalesce_seconds", 5
+)
 ATTACHMENT_COOLDOWN_ROLEID = config.get("moddelmsg", {}).get(
     "attachment_cooldown_roleid", 0
 )
 ATTACHMENT_COOLDOWN_DURATION_SECONDS = config.get("moddelmsg", {}).get(
     "attachment_cooldown_duration_seconds", 10
 )
+ATTACHMENT_COOLDOWN_TIMERS_PATH = config.get("moddelmsg", {}).get(
+    "attachment_cooldown_timers_path", None
+)
+MODDELMSG_LOG_WINDOW_SECONDS = config.get("moddelmsg", {}).get("log_window_seconds", 2)
+EVIDENCE_SPOOL_THRESHOLD_MEGABYTES = config.get("moddelmsg", {}).get(
+    "evidence_spool_threshold_megabytes", 1
+)
+EVIDENCE_MAX_MEMORY_MEGABYTES = config.get("moddelmsg", {}).get(
+    "evidence_max_memory_megabytes", 32
+)
+EVIDENCE_MAX_DISK_MEGABYTES = config.get("moddelmsg", {}).get(
+    "evidence_max_disk_megabytes", 256
+)
+EVIDENCE_DIRECTORY = config.get("moddelmsg", {}).get("evidence_directory", None)
+EVIDENCE_DOWNLOAD_WAIT_SECONDS = config.get("moddelmsg", {}).get(
+    "evidence_download_wait_seconds", 3
+)
+MODERATION_QUEUE_WORKERS = config.get("moddelmsg", {}).get("queue_workers", 4)
+MODERATION_QUEUE_MAX_SIZE = config.get("moddelmsg", {}).get("queue_max_size", 200)
+
+LOGGING_LEVEL = config.get("logging", {}).get("level", "INFO")
+LOGGING_SAMPLE_RATES = config.get("logging", {}).get("sample_rates", {})
+
+METRICS_HOST = config.get("metrics", {}).get("host", "127.0.0.1")
+METRICS_PORT = config.get("metrics", {}).get("port", None)
+
+RELOAD_POLL_SECONDS = config.get("reload", {}).get("poll_seconds", 10)
+
+STARTUP_GUILD_CONCURRENCY = config.get("startup", {}).get("guild_concurrency", 4)
+STARTUP_COMMAND_HASHES_PATH = config.get("startup", {}).get("command_hashes_path", None)
+
+MODSUSEDITS_INDEX_PATH = config.get("modsusedits", {}).get("index_path", None)
+MODSUSEDITS_SCAN_CONCURRENCY = config.get("modsusedits", {}).get("scan_concurrency", 4)
+
+SCAMDETECT_OCR_BACKEND = config.get("scamdetect", {}).get("ocr_backend", "pytesseract")
+SCAMDETECT_OCR_WORKERS = config.get("scamdetect", {}).get("ocr_workers", 2)
+SCAMDETECT_OCR_QUEUE_SIZE = config.get("scamdetect", {}).get("ocr_queue_size", 16)
+SCAMDETECT_OCR_TIMEOUT_SECONDS = config.get("scamdetect", {}).get(
+    "ocr_timeout_seconds", 30
+)
+SCAMDETECT_OCR_QUEUE_TIMEOUT_SECONDS = config.get("scamdetect", {}).get(
+    "ocr_queue_timeout_seconds", 60
+)
+SCAMDETECT_SCAN_RETRIES = config.get("scamdetect", {}).get("scan_retries", 3)
+SCAMDETECT_SCAN_RETRY_SECONDS = config.get("scamdetect", {}).get(
+    "scan_retry_seconds", 10
+)
+SCAMDETECT_CACHE_MAX_ENTRIES = config.get("scamdetect", {}).get(
+    "cache_max_entries", 4096
+)
+SCAMDETECT_CACHE_TTL_HOURS = config.get("scamdetect", {}).get("cache_ttl_hours", 168)
+SCAMDETECT_CACHE_PATH = config.get("scamdetect", {}).get("cache_path", None)
+SCAMDETECT_MAX_ATTACHMENTS = config.get("scamdetect", {}).get("max_attachments", 10)
+SCAMDETECT_MAX_IMAGE_MEGABYTES = config.get("scamdetect", {}).get(
+    "max_image_megabytes", 8
+)
+SCAMDETECT_MAX_IMAGE_MEGAPIXELS = config.get("scamdetect", {}).get(
+    "max_image_megapixels", 16
+)
+SCAMDETECT_PREVIEW_MAX_DIMENSION = config.get("scamdetect", {}).get(
+    "preview_max_dimension", 2048
+)
+SCAMDETECT_PIPELINES = config.get("scamdetect", {}).get("pipelines", {})
+SCAMDETECT_PHASH_INDEX_PATH = config.get("scamdetect", {}).get("phash_index_path", None)
+SCAMDETECT_PHASH_MAX_DISTANCE = config.get("scamdetect", {}).get(
+    "phash_max_distance", 12
+)
+
+# JSON lines on stdout, written by a background thread started in setup()
+LOG_LISTENER: logging.handlers.QueueListener
+log = logging.getLogger("bot")
+
+# All forbidden regexes are checked with one pass over each message
+FORBIDDEN_REGEX_MATCHER = PatternListMatcher(
+    config.get("moddelmsg", {}).get("forbidden_regexes", []),
+    flags=re.IGNORECASE | re.MULTILINE,
+)
+
+# Where users posted within the time window of /moddelmsg
+RECENT_MESSAGES = RecentMessageIndex(
+    max_messages_per_user=MODDELMSG_INDEX_MAX_MESSAGES_PER_USER,
+    max_messages=MODDELMSG_INDEX_MAX_MESSAGES,
+    max_age=timedelta(hours=MODDELMSG_MAX_HOURS),
+)
+
+# Messages that were edited, and up to where each channel was scanned. Opened
+# in setup().
+EDIT_INDEX: EditIndex
+
+# Metrics of the hot paths, served in the Prometheus text format on
+# METRICS_PORT. Gauges of the queues and stores are defined with them.
+MESSAGE_HANDLER_SECONDS = Histogram(
+    "automod_message_handler_seconds", "Time spent in the message event handler"
+)
+MESSAGE_SECONDS = Histogram(
+    "automod_message_seconds",
+    "Time from receiving a message until it was found clean or forbidden",
+    ("result",),
+)
+REGEX_SECONDS = Histogram(
+    "automod_regex_seconds", "Time spent matching the forbidden regexes"
+)
+SCAN_STAGE_SECONDS = Histogram(
+    "scamdetect_stage_seconds",
+    "Time spent per attachment scan in downloads and OCR passes",
+    ("stage",),
+)
+SCANS = Counter(
+    "scamdetect_scans_total",
+    "Attachment scans by result and whether a second pass was needed",
+    ("result", "second_pass"),
+)
+ACTION_SECONDS = Histogram(
+    "automod_action_seconds", "Duration of automod requests to Discord", ("action",)
+)
+ACTION_ERRORS = Counter(
+    "automod_action_errors_total", "Failed automod requests to Discord", ("action",)
+)
+MODDELMSG_SECONDS = Histogram(
+    "moddelmsg_seconds",
+    "Runtime of /moddelmsg",
+    buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0),
+)
+MODDELMSG_DELETED = Counter(
+    "moddelmsg_deleted_messages_total", "Messages deleted by /moddelmsg"
+)
+RATE_LIMITS = Counter(
+    "discord_rate_limits_total", "Requests that Discord answered with 429"
+)
+RELOADS = Counter(
+    "config_reloads_total", "Reloads of the configuration", labels=("result",)
+)
+Gauge(
+    "automod_queue_depth",
+    "Jobs waiting in the moderation work queue",
+    function=lambda: MODERATION_QUEUE.depth,
+)
+Gauge(
+    "automod_queue_wait_seconds",
+    "Moving average of the time jobs waited in the moderation work queue",
+    function=lambda: MODERATION_QUEUE.wait_seconds,
+)
+Counter(
+    "automod_queue_dropped_total",
+    "Jobs dropped because the moderation work queue was full",
+    labels=("priority",),
+    function=lambda: {
+        (PRIORITY_NAMES.get(priority, str(priority)),): count
+        for priority, count in MODERATION_QUEUE.shed_by_priority.items()
+    },
+)
+Counter(
+    "automod_queue_overflow_total",
+    "Urgent jobs queued beyond the size of the full moderation work queue",
+    function=lambda: MODERATION_QUEUE.overflow_count,
+)
+Gauge(
+    "automod_evidence_memory_bytes",
+    "Attachments kept in memory as evidence",
+    function=lambda: EVIDENCE.memory_bytes,
+)
+Gauge(
+    "automod_evidence_disk_bytes",
+    "Attachments kept on disk as evidence",
+    function=lambda: EVIDENCE.disk_bytes,
+)
+
+
+# discord.py retries rate limited requests itself and only logs a warning.
+# Every 429 is logged as "responded with 429", a global one additionally as
+# "Global rate limit has been hit", which must not count again.
+class RateLimitCounter(logging.Handler):
+    def emit(self, record: logging.LogRecord):
+        if "responded with 429" in str(record.msg):
+            RATE_LIMITS.inc()
 
-FORBIDDEN_REGEXES = [
-    re.compile(pattern, flags=re.IGNORECASE | re.MULTILINE)
-    for pattern in config.get("moddelmsg", {}).get("forbidden_regexes", [])
-]
 
 intents = discord.Intents.default()
 intents.message_content = True
@@ -63,115 +300,176 @@ client = discord.Client(intents=intents)
 tree = discord_command.CommandTree(client)
 
 
-async def setup_guild(guild: discord.Guild):
+# Loaded in setup()
+COMMAND_SYNC: CommandSyncCache
+
+# Guilds that were set up by this process. on_ready runs again after the bot
+# reconnected, which must not set up a guild twice.
+SETUP_GUILD_IDS: set[int] = set()
+
+
+# Returns whether the guild was set up
+async def setup_guild(guild: discord.Guild) -> bool:
+    started_at = time.perf_counter()
     tree.copy_global_to(guild=guild)
-    commands = await tree.sync(guild=guild)
-    print(f"Synced {len(commands)} commands: {', '.join([c.name for c in commands])}")
-    # Make sure nobody still has the attachment cooldown role
     try:
-        role = guild.get_role(ATTACHMENT_COOLDOWN_ROLEID)
-        if role:
-            count = len(role.members)
-            for member in role.members:
-                await member.remove_roles(
-                    role, reason="Role removal at moderation bot startup"
-                )
-            if count > 0:
-                print(f"Removed the attachment cooldown role from {count} members")
-    except discord.Forbidden:
-        print(
-            "Error: Failed to remove attachment cooldown role from all members: Missing permissions"
-        )
-    except Exception as e:
-        print(f"Error: Failed to remove attachment cooldown role from all members: {e}")
+        synced = await COMMAND_SYNC.sync(tree, guild)
+    except discord.HTTPException as e:
+        log.error("Failed to sync commands: %s", e, extra={"guild_id": guild.id})
+        return False
+    log.info(
+        "Synced commands" if synced else "Commands are unchanged, skipped the sync",
+        extra={
+            "guild_id": guild.id,
+            "event": "startup.commands",
+            "synced": synced,
+            "seconds": time.perf_counter() - started_at,
+            "commands": [c.name for c in tree.get_commands(guild=guild)],
+        },
+    )
+    # Pending cooldowns continue where they were before the restart. Members
+    # that have the role without a pending cooldown lose it right away.
+    started_at = time.perf_counter()
+    role = guild.get_role(ATTACHMENT_COOLDOWN_ROLEID)
+    if role:
+        timers = [
+            (
+                attachment_cooldown_key(member),
+                0,
+                {"guild_id": guild.id, "user_id": member.id},
+            )
+            for member in role.members
+            if attachment_cooldown_key(member) not in ATTACHMENT_COOLDOWN_TIMERS
+        ]
+        ATTACHMENT_COOLDOWN_TIMERS.schedule_many(timers)
+        if timers:
+            log.info(
+                "Removing the attachment cooldown role from %d members",
+                len(timers),
+                extra={
+                    "guild_id": guild.id,
+                    "event": "startup.cooldowns",
+                    "seconds": time.perf_counter() - started_at,
+                },
+            )
+    return True
+
+
+# Sets up the guilds that weren't set up yet, a few at a time
+async def setup_guilds(guilds: list[discord.Guild]):
+    guilds = [guild for guild in guilds if guild.id not in SETUP_GUILD_IDS]
+    if not guilds:
+        return
+    SETUP_GUILD_IDS.update(guild.id for guild in guilds)
+    started_at = time.perf_counter()
+    results = await run_bounded(guilds, setup_guild, STARTUP_GUILD_CONCURRENCY)
+    # Failed guilds are set up again with the next on_ready
+    failed = [guild.id for guild, success in zip(guilds, results) if not success]
+    SETUP_GUILD_IDS.difference_update(failed)
+    log.info(
+        "Set up %d of %d guilds",
+        len(guilds) - len(failed),
+        len(guilds),
+        extra={
+            "event": "startup.guilds",
+            "seconds": time.perf_counter() - started_at,
+            "seconds_since_start": time.perf_counter() - STARTED_AT,
+            "failed_guild_ids": failed,
+        },
+    )
 
 
+# The roles are changed with a single member edit, so a member is either
+# quarantined completely or not at all. Returns whether it succeeded.
 async def quarantine_user(
     user: discord.Member,
     *,
     with_write_permission: bool = False,
     reason: str | None = None,
-):
-    try:
-        role_to_remove = user.guild.get_role(MODDELMSG_TIMEOUT_REMOVE_ROLEID)
-        if role_to_remove and role_to_remove in user.roles:
-            await user.remove_roles(role_to_remove, reason="User was quarantined")
-    except discord.Forbidden:
-        print("Error: Failed to remove a role during quarantine: Missing permissions")
-    except Exception as e:
-        print(f"Error: Failed to remove a role during quarantine: {e}")
+) -> bool:
+    roles_to_give = [user.guild.get_role(MODDELMSG_QUARANTINE_ROLEID)]
+    if with_write_permission:
+        roles_to_give.append(
+            user.guild.get_role(MODDELMSG_QUARANTINE_WRITEPERMISSION_ROLEID)
+        )
     try:
-        role_to_give = user.guild.get_role(MODDELMSG_QUARANTINE_ROLEID)
-        if role_to_give and role_to_give not in user.roles:
-            await user.add_roles(
-                role_to_give, reason="User was quarantined" if not reason else reason
-            )
+        await edit_roles(
+            user,
+            add=roles_to_give,
+            remove=[user.guild.get_role(MODDELMSG_TIMEOUT_REMOVE_ROLEID)],
+            reason="User was quarantined" if not reason else reason,
+        )
+        return True
     except discord.Forbidden:
-        print("Error: Failed to add quarantine role: Missing permissions")
+        log.error(
+            "Failed to quarantine user: Missing permissions",
+            extra={"guild_id": user.guild.id, "user_id": user.id},
+        )
     except Exception as e:
-        print(f"Error: Failed to add quarantine role: {e}")
-    if with_write_permission:
-        try:
-            role_to_give = user.guild.get_role(
-                MODDELMSG_QUARANTINE_WRITEPERMISSION_ROLEID
-            )
-            if role_to_give and role_to_give not in user.roles:
-                await user.add_roles(
-                    role_to_give,
-                    reason=("User was quarantined with write permission"),
-                )
-        except discord.Forbidden:
-            print(
-                "Error: Failed to add quarantine write permission role: Missing permissions"
-            )
-        except Exception as e:
-            print(f"Error: Failed to add quarantine write permission role: {e}")
+        log.error(
+            "Failed to quarantine user: %s",
+            e,
+            extra={"guild_id": user.guild.id, "user_id": user.id},
+        )
+    return False
+
+
+# Quarantines many members at once, e.g. during a raid, with at most
+# MODQUARANTINE_CONCURRENCY member edits at a time.
+async def quarantine_users(
+    users: list[discord.Member],
+    *,
+    with_write_permission: bool = False,
+    reason: str | None = None,
+) -> list[bool]:
+    return await run_bounded(
+        users,
+        lambda user: quarantine_user(
+            user, with_write_permission=with_write_permission, reason=reason
+        ),
+        concurrency=MODQUARANTINE_CONCURRENCY,
+    )
 
 
 async def unquarantine_user(
     user: discord.Member, *, reason: str | None = None
 ) -> tuple[bool, bool]:
-    success_count = 0
-    had_role = False
+    role_to_remove = user.guild.get_role(MODDELMSG_QUARANTINE_ROLEID)
+    member = user.guild.get_member(user.id) or user
+    had_role = role_to_remove is not None and role_to_remove in member.roles
     try:
-        role_to_remove = user.guild.get_role(MODDELMSG_QUARANTINE_ROLEID)
-        if role_to_remove and role_to_remove in user.roles:
-            had_role = True
-            await user.remove_roles(
+        await edit_roles(
+            user,
+            add=[user.guild.get_role(MODDELMSG_TIMEOUT_REMOVE_ROLEID)],
+            remove=[
                 role_to_remove,
-                reason="User was unquarantined" if not reason else reason,
-            )
-            success_count += 1
-    except discord.Forbidden:
-        print("Error: Failed to remove quarantine role: Missing permissions")
-    except Exception as e:
-        print(f"Error: Failed to remove quarantine role: {e}")
-    try:
-        role_to_give = user.guild.get_role(MODDELMSG_TIMEOUT_REMOVE_ROLEID)
-        if role_to_give and role_to_give not in user.roles:
-            await user.add_roles(role_to_give, reason="User was unquarantined")
-            success_count += 1
-    except discord.Forbidden:
-        print("Error: Failed to add a role during unquarantine: Missing permissions")
-    except Exception as e:
-        print(f"Error: Failed to add a role during unquarantine: {e}")
-    # This one doesn't have to succeed, necessarily
-    try:
-        role_to_remove = user.guild.get_role(
-            MODDELMSG_QUARANTINE_WRITEPERMISSION_ROLEID
+                user.guild.get_role(MODDELMSG_QUARANTINE_WRITEPERMISSION_ROLEID),
+            ],
+            reason="User was unquarantined" if not reason else reason,
         )
-        if role_to_remove and role_to_remove in user.roles:
-            await user.remove_roles(
-                role_to_remove,
-                reason="User was unquarantined" if not reason else reason,
-            )
+        return had_role, True
     except discord.Forbidden:
-        print(
-            "Error: Failed to remove quarantine write permission role: Missing permissions"
+        log.error(
+            "Failed to unquarantine user: Missing permissions",
+            extra={"guild_id": user.guild.id, "user_id": user.id},
         )
     except Exception as e:
-        print(f"Error: Failed to remove quarantine write permission role: {e}")
-    return had_role, success_count == 2
+        log.error(
+            "Failed to unquarantine user: %s",
+            e,
+            extra={"guild_id": user.guild.id, "user_id": user.id},
+        )
+    return had_role, False
+
+
+# IDs of a message for structured log records
+def message_fields(message: discord.Message) -> dict:
+    return {
+        "guild_id": message.guild.id if message.guild else None,
+        "channel_id": message.channel.id,
+        "user_id": message.author.id,
+        "message_id": message.id,
+    }
 
 
 class FormattedMessage:
@@ -201,73 +499,344 @@ class FormattedMessage:
         return self.content
 
 
+METRICS_SERVER = None
+
+
+async def start_metrics():
+    global METRICS_SERVER
+    if METRICS_PORT is None or METRICS_SERVER is not None:
+        return
+    try:
+        METRICS_SERVER = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+        log.info("Serving metrics on http://%s:%d/metrics", METRICS_HOST, METRICS_PORT)
+    except OSError as e:
+        log.error("Failed to start the metrics server: %s", e)
+
+
+# The forbidden regexes, the scam phrases and the OCR pipelines can be changed
+# without a restart, with /modreload or by saving config.yaml or the
+# blacklist. Everything is read and compiled off the event loop and only
+# swapped in if all of it is valid. Other settings need a restart.
+RELOADABLE_SETTINGS = {("moddelmsg", "forbidden_regexes"), ("scamdetect", "pipelines")}
+RELOAD_LOCK = asyncio.Lock()
+
+
+# Raises OSError, ValueError or yaml.YAMLError if the file can't be used
+def read_reloadable_config(path: str) -> tuple[dict, PatternListMatcher]:
+    with open(path, "r") as f:
+        new_config = yaml.safe_load(f) or {}
+    if not isinstance(new_config, dict) or not all(
+        isinstance(section, dict) for section in new_config.values()
+    ):
+        raise ValueError(f"{path} must contain sections of settings")
+    patterns = new_config.get("moddelmsg", {}).get("forbidden_regexes", [])
+    if not isinstance(patterns, list) or not all(isinstance(p, str) for p in patterns):
+        raise ValueError("forbidden_regexes must be a list of strings")
+    if not isinstance(new_config.get("scamdetect", {}).get("pipelines", {}), dict):
+        raise ValueError("pipelines must map pipeline names to stages")
+    try:
+        matcher = PatternListMatcher(patterns, flags=re.IGNORECASE | re.MULTILINE)
+    except re.error as e:
+        raise ValueError(f"Invalid forbidden regex {e.pattern!r}: {e}") from e
+    return new_config, matcher
+
+
+# Settings that differ from the ones the bot was started with and that
+# don't take effect until a restart
+def settings_needing_restart(new_config: dict) -> list[str]:
+    changed = []
+    for section in sorted(set(config) | set(new_config)):
+        old_settings = config.get(section) or {}
+        new_settings = new_config.get(section) or {}
+        for key in sorted(set(old_settings) | set(new_settings)):
+            if (section, key) in RELOADABLE_SETTINGS:
+                continue
+            if old_settings.get(key) != new_settings.get(key):
+                changed.append(f"{section}.{key}")
+    return changed
+
+
+# Returns whether the reload succeeded and a message for the moderator
+async def reload_config() -> tuple[bool, str]:
+    global FORBIDDEN_REGEX_MATCHER
+    async with RELOAD_LOCK:
+        started_at = time.perf_counter()
+        # Files saved from now on are reloaded again by the watcher
+        CONFIG_WATCHER.poll()
+        try:
+            new_config, matcher = await asyncio.to_thread(
+                read_reloadable_config, CONFIG_PATH
+            )
+            phrases, phrase_matcher = await asyncio.to_thread(load_blacklist)
+            # Validates the pipelines before anything else is swapped in
+            configure_ocr_pipelines(
+                new_config.get("scamdetect", {}).get("pipelines", {})
+            )
+        except (OSError, ValueError, yaml.YAMLError) as e:
+            RELOADS.inc("failed")
+            log.error(
+                "Failed to reload, keeping the previous configuration: %s",
+                e,
+                extra={"event": "reload.failed"},
+            )
+            return False, f"Reload failed, nothing was changed: {e}"
+        FORBIDDEN_REGEX_MATCHER = matcher
+        configure_blacklist(phrases, phrase_matcher)
+        RELOADS.inc("success")
+        restart = settings_needing_restart(new_config)
+        message = (
+            f"Reloaded {len(matcher)} forbidden regexes and "
+            f"{len(phrases)} scam phrases."
+        )
+        if restart:
+            message += f" Changes that need a restart: {', '.join(restart)}"
+        log.info(
+            message,
+            extra={
+                "event": "reload",
+                "seconds": time.perf_counter() - started_at,
+                "needs_restart": restart,
+            },
+        )
+        return True, message
+
+
+async def reload_changed_files(paths: list[str]):
+    log.info("Files changed, reloading", extra={"paths": paths})
+    await reload_config()
+
+
+CONFIG_WATCHER = FileWatcher(
+    [CONFIG_PATH, BLACKLIST_PATH],
+    reload_changed_files,
+    interval_seconds=RELOAD_POLL_SECONDS,
+)
+
+
+@client.event
+async def on_connect():
+    log.info(
+        "Connected to Discord",
+        extra={
+            "event": "startup.connect",
+            "seconds_since_start": time.perf_counter() - STARTED_AT,
+        },
+    )
+
+
+# Automod doesn't wait for this: on_message handles messages as soon as they
+# arrive, also while the guilds are set up. Everything here may run more than
+# once, on_ready fires again after a reconnect.
 @client.event
 async def on_ready():
-    for guild in client.guilds:
-        await setup_guild(guild)
+    log.info(
+        "Received the guilds",
+        extra={
+            "event": "startup.ready",
+            "seconds_since_start": time.perf_counter() - STARTED_AT,
+            "guilds": len(client.guilds),
+        },
+    )
+    # Messages sent while the bot was disconnected are not in the index
+    RECENT_MESSAGES.mark_gap()
+    ATTACHMENT_COOLDOWN_TIMERS.start()
+    EDIT_INDEX.start()
+    start_ocr_cache()
+    CONFIG_WATCHER.start()
+    await start_metrics()
+    await setup_guilds(client.guilds)
+
+
+@dataclass
+class AutomodDetection:
+    message: discord.Message
+    formatted_message: FormattedMessage
+    mod_note: str | None
+    attachment_files: list[Evidence]
+
+
+# Log messages for the notify channel, sent in batches
+MOD_LOG = ModLogSink(window_seconds=MODDELMSG_LOG_WINDOW_SECONDS)
+
+
+def notify_user_of(guild: discord.Guild) -> discord.Member | None:
+    return guild.get_member(MODDELMSG_NOTIFY_USER_ID)
+
+
+# Logs all detections against a user within the coalescing window as one
+# entry. The same images are usually posted in every channel, the log sink
+# uploads them only once.
+async def send_automod_log(key: tuple[int, int], detections: list[AutomodDetection]):
+    first = detections[0].message
+    notify_channel = first.guild.get_channel(MODDELMSG_NOTIFY_CHANNELID)
+    if not notify_channel:
+        log.error("Notify channel not found", extra={"guild_id": first.guild.id})
+        for detection in detections:
+            for evidence in detection.attachment_files:
+                evidence.discard()
+        return
+    channels = []
+    notes = []
+    files = []
+    for detection in detections:
+        if detection.message.channel.mention not in channels:
+            channels.append(detection.message.channel.mention)
+        if detection.mod_note and detection.mod_note not in notes:
+            notes.append(detection.mod_note)
+        files.extend(detection.attachment_files)
+    channel_list = ", ".join(channels)
+    deleted_text = detections[0].formatted_message.pretty(shortened=True)
+    embed = discord.Embed(
+        title="🚨 [AUTOMOD] Forbidden content deleted",
+        description=(
+            (f"```{deleted_text}```\n" if len(deleted_text) > 0 else "")
+            + f"**Channel{"s" if len(channels) != 1 else ""}:** {channel_list}\n"
+            f"**Author:** {first.author.mention} / `{first.author.display_name}` / `{first.author.name}`\n"
+            f"**User ID:** `{first.author.id}`"
+            + (f"\n**Messages:** {len(detections)}" if len(detections) > 1 else "")
+            + "".join(f"\n**Note**: {note}" for note in notes)
+        ),
+        color=discord.Color.orange(),
+        timestamp=datetime.now(timezone.utc),
+    )
+    MOD_LOG.log(
+        notify_channel,
+        LogEntry(embed=embed, files=files),
+        ping=notify_user_of(first.guild),
+    )
+    log.info(
+        "Automod log entry queued",
+        extra={**message_fields(first), "message_count": len(detections)},
+    )
+
+
+# Attachments of scams that were downloaded by the scan, for the automod log
+EVIDENCE = EvidenceStore(
+    spool_threshold_bytes=EVIDENCE_SPOOL_THRESHOLD_MEGABYTES * 1024 * 1024,
+    max_memory_bytes=EVIDENCE_MAX_MEMORY_MEGABYTES * 1024 * 1024,
+    max_disk_bytes=EVIDENCE_MAX_DISK_MEGABYTES * 1024 * 1024,
+    directory=EVIDENCE_DIRECTORY,
+)
+
+
+def keep_evidence(attachments: list[discord.Attachment], downloaded: dict[int, bytes]):
+    for attachment in attachments:
+        if attachment.id in downloaded:
+            EVIDENCE.put(attachment.id, attachment.filename, downloaded[attachment.id])
+
+
+# Takes the attachments from the evidence store and downloads the ones that
+# aren't in it, all at the same time. Attachments that can't be downloaded
+# are left out.
+async def collect_evidence(attachments: list[discord.Attachment]) -> list[Evidence]:
+    async def collect(attachment: discord.Attachment) -> Evidence | None:
+        evidence = EVIDENCE.pop(attachment.id)
+        if evidence is not None:
+            return evidence
+        try:
+            with ACTION_SECONDS.time("evidence"):
+                data = await attachment.read()
+        except discord.HTTPException as e:
+            ACTION_ERRORS.inc("evidence")
+            log.warning(
+                "Failed to download %s as evidence: %s",
+                attachment.filename,
+                e,
+                extra={"attachment_id": attachment.id},
+            )
+            return None
+        return EVIDENCE.create(attachment.filename, data)
+
+    results = await asyncio.gather(*[collect(a) for a in attachments])
+    return [evidence for evidence in results if evidence is not None]
+
+
+# Moderation work that doesn't have to happen in the event handler. Deletes
+# and quarantines run before attachment scans, and those before log messages
+# and DMs. During a raid the least urgent work is dropped, see WorkQueue.
+MODERATION_QUEUE = WorkQueue(
+    workers=MODERATION_QUEUE_WORKERS, max_size=MODERATION_QUEUE_MAX_SIZE
+)
+
+
+# A scam bot usually posts the same message in many channels at once. Every
+# message is deleted, but the member is quarantined and notified only for
+# the first one, and all of them are logged together at the end of the window.
+AUTOMOD_ACTIONS = ActionCoalescer(send_automod_log, AUTOMOD_COALESCE_SECONDS)
 
 
 async def delete_message_and_quarantine_member(
-    message: discord.Message, mod_note: str | None = None
+    message: discord.Message,
+    mod_note: str | None = None,
+    scan_result: ScamScanResult | None = None,
 ):
-    # Get the attachments as files first
-    attachment_files = [await a.to_file() for a in message.attachments]
+    # Remember the images of confirmed scams, to recognize reposts instantly
+    if scan_result is not None and scan_result.is_scam:
+        count = remember_scam_images(scan_result.image_hashes)
+        if count > 0:
+            log.info("Added %d images to the known scam images", count)
 
-    # Delete the message
     formatted_message = FormattedMessage(message)
-    try:
-        await message.delete()
-        print(
-            f"[AUTOMOD] Deleted message from {message.author} ({message.author.id}) in #{message.channel.name}: {formatted_message.pretty()}"
-        )
-    except Exception as e:
-        print(f"[AUTOMOD] Failed to delete message: {e}")
 
-    # Notify in the log channel
-    try:
-        notify_channel = message.guild.get_channel(MODDELMSG_NOTIFY_CHANNELID)
-        if notify_channel:
-            embed = discord.Embed(
-                description=(
-                    f"**Channel:** {message.channel.mention}\n"
-                    f"**Author:** {message.author.mention} / `{message.author.display_name}` / `{message.author.name}`\n"
-                    f"**User ID:** `{message.author.id}`"
-                    + (
-                        f"\n**Note**: {mod_note}"
-                        if mod_note is not None and len(mod_note) > 0
-                        else ""
-                    )
-                ),
-                color=discord.Color.orange(),
-                timestamp=datetime.now(timezone.utc),
-            )
-            deleted_text = formatted_message.pretty(shortened=True)
-            await notify_channel.send(
-                f"🚨 **[AUTOMOD] Forbidden content deleted**"
-                + (f"\n```{deleted_text}```" if len(deleted_text) > 0 else ""),
-                embed=embed,
-                files=attachment_files,
+    async def delete():
+        try:
+            with ACTION_SECONDS.time("delete"):
+                await message.delete()
+            log.info(
+                "Automod deleted message",
+                extra={
+                    **message_fields(message),
+                    "event": "automod.delete",
+                    "content": formatted_message.shortened,
+                    "content_length": len(formatted_message.content),
+                },
             )
-            print("[AUTOMOD] Log embed sent to notify channel.")
-            # Ping the user that wants to get notified
-            notify_user = message.guild.get_member(MODDELMSG_NOTIFY_USER_ID)
-            if notify_user and notify_channel:
-                await notify_channel.send(
-                    f"{notify_user.mention} New moderation events."
-                )
-        else:
-            print("[AUTOMOD] Notify channel not found.")
-    except Exception as e:
-        print(f"[AUTOMOD] Failed to send log embed: {e}")
+        except Exception as e:
+            ACTION_ERRORS.inc("delete")
+            log.error("Failed to delete message: %s", e, extra=message_fields(message))
+
+    # Attachments that the scan didn't download, e.g. of messages with a
+    # forbidden regex, may not be available anymore once the message is
+    # deleted. The delete waits for their download, up to a limit.
+    must_download = any(a.id not in EVIDENCE for a in message.attachments)
+    evidence_task = asyncio.create_task(collect_evidence(message.attachments))
+    if must_download:
+        await asyncio.wait([evidence_task], timeout=EVIDENCE_DOWNLOAD_WAIT_SECONDS)
+    await delete()
+    attachment_files = await evidence_task
+
+    # Notify in the log channel, once the coalescing window is over
+    detection = AutomodDetection(message, formatted_message, mod_note, attachment_files)
+    if not AUTOMOD_ACTIONS.add((message.guild.id, message.author.id), detection):
+        log.info(
+            "Member was already quarantined for an earlier message",
+            extra=message_fields(message),
+        )
+        return
 
     # Add Quarantined role to the user
-    await quarantine_user(
-        message.author,
-        with_write_permission=True,
-        reason="Automod: Forbidden content detected",
+    with ACTION_SECONDS.time("quarantine"):
+        quarantined = await quarantine_user(
+            message.author,
+            with_write_permission=True,
+            reason="Automod: Forbidden content detected",
+        )
+    if not quarantined:
+        ACTION_ERRORS.inc("quarantine")
+
+    # DM the quarantined user, after more urgent work
+    MODERATION_QUEUE.submit(
+        PRIORITY_NOTIFY,
+        send_quarantine_dm,
+        message,
+        formatted_message,
+        message_id=message.id,
     )
 
-    # DM the quarantined user
+
+async def send_quarantine_dm(
+    message: discord.Message, formatted_message: FormattedMessage
+):
     try:
         message_text = formatted_message.pretty(shortened=True)
         dm_embed = discord.Embed(
@@ -289,77 +858,225 @@ async def delete_message_and_quarantine_member(
             name=message.guild.name,
             icon_url=message.guild.icon.url if message.guild.icon else None,
         )
-        await message.author.send(embed=dm_embed)
-        print("[AUTOMOD] DM sent to user.")
+        with ACTION_SECONDS.time("dm"):
+            await message.author.send(embed=dm_embed)
+        log.info("Quarantine DM sent", extra=message_fields(message))
     except Exception as e:
-        print(f"[AUTOMOD] Could not send DM to user: {e}")
+        ACTION_ERRORS.inc("dm")
+        log.warning(
+            "Could not send quarantine DM: %s", e, extra=message_fields(message)
+        )
 
 
-async def remove_attachment_cooldown_role(
-    user: discord.Member,
-    delay_seconds: int = 0,
-):
-    if delay_seconds > 0:
-        await asyncio.sleep(delay_seconds)
-    try:
-        role = user.guild.get_role(ATTACHMENT_COOLDOWN_ROLEID)
-        if role and role in user.roles:
-            await user.remove_roles(role, reason="Attachment cooldown ended")
-            print(f"Removed attachment cooldown role from {user.id}")
-    except discord.Forbidden:
-        print("Error: Failed to remove attachment cooldown role: Missing permissions")
-    except Exception as e:
-        print(f"Error: Failed to remove attachment cooldown role: {e}")
+def attachment_cooldown_key(user: discord.Member) -> str:
+    return f"{user.guild.id}:{user.id}"
+
+
+# Role changes that nobody has to wait for, applied in the background
+ROLE_ACTIONS = RoleActionQueue()
+# When the members in an attachment cooldown sent their last attachment. The
+# role may still be queued to be added, see ROLE_ACTIONS.
+ATTACHMENT_COOLDOWNS: dict[str, datetime] = {}
+
+
+# Called with all cooldowns that ended at the same time
+async def remove_attachment_cooldown_roles(expired: list[dict]):
+    for timer in expired:
+        ATTACHMENT_COOLDOWNS.pop(f"{timer['guild_id']}:{timer['user_id']}", None)
+        guild = client.get_guild(timer["guild_id"])
+        member = guild.get_member(timer["user_id"]) if guild else None
+        role = guild.get_role(ATTACHMENT_COOLDOWN_ROLEID) if guild else None
+        if member is not None and role is not None:
+            ROLE_ACTIONS.remove(member, role, reason="Attachment cooldown ended")
+            log.debug(
+                "Removing attachment cooldown role",
+                extra={"guild_id": guild.id, "user_id": member.id},
+            )
+
+
+# The cooldowns are saved to disk, so the role is removed on time even if
+# the bot restarts in between. Loaded in setup().
+ATTACHMENT_COOLDOWN_TIMERS: TimerScheduler
 
 
-async def give_attachment_cooldown_role(
+# Returns right away, the role is added in the background. If the cooldown
+# ends before that happened, the role is not added at all.
+def give_attachment_cooldown_role(
     user: discord.Member,
     duration_seconds: int,
 ):
-    try:
-        role = user.guild.get_role(ATTACHMENT_COOLDOWN_ROLEID)
-        if role and role not in user.roles:
-            await user.add_roles(role, reason="User sent an attachment recently")
-            print(f"Gave attachment cooldown role to {user.id}")
-            asyncio.create_task(remove_attachment_cooldown_role(user, duration_seconds))
-    except discord.Forbidden:
-        print("Error: Failed to add attachment cooldown role: Missing permissions")
-    except Exception as e:
-        print(f"Error: Failed to add attachment cooldown role: {e}")
+    role = user.guild.get_role(ATTACHMENT_COOLDOWN_ROLEID)
+    key = attachment_cooldown_key(user)
+    if not role or key in ATTACHMENT_COOLDOWNS or role in user.roles:
+        return
+    ATTACHMENT_COOLDOWNS[key] = datetime.now(timezone.utc)
+    # Scheduled first, so the role is removed even if the bot stops while
+    # the role is being added
+    ATTACHMENT_COOLDOWN_TIMERS.schedule(
+        key, duration_seconds, {"guild_id": user.guild.id, "user_id": user.id}
+    )
+    ROLE_ACTIONS.add(user, role, reason="User sent an attachment recently")
+    log.debug(
+        "Giving attachment cooldown role",
+        extra={"guild_id": user.guild.id, "user_id": user.id},
+    )
 
 
 @client.event
 async def on_message(message: discord.Message):
+    received_at = time.perf_counter()
+    try:
+        check_message(message, received_at)
+    finally:
+        MESSAGE_HANDLER_SECONDS.observe(time.perf_counter() - received_at)
+
+
+# The checks that are fast enough for the event handler, everything else is
+# queued on MODERATION_QUEUE
+def check_message(message: discord.Message, received_at: float):
     if message.author.bot:
         return
+    RECENT_MESSAGES.add(message)
 
     # Bypass if > or = bot's role (for mods)
     if isinstance(message.author, discord.Member):
         if message.author.top_role >= message.guild.me.top_role:
             return
 
-    # Give the attachment cooldown role, if this message has an attachment
+    # Give the attachment cooldown role, if this message has an attachment,
+    # without waiting for it before checking the content
     if len(message.attachments) > 0:
-        await give_attachment_cooldown_role(
+        give_attachment_cooldown_role(
             message.author, max(1, min(120, ATTACHMENT_COOLDOWN_DURATION_SECONDS))
         )
 
-    for pattern in FORBIDDEN_REGEXES:
-        if pattern.search(message.content):
-            await delete_message_and_quarantine_member(
-                message, mod_note=f"Matched pattern: {pattern.pattern}"
-            )
-            return
+    with REGEX_SECONDS.time():
+        pattern = FORBIDDEN_REGEX_MATCHER.first_match(message.content)
+    if pattern is not None:
+        MESSAGE_SECONDS.observe(time.perf_counter() - received_at, "forbidden")
+        MODERATION_QUEUE.submit(
+            PRIORITY_ENFORCE,
+            delete_message_and_quarantine_member,
+            message,
+            f"Matched pattern: {pattern.pattern}",
+            message_id=message.id,
+        )
+        return
 
     if len(message.attachments) > 0:
-        result = await scan_discord_attachments_for_scams(message.attachments)
-        if result.is_scam:
+        MODERATION_QUEUE.submit(
+            PRIORITY_SCAN,
+            scan_message_attachments,
+            message,
+            received_at,
+            message_id=message.id,
+        )
+    else:
+        MESSAGE_SECONDS.observe(time.perf_counter() - received_at, "clean")
+
+
+async def scan_message_attachments(
+    message: discord.Message, received_at: float, attempt: int = 0
+):
+    # Skip the enhanced OCR pass while the queue is backing up, so that the
+    # workers catch up with the raid instead of falling further behind
+    enhanced_pass = not MODERATION_QUEUE.busy
+    if not enhanced_pass:
+        log.warning(
+            "Work queue is busy, skipping the enhanced OCR pass",
+            extra={
+                **message_fields(message),
+                "event": "automod.degraded",
+                **MODERATION_QUEUE.stats(),
+            },
+        )
+    # The downloads are kept as evidence only if the message is deleted
+    downloaded: dict[int, bytes] = {}
+    result = await scan_discord_attachments_for_scams(
+        message.attachments,
+        enhanced_pass=enhanced_pass,
+        on_download=lambda attachment, data: downloaded.update({attachment.id: data}),
+    )
+    for stage, seconds in result.timings.items():
+        SCAN_STAGE_SECONDS.observe(seconds, stage)
+    if result.known_image_distance is not None:
+        scan_result = "known_image"
+    elif result.is_scam:
+        scan_result = "scam"
+    else:
+        scan_result = "incomplete" if result.unscanned > 0 else "clean"
+    SCANS.inc(scan_result, str("second_pass" in result.timings).lower())
+    # Images that the overloaded OCR workers didn't get to are scanned again
+    # later. Those that were scanned come from the OCR cache then.
+    if scan_result == "incomplete":
+        fields = {
+            **message_fields(message),
+            "event": "automod.scan_incomplete",
+            "unscanned": result.unscanned,
+            "attempt": attempt,
+        }
+        if attempt < SCAMDETECT_SCAN_RETRIES:
+            log.warning("Scan was incomplete, retrying later", extra=fields)
+            asyncio.get_running_loop().call_later(
+                SCAMDETECT_SCAN_RETRY_SECONDS * (attempt + 1),
+                functools.partial(MODERATION_QUEUE.submit, message_id=message.id),
+                PRIORITY_SCAN,
+                scan_message_attachments,
+                message,
+                received_at,
+                attempt + 1,
+            )
+            return
+        log.error("Gave up scanning the attachments of a message", extra=fields)
+    MESSAGE_SECONDS.observe(
+        time.perf_counter() - received_at, "forbidden" if result.is_scam else "clean"
+    )
+    if result.is_scam:
+        if result.known_image_distance is not None:
+            note = (
+                f"Scam detected with a known scam image "
+                f"(distance {result.known_image_distance}) and phrases: "
+                f"{', '.join(result.phrases)}"
+            )
+        else:
             note = (
                 f"Scam detected with phrases: {', '.join(result.phrases)} "
                 f"({len(result.phrases)} phrases)"
             )
-            print(f"[AUTOMOD] {note}")
-            await delete_message_and_quarantine_member(message, mod_note=note)
+        log.info(note, extra={**message_fields(message), "timings": result.timings})
+        keep_evidence(message.attachments, downloaded)
+        await delete_message_and_quarantine_member(
+            message, mod_note=note, scan_result=result
+        )
+
+
+@client.event
+async def on_raw_message_edit(payload: discord.RawMessageUpdateEvent):
+    EDIT_INDEX.record_edit(payload.message)
+    # Also indexes messages that were sent before the bot started
+    if not payload.message.author.bot:
+        RECENT_MESSAGES.add(payload.message)
+
+
+@client.event
+async def on_message_delete(message: discord.Message):
+    RECENT_MESSAGES.remove(message.author.id, message.id)
+
+
+@client.event
+async def on_bulk_message_delete(messages: list[discord.Message]):
+    for message in messages:
+        RECENT_MESSAGES.remove(message.author.id, message.id)
+
+
+@client.event
+async def on_raw_message_delete(payload: discord.RawMessageDeleteEvent):
+    EDIT_INDEX.remove([payload.message_id])
+
+
+@client.event
+async def on_raw_bulk_message_delete(payload: discord.RawBulkMessageDeleteEvent):
+    EDIT_INDEX.remove(list(payload.message_ids))
 
 
 @tree.command(
@@ -377,6 +1094,7 @@ async def moddelmsg(
     hours: int = MODDELMSG_DEFAULT_HOURS,
     timeout_hours: int = MODDELMSG_DEFAULT_TIMEOUT_HOURS,
 ):
+    started_at = time.perf_counter()
     await interaction.response.defer(ephemeral=True)
 
     command_user: discord.Member = interaction.user
@@ -411,30 +1129,95 @@ async def moddelmsg(
     deleted_messages = []
     notify_channel = interaction.guild.get_channel(MODDELMSG_NOTIFY_CHANNELID)
 
-    # Delete specified messages in all of the guild's channels
+    def is_user_message(message: discord.Message) -> bool:
+        # Do not delete welcome messages
+        return (
+            message.author.id == user.id
+            and message.type != discord.MessageType.new_member
+        )
+
+    last_progress_time = 0.0
+
+    async def report_progress(progress: PurgeProgress):
+        nonlocal last_progress_time
+        # Editing the response is rate limited as well
+        now = asyncio.get_running_loop().time()
+        if now - last_progress_time < MODDELMSG_PROGRESS_INTERVAL_SECONDS:
+            return
+        last_progress_time = now
+        await interaction.edit_original_response(
+            content=f"Scanned {progress.channels_scanned} of {progress.channels_total} channels, deleted {progress.messages_deleted} of {progress.messages_found} messages..."
+        )
+
+    # Messages that the bot has seen since it started are deleted straight
+    # from the recent message index. Only the part of the time window that
+    # the index doesn't cover is scanned in the history of every channel.
+    gap_before = RECENT_MESSAGES.gap_before(user.id)
+    cached_messages = {message.id: message for message in client.cached_messages}
+    messages_by_channel = {}
+    for channel_id, message_id in RECENT_MESSAGES.messages(
+        user.id, after=max(cutoff_time, gap_before)
+    ):
+        channel = interaction.guild.get_channel_or_thread(channel_id)
+        if channel is None:
+            continue  # the channel was deleted or belongs to another guild
+        message = cached_messages.get(message_id)
+        if message is None:
+            message = channel.get_partial_message(message_id)
+        messages_by_channel.setdefault(channel, []).append(message)
+
+    # The channels are scanned concurrently and the messages of each channel
+    # are deleted in bulk.
+    reason = f"Messages deleted by {command_user.name}"
     try:
-        for channel in interaction.guild.text_channels:
-            try:
-                async for message in channel.history(limit=100, after=cutoff_time):
-                    if message.author.id != user.id:
-                        continue
-                    if message.type == discord.MessageType.new_member:
-                        continue  # do not delete welcome messages
-
-                    formatted_message = FormattedMessage(message)
-                    deleted_messages.append((channel.name, formatted_message.shortened))
-
-                    await message.delete()
-                    print(
-                        f"Deleted message from {user} ({user.id}) in #{channel.name}: {formatted_message.pretty()}"
-                    )
-                    await asyncio.sleep(0.2)  # avoid rate limits
-            except discord.Forbidden:
-                continue  # skip channels the bot can't access
+        results = await delete_known_messages(
+            messages_by_channel,
+            concurrency=MODDELMSG_SCAN_CONCURRENCY,
+            reason=reason,
+        )
+        if gap_before > cutoff_time:
+            results += await purge_channels(
+                interaction.guild.text_channels,
+                is_user_message,
+                cutoff_time,
+                before=gap_before,
+                concurrency=MODDELMSG_SCAN_CONCURRENCY,
+                reason=reason,
+                on_progress=report_progress,
+            )
     except Exception as e:
-        return await interaction.followup.send(
-            f"Error deleting messages: {e}", ephemeral=True
+        return await interaction.edit_original_response(
+            content=f"Error deleting messages: {e}"
         )
+    for result in results:
+        if result.error and result.error != "Missing permissions":
+            # Channels the bot can't access are skipped
+            log.error(
+                "Failed to delete messages in #%s: %s",
+                result.channel.name,
+                result.error,
+                extra={"guild_id": user.guild.id, "channel_id": result.channel.id},
+            )
+        for message in result.messages:
+            RECENT_MESSAGES.remove(user.id, message.id)
+            if isinstance(message, discord.Message):
+                shortened = FormattedMessage(message).shortened
+            else:
+                shortened = "(message content not cached)"
+            deleted_messages.append((result.channel.name, shortened))
+            log.info(
+                "Deleted message",
+                extra={
+                    "event": "moddelmsg.delete",
+                    "guild_id": user.guild.id,
+                    "channel_id": result.channel.id,
+                    "user_id": user.id,
+                    "message_id": message.id,
+                    "content": shortened,
+                },
+            )
+    MODDELMSG_SECONDS.observe(time.perf_counter() - started_at)
+    MODDELMSG_DELETED.inc(amount=len(deleted_messages))
 
     log_text = (
         f"Deleted {len(deleted_messages)} message{"s" if len(deleted_messages) != 1 else ""} from {user.mention} that were sent within the last {hours_to_use} hour{"s" if hours_to_use != 1 else ""}. "
@@ -445,44 +1228,34 @@ async def moddelmsg(
         )
     )
 
-    await interaction.followup.send(log_text, ephemeral=True)
+    await interaction.edit_original_response(content=log_text)
 
     if len(deleted_messages) == 0 and timeout_hours == 0:
         return
 
-    if notify_channel:
-        await notify_channel.send(
-            log_text + f" Performed by {command_user.mention}.",
-            allowed_mentions=discord.AllowedMentions(users=[]),
+    if not notify_channel:
+        return
+    entry = LogEntry(content=log_text + f" Performed by {command_user.mention}.")
+    if deleted_messages:
+        message_lines = [
+            f"`#{channel}` {re.sub(r'\s+', ' ', content)}"
+            for channel, content in deleted_messages
+        ]
+        max_chars = 4000  # limit for embed fields
+
+        message_text = "\n".join(message_lines)
+        if len(message_text) > max_chars:
+            message_text = message_text[: max_chars - 20] + "... (truncated)"
+
+        entry.embed = discord.Embed(
+            title=f"Log of deleted messages",
+            description=message_text,
+            color=discord.Color.orange(),
+            timestamp=datetime.now(timezone.utc),
         )
-
-    if notify_channel and deleted_messages:
-        try:
-            message_lines = [
-                f"`#{channel}` {re.sub(r'\s+', ' ', content)}"
-                for channel, content in deleted_messages
-            ]
-            max_chars = 4000  # limit for embed fields
-
-            message_text = "\n".join(message_lines)
-            if len(message_text) > max_chars:
-                message_text = message_text[: max_chars - 20] + "... (truncated)"
-
-            embed = discord.Embed(
-                title=f"Log of deleted messages",
-                description=message_text,
-                color=discord.Color.orange(),
-                timestamp=datetime.now(timezone.utc),
-            )
-            embed.set_footer(text=f"User ID: {user.id}")
-            await notify_channel.send(embed=embed)
-        except Exception as e:
-            print(f"Failed to send log embed: {e}")
-
-    # Ping the user that wants to get notified
-    notify_user = interaction.guild.get_member(MODDELMSG_NOTIFY_USER_ID)
-    if notify_user and notify_channel:
-        await notify_channel.send(f"{notify_user.mention} New moderation events.")
+        entry.embed.set_footer(text=f"User ID: {user.id}")
+    # Pings the user that wants to get notified
+    MOD_LOG.log(notify_channel, entry, ping=notify_user_of(interaction.guild))
 
 
 @tree.command(
@@ -515,6 +1288,56 @@ async def modunquarantine(interaction: discord.Interaction, user: discord.Member
     )
 
 
+@tree.command(
+    name="modquarantine",
+    description="Quarantine several users at once.",
+)
+@discord_command.describe(
+    users="Mentions or IDs of the users to quarantine, separated by spaces",
+)
+async def modquarantine(interaction: discord.Interaction, users: str):
+    await interaction.response.defer(ephemeral=True)
+
+    command_user: discord.Member = interaction.user
+    members = []
+    skipped = 0
+    for user_id in dict.fromkeys(int(i) for i in re.findall(r"\d{15,20}", users)):
+        member = interaction.guild.get_member(user_id)
+        # Role hierarchy check
+        if member is None or member.top_role >= command_user.top_role:
+            skipped += 1
+            continue
+        members.append(member)
+
+    results = await quarantine_users(
+        members, reason=f"Quarantined by {command_user.name}"
+    )
+    quarantined = [member for member, success in zip(members, results) if success]
+    log_text = f"Quarantined {len(quarantined)} of {len(members)} user{"s" if len(members) != 1 else ""}"
+    if skipped > 0:
+        log_text += f", skipped {skipped} unknown or higher ranked user{"s" if skipped != 1 else ""}"
+    log_text += "."
+    log.info(
+        log_text,
+        extra={
+            "guild_id": interaction.guild.id,
+            "user_ids": [member.id for member in quarantined],
+        },
+    )
+    await interaction.followup.send(log_text, ephemeral=True)
+
+    notify_channel = interaction.guild.get_channel(MODDELMSG_NOTIFY_CHANNELID)
+    if notify_channel and quarantined:
+        MOD_LOG.log(
+            notify_channel,
+            LogEntry(
+                content=log_text
+                + f" Performed by {command_user.mention}: "
+                + " ".join(member.mention for member in quarantined)
+            ),
+        )
+
+
 @tree.command(
     name="modsusedits",
     description="Scan server messages for edits made more than N hours after sending.",
@@ -522,12 +1345,17 @@ async def modunquarantine(interaction: discord.Interaction, user: discord.Member
 @discord_command.describe(
     hours="Number of hours between send and edit to count (default is 8).",
     start_channel_id="The ID of the channel to start at. Any channels that would come before it are skipped.",
+    scan="Scan the channels for new messages first (default). Otherwise only the edit index is searched.",
 )
 async def modsusedits(
-    interaction: discord.Interaction, hours: int = 8, start_channel_id: str = "0"
+    interaction: discord.Interaction,
+    hours: int = 8,
+    start_channel_id: str = "0",
+    scan: bool = True,
 ):
     await interaction.response.send_message(
-        "Searching... this may take a while.", ephemeral=False
+        "Searching... this may take a while." if scan else "Searching...",
+        ephemeral=False,
     )
 
     guild = interaction.guild
@@ -572,6 +1400,7 @@ async def modsusedits(
         buffer = buffer[len(lines_to_send) :]
         buffer_chars = sum(len(l) + 1 for l in buffer)
 
+    channels = []
     found_start_channel = False
     for channel in guild.text_channels:
         if not found_start_channel:
@@ -579,64 +1408,130 @@ async def modsusedits(
                 found_start_channel = True
             else:
                 continue
-        while True:
-            last_id = None
-            try:
-                count = 0
-                print(f"modsusedits: Scanning channel #{channel.name}")
-                async for message in channel.history(
-                    limit=None, oldest_first=True, after=last_id
-                ):
-                    count += 1
-                    if count % 1000 == 0:
-                        print(
-                            f"modsusedits: {count} messages scanned in #{channel.name}"
-                        )
-                    if message.edited_at:
-                        delta = message.edited_at - message.created_at
-                        if delta > threshold:
-                            total_age = datetime.now(timezone.utc) - message.created_at
-
-                            age_hours = total_age.total_seconds() / 3600.0
-                            if age_hours < 24:
-                                age_label = f"{int(round(age_hours))}h"
-                            else:
-                                age_label = f"{int(round(age_hours / 24.0))}d"
-
-                            edit_hours = delta.total_seconds() / 3600.0
-                            if edit_hours < 24:
-                                edit_label = f"{int(round(edit_hours))}h"
-                            else:
-                                edit_label = f"{int(round(edit_hours / 24.0))}d"
-
-                            link = f"https://discord.com/channels/{guild.id}/{channel.id}/{message.id}"
-                            log_line = (
-                                f"age: {age_label} edit: {edit_label} link: {link}"
-                            )
-                            line = f"- {log_line}"
-
-                            buffer.append(line)
-                            buffer_chars += len(line) + 1
-
-                            print("modsusedits: " + log_line)
-
-                            if buffer_chars > MAX_CHARS:
-                                await flush_buffer()
-                    last_id = message.id
-                break
+        channels.append(channel)
+
+    # Only messages after the checkpoint of each channel are read, the edits
+    # of all earlier messages are already in the index.
+    if scan:
+
+        async def report_channel(channel: discord.TextChannel, count: int):
+            log.info(
+                "modsusedits: %d new messages scanned in #%s",
+                count,
+                channel.name,
+                extra={"event": "modsusedits.progress", "channel_id": channel.id},
+            )
 
-            except discord.Forbidden:
-                # Skip channel, if access is forbidden.
-                break
+        count = await EDIT_INDEX.scan_channels(
+            channels,
+            concurrency=MODSUSEDITS_SCAN_CONCURRENCY,
+            on_channel=report_channel,
+        )
+        log.info("modsusedits: %d new messages scanned in total", count)
+
+    positions = {channel.id: i for i, channel in enumerate(channels)}
+    edits = [
+        edit
+        for edit in EDIT_INDEX.edited_after(guild.id, threshold)
+        if edit.channel_id in positions
+    ]
+    edits.sort(key=lambda edit: (positions[edit.channel_id], edit.message_id))
+    for edit in edits:
+        delta = edit.edit_delay
+        total_age = datetime.now(timezone.utc) - edit.created_at
+
+        age_hours = total_age.total_seconds() / 3600.0
+        if age_hours < 24:
+            age_label = f"{int(round(age_hours))}h"
+        else:
+            age_label = f"{int(round(age_hours / 24.0))}d"
 
-            except discord.HTTPException as e:
-                # Back off and retry.
-                print(f"modsusedits: Error: {e}")
-                await asyncio.sleep(60)
-                continue
+        edit_hours = delta.total_seconds() / 3600.0
+        if edit_hours < 24:
+            edit_label = f"{int(round(edit_hours))}h"
+        else:
+            edit_label = f"{int(round(edit_hours / 24.0))}d"
+
+        link = f"https://discord.com/channels/{guild.id}/{edit.channel_id}/{edit.message_id}"
+        log_line = f"age: {age_label} edit: {edit_label} link: {link}"
+        line = f"- {log_line}"
+
+        buffer.append(line)
+        buffer_chars += len(line) + 1
+
+        log.info(
+            "modsusedits: %s",
+            log_line,
+            extra={
+                "event": "modsusedits.edit",
+                "guild_id": guild.id,
+                "channel_id": edit.channel_id,
+                "message_id": edit.message_id,
+            },
+        )
+
+        if buffer_chars > MAX_CHARS:
+            await flush_buffer()
 
     await flush_buffer()
     await interaction.followup.send("Done.")
 
 
-client.run(os.getenv("BOT_TOKEN"))
+@tree.command(
+    name="modreload",
+    description="Reload the forbidden regexes, scam phrases and OCR pipelines.",
+)
+async def modreload(interaction: discord.Interaction):
+    await interaction.response.defer(ephemeral=True)
+    _, message = await reload_config()
+    await interaction.followup.send(message[:2000], ephemeral=True)
+
+
+# Starts the logging thread, opens the databases and loads the files of the
+# bot. OCR worker processes import this file again as __mp_main__ with the
+# forkserver and spawn start methods, so none of this happens on import.
+def setup():
+    global LOG_LISTENER, EDIT_INDEX, COMMAND_SYNC, ATTACHMENT_COOLDOWN_TIMERS
+    LOG_LISTENER = setup_logging(LOGGING_LEVEL, LOGGING_SAMPLE_RATES)
+    logging.getLogger("discord.http").addHandler(RateLimitCounter(logging.WARNING))
+
+    configure_ocr_executor(
+        backend=SCAMDETECT_OCR_BACKEND,
+        workers=SCAMDETECT_OCR_WORKERS,
+        queue_size=SCAMDETECT_OCR_QUEUE_SIZE,
+        timeout_seconds=SCAMDETECT_OCR_TIMEOUT_SECONDS,
+        queue_timeout_seconds=SCAMDETECT_OCR_QUEUE_TIMEOUT_SECONDS,
+    )
+    configure_ocr_cache(
+        max_entries=SCAMDETECT_CACHE_MAX_ENTRIES,
+        ttl_seconds=SCAMDETECT_CACHE_TTL_HOURS * 3600,
+        path=SCAMDETECT_CACHE_PATH,
+    )
+    configure_attachment_limits(
+        max_attachments=SCAMDETECT_MAX_ATTACHMENTS,
+        max_image_bytes=int(SCAMDETECT_MAX_IMAGE_MEGABYTES * 1024 * 1024),
+        max_image_pixels=int(SCAMDETECT_MAX_IMAGE_MEGAPIXELS * 1024 * 1024),
+        preview_max_dimension=SCAMDETECT_PREVIEW_MAX_DIMENSION,
+    )
+    configure_ocr_pipelines(SCAMDETECT_PIPELINES)
+    configure_scam_image_index(
+        path=SCAMDETECT_PHASH_INDEX_PATH, max_distance=SCAMDETECT_PHASH_MAX_DISTANCE
+    )
+
+    EDIT_INDEX = EditIndex(MODSUSEDITS_INDEX_PATH)
+    COMMAND_SYNC = CommandSyncCache(STARTUP_COMMAND_HASHES_PATH)
+    ATTACHMENT_COOLDOWN_TIMERS = TimerScheduler(
+        remove_attachment_cooldown_roles, path=ATTACHMENT_COOLDOWN_TIMERS_PATH
+    )
+
+
+if __name__ == "__main__":
+    setup()
+    try:
+        # Records of discord.py go through the same queue as the bot's own
+        client.run(os.getenv("BOT_TOKEN"), log_handler=None)
+    finally:
+        ATTACHMENT_COOLDOWN_TIMERS.flush()
+        EDIT_INDEX.close()
+        close_ocr_cache()
+        LOG_LISTENER.stop()
@@ -0,0 +1,24 @@
+from .coalesce import ActionCoalescer
+from .commandsync import CommandSyncCache
+from .edits import EditIndex, EditedMessage
+from .evidence import Evidence, EvidenceStore
+from .jsonlog import JsonFormatter, SamplingFilter, setup_logging
+from .logsink import LogEntry, ModLogSink
+from .metrics import Counter, Gauge, Histogram, start_metrics_server
+from .purge import (
+    ChannelPurgeResult,
+    PurgeProgress,
+    delete_known_messages,
+    purge_channels,
+)
+from .recent import RecentMessageIndex
+from .roles import RoleActionQueue, edit_roles, run_bounded, target_roles
+from .scheduler import TimerScheduler
+from .watch import FileWatcher
+from .workqueue import (
+    PRIORITY_ENFORCE,
+    PRIORITY_NAMES,
+    PRIORITY_NOTIFY,
+    PRIORITY_SCAN,
+    WorkQueue,
+)
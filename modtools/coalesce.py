@@ -0,0 +1,47 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
+log = logging.getLogger(__name__)
+
+K = TypeVar("K", bound=Hashable)
+T = TypeVar("T")
+
+
+# Groups items that are added for the same key within a time window. The
+# window starts with the first item of a key, at its end on_flush is awaited
+# once with all items of the window. Used to handle a burst of detections
+# against the same user with a single set of moderation actions.
+class ActionCoalescer(Generic[K, T]):
+    def __init__(
+        self,
+        on_flush: Callable[[K, list[T]], Awaitable[None]],
+        window_seconds: float = 5.0,
+    ):
+        self.on_flush = on_flush
+        self.window_seconds = window_seconds
+        self._groups: dict[K, list[T]] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._groups
+
+    # Returns True, if the item started a new window for its key
+    def add(self, key: K, item: T) -> bool:
+        group = self._groups.get(key)
+        if group is not None:
+            group.append(item)
+            return False
+        self._groups[key] = [item]
+        task = asyncio.create_task(self._flush_later(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _flush_later(self, key: K):
+        await asyncio.sleep(self.window_seconds)
+        items = self._groups.pop(key)
+        try:
+            await self.on_flush(key, items)
+        except Exception as e:
+            log.error("Failed to handle %d coalesced actions: %s", len(items), e)
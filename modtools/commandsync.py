@@ -0,0 +1,56 @@
+import hashlib
+import json
+import logging
+import os
+
+import discord
+from discord import app_commands
+
+log = logging.getLogger(__name__)
+
+# Syncs the commands of a guild only if they changed since the last sync,
+# according to a hash of the payload that the sync would send. The hashes are
+# kept in a JSON file, so that a restart without command changes doesn't
+# sync at all. Delete the file to sync every guild again, e.g. after the
+# commands were changed by something else than the bot.
+
+
+class CommandSyncCache:
+    def __init__(self, path: str | None = None):
+        self.path = path
+        # "application ID:guild ID" -> hash of the synced commands
+        self._hashes: dict[str, str] = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path) as file:
+                    self._hashes = dict(json.load(file))
+            except (OSError, ValueError, TypeError) as e:
+                log.error("Failed to load command hashes from %s: %s", path, e)
+
+    @staticmethod
+    def tree_hash(tree: app_commands.CommandTree, guild: discord.Guild) -> str:
+        payload = [command.to_dict(tree) for command in tree.get_commands(guild=guild)]
+        data = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    # Returns whether the commands were synced, False if they didn't change
+    async def sync(self, tree: app_commands.CommandTree, guild: discord.Guild) -> bool:
+        key = f"{tree.client.application_id}:{guild.id}"
+        digest = self.tree_hash(tree, guild)
+        if self._hashes.get(key) == digest:
+            return False
+        await tree.sync(guild=guild)
+        self._hashes[key] = digest
+        self._save()
+        return True
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            temporary_path = f"{self.path}.tmp"
+            with open(temporary_path, "w") as file:
+                json.dump(self._hashes, file, indent=2, sort_keys=True)
+            os.replace(temporary_path, self.path)
+        except OSError as e:
+            log.error("Failed to save command hashes to %s: %s", self.path, e)
@@ -0,0 +1,247 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable
+
+import discord
+from discord.utils import snowflake_time
+
+log = logging.getLogger(__name__)
+
+# Remembers which messages were edited and when, so that /modsusedits doesn't
+# have to read the whole history of every channel again. For each channel the
+# ID of the last scanned message is stored as a checkpoint, a scan continues
+# after it. Only edited messages are stored. Messages that are edited later
+# are added live from edit events, but edits made while the bot was offline
+# to messages that were already scanned are missed. Changes from edit and
+# delete events are committed in batches, by count and by a periodic task.
+
+
+@dataclass
+class EditedMessage:
+    guild_id: int
+    channel_id: int
+    message_id: int
+    edited_at: datetime
+
+    @property
+    def created_at(self) -> datetime:
+        return snowflake_time(self.message_id)
+
+    @property
+    def edit_delay(self) -> timedelta:
+        return self.edited_at - self.created_at
+
+
+class EditIndex:
+    # Number of scanned messages after which the checkpoint is saved
+    CHECKPOINT_INTERVAL = 500
+    # Number of changes from events after which they are committed
+    COMMIT_INTERVAL = 100
+
+    def __init__(self, path: str | None = None, commit_interval_seconds: float = 5.0):
+        self.commit_interval_seconds = commit_interval_seconds
+        self._pending = 0
+        self._task: asyncio.Task | None = None
+        self._db = sqlite3.connect(path or ":memory:")
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS channel_checkpoints ("
+            "channel_id INTEGER PRIMARY KEY, last_message_id INTEGER NOT NULL, "
+            "scanned_count INTEGER NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS edited_messages ("
+            "message_id INTEGER PRIMARY KEY, guild_id INTEGER NOT NULL, "
+            "channel_id INTEGER NOT NULL, edited_at REAL NOT NULL, "
+            "edit_delay REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS edited_messages_delay "
+            "ON edited_messages (guild_id, edit_delay)"
+        )
+        self._db.commit()
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM edited_messages").fetchone()[0]
+
+    def checkpoint(self, channel_id: int) -> int | None:
+        row = self._db.execute(
+            "SELECT last_message_id FROM channel_checkpoints WHERE channel_id = ?",
+            (channel_id,),
+        ).fetchone()
+        return row[0] if row else None
+
+    def save_checkpoint(self, channel_id: int, last_message_id: int, scanned: int):
+        self._db.execute(
+            "INSERT INTO channel_checkpoints "
+            "(channel_id, last_message_id, scanned_count, updated_at) "
+            "VALUES (?, ?, ?, ?) ON CONFLICT (channel_id) DO UPDATE SET "
+            "last_message_id = MAX(last_message_id, excluded.last_message_id), "
+            "scanned_count = scanned_count + excluded.scanned_count, "
+            "updated_at = excluded.updated_at",
+            (channel_id, last_message_id, scanned, time.time()),
+        )
+        self.commit()
+
+    def _record(self, guild_id: int, channel_id: int, message_id: int, edited_at):
+        delay = (edited_at - snowflake_time(message_id)).total_seconds()
+        self._db.execute(
+            "INSERT OR REPLACE INTO edited_messages "
+            "(message_id, guild_id, channel_id, edited_at, edit_delay) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (message_id, guild_id, channel_id, edited_at.timestamp(), delay),
+        )
+
+    # Called for edit events, so that the index stays up to date between scans
+    def record_edit(self, message: discord.Message):
+        if message.guild is None or message.edited_at is None:
+            return
+        self._record(
+            message.guild.id, message.channel.id, message.id, message.edited_at
+        )
+        self._changed(1)
+
+    def remove(self, message_ids: list[int]):
+        self._db.executemany(
+            "DELETE FROM edited_messages WHERE message_id = ?",
+            [(message_id,) for message_id in message_ids],
+        )
+        self._changed(len(message_ids))
+
+    def _changed(self, count: int):
+        self._pending += count
+        if self._pending >= self.COMMIT_INTERVAL:
+            self.commit()
+
+    def commit(self):
+        self._pending = 0
+        self._db.commit()
+
+    # Starts committing changes from events every commit_interval_seconds,
+    # once there is a running event loop
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.commit_interval_seconds)
+            if self._pending > 0:
+                self.commit()
+
+    # Returns the messages of the guild that were edited at least min_delay
+    # after they were sent, oldest first.
+    def edited_after(self, guild_id: int, min_delay: timedelta) -> list[EditedMessage]:
+        rows = self._db.execute(
+            "SELECT channel_id, message_id, edited_at FROM edited_messages "
+            "WHERE guild_id = ? AND edit_delay > ? ORDER BY message_id",
+            (guild_id, min_delay.total_seconds()),
+        ).fetchall()
+        return [
+            EditedMessage(
+                guild_id=guild_id,
+                channel_id=channel_id,
+                message_id=message_id,
+                edited_at=datetime.fromtimestamp(edited_at, timezone.utc),
+            )
+            for channel_id, message_id, edited_at in rows
+        ]
+
+    # Reads the history of the channel after its checkpoint and stores the
+    # edited messages. After an HTTP error the scan continues from the last
+    # saved checkpoint. Returns the number of scanned messages.
+    async def scan_channel(
+        self,
+        channel: discord.TextChannel,
+        retry_seconds: float = 60,
+        max_retries: int = 5,
+    ) -> int:
+        total = 0
+        retries = 0
+        while True:
+            after = self.checkpoint(channel.id)
+            scanned = 0
+            last_id = after
+            try:
+                async for message in channel.history(
+                    limit=None,
+                    oldest_first=True,
+                    after=discord.Object(after) if after else None,
+                ):
+                    if message.edited_at is not None:
+                        self._record(
+                            channel.guild.id, channel.id, message.id, message.edited_at
+                        )
+                    scanned += 1
+                    last_id = message.id
+                    if scanned % self.CHECKPOINT_INTERVAL == 0:
+                        self.save_checkpoint(
+                            channel.id, last_id, self.CHECKPOINT_INTERVAL
+                        )
+                if last_id is not None:
+                    self.save_checkpoint(
+                        channel.id, last_id, scanned % self.CHECKPOINT_INTERVAL
+                    )
+                return total + scanned
+            except discord.Forbidden:
+                # Skip channels the bot can't read
+                self.commit()
+                return total + scanned
+            except discord.HTTPException as e:
+                # Keep what was scanned, then back off and continue after it
+                if last_id is not None:
+                    self.save_checkpoint(
+                        channel.id, last_id, scanned % self.CHECKPOINT_INTERVAL
+                    )
+                total += scanned
+                retries += 1
+                if retries > max_retries:
+                    raise
+                log.warning(
+                    "Error while scanning #%s for edits, retrying: %s",
+                    channel.name,
+                    e,
+                    extra={"channel_id": channel.id},
+                )
+                await asyncio.sleep(retry_seconds)
+
+    # Scans all channels concurrently, at most concurrency at a time.
+    # on_channel is awaited with each channel and its number of new messages.
+    async def scan_channels(
+        self,
+        channels: list[discord.TextChannel],
+        *,
+        concurrency: int = 4,
+        on_channel: Callable[[discord.TextChannel, int], Awaitable[None]] | None = None,
+    ) -> int:
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def scan(channel: discord.TextChannel) -> int:
+            async with semaphore:
+                try:
+                    scanned = await self.scan_channel(channel)
+                except discord.HTTPException as e:
+                    log.error(
+                        "Gave up scanning #%s for edits: %s",
+                        channel.name,
+                        e,
+                        extra={"channel_id": channel.id},
+                    )
+                    return 0
+            if on_channel is not None:
+                await on_channel(channel, scanned)
+            return scanned
+
+        return sum(await asyncio.gather(*[scan(channel) for channel in channels]))
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.commit()
+        self._db.close()
@@ -0,0 +1,134 @@
+import hashlib
+import io
+import os
+import tempfile
+import time
+from collections import OrderedDict
+
+# Keeps the attachments that were already downloaded, e.g. by the scam scan,
+# so that they don't have to be downloaded again as evidence for the log.
+# Small files are kept in memory, larger ones in temporary files. The oldest
+# files are dropped once the memory or disk limit is reached, or when they
+# are older than max_age_seconds.
+
+
+class Evidence:
+    def __init__(self, filename: str, data: bytes, spool_directory: str | None):
+        self.filename = filename
+        self.size = len(data)
+        self.digest = hashlib.sha256(data).digest()
+        self.created_at = time.monotonic()
+        self._data: bytes | None = data
+        self._path: str | None = None
+        if spool_directory is not None:
+            file = tempfile.NamedTemporaryFile(
+                dir=spool_directory or None, prefix="evidence-", delete=False
+            )
+            with file:
+                file.write(data)
+            self._path = file.name
+            self._data = None
+
+    @property
+    def in_memory(self) -> bool:
+        return self._data is not None
+
+    # Returns a new file object with the data, the caller closes it
+    def open(self) -> io.BufferedIOBase:
+        if self._data is not None:
+            return io.BytesIO(self._data)
+        return open(self._path, "rb")
+
+    # Frees the memory or removes the temporary file
+    def discard(self):
+        self._data = None
+        if self._path is not None:
+            try:
+                os.remove(self._path)
+            except OSError:
+                pass
+            self._path = None
+
+
+class EvidenceStore:
+    def __init__(
+        self,
+        spool_threshold_bytes: int = 1024 * 1024,
+        max_memory_bytes: int = 32 * 1024 * 1024,
+        max_disk_bytes: int = 256 * 1024 * 1024,
+        max_age_seconds: float = 600,
+        directory: str | None = None,
+    ):
+        self.spool_threshold_bytes = spool_threshold_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.max_age_seconds = max_age_seconds
+        # Empty string for the default temporary directory
+        self.directory = directory or ""
+        # Attachment ID -> evidence, oldest first
+        self._files: OrderedDict[int, Evidence] = OrderedDict()
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def __contains__(self, attachment_id: int) -> bool:
+        return attachment_id in self._files
+
+    # Returns evidence that is not kept in the store, spooled to disk if it
+    # is larger than the threshold
+    def create(self, filename: str, data: bytes) -> Evidence:
+        spool = len(data) > self.spool_threshold_bytes
+        return Evidence(filename, data, self.directory if spool else None)
+
+    def put(self, attachment_id: int, filename: str, data: bytes) -> Evidence:
+        self._remove(attachment_id)
+        evidence = self.create(filename, data)
+        self._files[attachment_id] = evidence
+        self._account(evidence, 1)
+        self._evict()
+        return evidence
+
+    # Removes the evidence from the store and hands it to the caller, who
+    # has to discard it when it is no longer needed.
+    def pop(self, attachment_id: int) -> Evidence | None:
+        self._evict()
+        evidence = self._files.pop(attachment_id, None)
+        if evidence is not None:
+            self._account(evidence, -1)
+        return evidence
+
+    def _account(self, evidence: Evidence, sign: int):
+        if evidence.in_memory:
+            self.memory_bytes += sign * evidence.size
+        else:
+            self.disk_bytes += sign * evidence.size
+
+    def _remove(self, attachment_id: int):
+        evidence = self._files.pop(attachment_id, None)
+        if evidence is not None:
+            self._account(evidence, -1)
+            evidence.discard()
+
+    def _evict(self):
+        min_created_at = time.monotonic() - self.max_age_seconds
+        for attachment_id, evidence in list(self._files.items()):
+            if (
+                evidence.created_at >= min_created_at
+                and self.memory_bytes <= self.max_memory_bytes
+                and self.disk_bytes <= self.max_disk_bytes
+            ):
+                break
+            if (
+                evidence.created_at < min_created_at
+                or evidence.in_memory
+                and self.memory_bytes > self.max_memory_bytes
+                or not evidence.in_memory
+                and self.disk_bytes > self.max_disk_bytes
+            ):
+                self._remove(attachment_id)
+
+    def clear(self):
+        while self._files:
+            self._remove(next(iter(self._files)))
@@ -0,0 +1,103 @@
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+from datetime import datetime, timezone
+from typing import TextIO
+
+# Structured logging as JSON lines. Records are handed to a queue by the
+# code that logs, and written by a background thread, so a slow stdout (e.g.
+# a docker log driver under load) never blocks the event loop. Fields are
+# passed with extra, e.g.
+#   log.info("Deleted message", extra={"event": "automod.delete", "user_id": 1})
+# Records with an event name can be sampled, see SamplingFilter.
+#
+# The OCR worker processes must not log: their records would go to a copy of
+# the queue that nobody reads.
+
+# Attributes of every log record, everything else was passed with extra
+RECORD_ATTRIBUTES = set(logging.LogRecord("", 0, "", 0, "", None, None).__dict__) | {
+    "message",
+    "asctime",
+    "taskName",
+}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES and key not in entry:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+# Formats the message before the record is queued, since the arguments may
+# change in the meantime, but keeps the traceback as a separate field
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exception = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+            record.exc_text = None
+        return record
+
+
+# Keeps only every n-th record of an event, for high volume events like
+# progress updates. The number of dropped records is added to the next one
+# that is kept.
+class SamplingFilter(logging.Filter):
+    def __init__(self, sample_rates: dict[str, int]):
+        super().__init__()
+        self.sample_rates = sample_rates
+        self._counts: dict[str, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        event = getattr(record, "event", None)
+        rate = self.sample_rates.get(event, 1) if event else 1
+        if rate <= 1:
+            return True
+        count = self._counts.get(event, 0) + 1
+        if count < rate:
+            self._counts[event] = count
+            return False
+        self._counts[event] = 0
+        record.sampled = rate
+        return True
+
+
+# Sends all records of the process through a queue to a JSON handler on the
+# stream. Returns the listener, which has to be stopped before exiting so
+# that the remaining records are written.
+def setup_logging(
+    level: str | int = "INFO",
+    sample_rates: dict[str, int] | None = None,
+    stream: TextIO = sys.stdout,
+) -> logging.handlers.QueueListener:
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter())
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = StructuredQueueHandler(records)
+    # Sampling happens before the record is queued, so that dropped records
+    # cost as little as possible
+    queue_handler.addFilter(SamplingFilter(sample_rates or {}))
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    listener = logging.handlers.QueueListener(records, handler)
+    listener.start()
+    return listener
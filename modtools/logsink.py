@@ -0,0 +1,223 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import discord
+
+from .evidence import Evidence
+
+log = logging.getLogger(__name__)
+
+# Limits of a single Discord message
+MAX_CONTENT_LENGTH = 2000
+MAX_EMBEDS = 10
+MAX_EMBED_LENGTH = 6000  # all embeds of a message together
+MAX_FILES = 10
+
+
+@dataclass
+class LogEntry:
+    content: str | None = None
+    embed: discord.Embed | None = None
+    # Discarded once the entry was sent
+    files: list[Evidence] = field(default_factory=list)
+
+
+# Collects log entries per channel for a short window and sends them with as
+# few messages as possible, with up to 10 embeds each and a single ping at
+# the end. Files are uploaded once, later entries with the same file link to
+# the message that has it. log() never waits for Discord, so that logging
+# doesn't hold up moderation actions.
+class ModLogSink:
+    def __init__(
+        self,
+        window_seconds: float = 2.0,
+        max_uploaded_files: int = 1000,
+    ):
+        self.window_seconds = window_seconds
+        self.max_uploaded_files = max_uploaded_files
+        # Channel ID -> (channel, entries, user IDs to ping)
+        self._pending: dict[
+            int, tuple[discord.abc.Messageable, list[LogEntry], set[int]]
+        ] = {}
+        # SHA-256 of uploaded files -> URL of the message with the file
+        self._uploaded: OrderedDict[bytes, str] = OrderedDict()
+        self._tasks: set[asyncio.Task] = set()
+
+    def log(
+        self,
+        channel: discord.TextChannel,
+        entry: LogEntry,
+        ping: discord.abc.Snowflake | None = None,
+    ):
+        pending = self._pending.get(channel.id)
+        if pending is None:
+            pending = (channel, [], set())
+            self._pending[channel.id] = pending
+            task = asyncio.create_task(self._flush_later(channel.id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        pending[1].append(entry)
+        if ping is not None:
+            pending[2].add(ping.id)
+
+    async def _flush_later(self, channel_id: int):
+        await asyncio.sleep(self.window_seconds)
+        channel, entries, ping_ids = self._pending.pop(channel_id)
+        if ping_ids:
+            mentions = " ".join(f"<@{user_id}>" for user_id in sorted(ping_ids))
+            entries.append(LogEntry(content=f"{mentions} New moderation events."))
+        try:
+            await self._send(channel, entries, ping_ids)
+        except Exception as e:
+            log.error("Failed to send %d log entries: %s", len(entries), e)
+        finally:
+            for entry in entries:
+                for evidence in entry.files:
+                    evidence.discard()
+
+    def _reference_uploaded(self, entry: LogEntry, urls: list[str]):
+        text = " ".join(urls)
+        if entry.embed is not None and len(text) <= 1024:
+            entry.embed.add_field(name="Evidence", value=text, inline=False)
+        else:
+            entry.content = f"{entry.content or ''}\nEvidence: {text}".strip()
+
+    async def _send_message(
+        self,
+        channel: discord.abc.Messageable,
+        content: str | None,
+        embeds: list[discord.Embed],
+        files: list[Evidence],
+        mentioned: list[int],
+    ) -> discord.Message:
+        opened = [
+            discord.File(evidence.open(), filename=evidence.filename)
+            for evidence in files
+        ]
+        try:
+            return await channel.send(
+                content,
+                embeds=list(embeds),
+                files=opened,
+                allowed_mentions=discord.AllowedMentions(
+                    everyone=False,
+                    roles=False,
+                    users=[discord.Object(user_id) for user_id in mentioned],
+                ),
+            )
+        finally:
+            for file in opened:
+                file.close()
+                file.fp.close()
+
+    async def _send(
+        self,
+        channel: discord.abc.Messageable,
+        entries: list[LogEntry],
+        ping_ids: set[int],
+    ):
+        contents: list[str] = []
+        embeds: list[discord.Embed] = []
+        files: dict[bytes, Evidence] = {}
+
+        async def send():
+            if not contents and not embeds and not files:
+                return
+            content = "\n".join(contents) or None
+            mentioned = [
+                user_id for user_id in ping_ids if f"<@{user_id}>" in (content or "")
+            ]
+            # One message that can't be sent must not take the other entries
+            # of the window or the ping with it. Without the files, it usually
+            # fits (413) or is allowed, otherwise the entries are kept in the
+            # bot's log.
+            uploaded = list(files)
+            try:
+                message = await self._send_message(
+                    channel, content, embeds, list(files.values()), mentioned
+                )
+            except Exception as e:
+                message = None
+                log.warning(
+                    "Failed to send a log message with %d files: %s", len(files), e
+                )
+            if message is None and files:
+                uploaded = []
+                note = f"({len(files)} evidence files could not be uploaded)"
+                try:
+                    message = await self._send_message(
+                        channel,
+                        f"{content or ''}\n{note}".strip()[-MAX_CONTENT_LENGTH:],
+                        embeds,
+                        [],
+                        mentioned,
+                    )
+                except Exception as e:
+                    log.warning("Failed to send a log message without files: %s", e)
+            if message is None:
+                log.error(
+                    "Dropped a log message",
+                    extra={
+                        "event": "modlog.dropped",
+                        "content": content,
+                        "embeds": [embed.to_dict() for embed in embeds],
+                    },
+                )
+                if mentioned:
+                    mentions = " ".join(f"<@{user_id}>" for user_id in mentioned)
+                    try:
+                        await self._send_message(
+                            channel,
+                            f"{mentions} New moderation events, some could not "
+                            f"be logged here.",
+                            [],
+                            [],
+                            mentioned,
+                        )
+                    except Exception as e:
+                        log.error("Failed to send the log ping: %s", e)
+            else:
+                for digest in uploaded:
+                    self._uploaded[digest] = message.jump_url
+                    self._uploaded.move_to_end(digest)
+                while len(self._uploaded) > self.max_uploaded_files:
+                    self._uploaded.popitem(last=False)
+            contents.clear()
+            embeds.clear()
+            files.clear()
+
+        for entry in entries:
+            new_files = {}
+            uploaded = []
+            for evidence in entry.files:
+                digest = evidence.digest
+                if digest in files or digest in new_files:
+                    continue
+                if digest in self._uploaded:
+                    uploaded.append(self._uploaded[digest])
+                else:
+                    new_files[digest] = evidence
+            if uploaded:
+                self._reference_uploaded(entry, list(dict.fromkeys(uploaded)))
+            content_length = sum(len(c) + 1 for c in contents)
+            embed_length = sum(len(e) for e in embeds)
+            if (
+                entry.content
+                and content_length + len(entry.content) > MAX_CONTENT_LENGTH
+                or entry.embed is not None
+                and (
+                    len(embeds) >= MAX_EMBEDS
+                    or embed_length + len(entry.embed) > MAX_EMBED_LENGTH
+                )
+                or len(files) + len(new_files) > MAX_FILES
+            ):
+                await send()
+            if entry.content:
+                contents.append(entry.content[:MAX_CONTENT_LENGTH])
+            if entry.embed is not None:
+                embeds.append(entry.embed)
+            for digest, file in list(new_files.items())[:MAX_FILES]:
+                files[digest] = file
+        await send()
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable
+
+import discord
+
+log = logging.getLogger(__name__)
+
+# Discord only bulk deletes messages that are younger than 14 days, at most
+# 100 per request. Older messages have to be deleted one by one.
+BULK_DELETE_MAX_AGE = timedelta(days=14)
+BULK_DELETE_MAX_COUNT = 100
+# Messages close to the age limit are deleted one by one, in case the clocks
+# differ a little or the request is delayed by a rate limit.
+BULK_DELETE_AGE_MARGIN = timedelta(minutes=5)
+
+
+def is_bulk_deletable(message: discord.PartialMessage, now: datetime) -> bool:
+    return now - message.created_at < BULK_DELETE_MAX_AGE - BULK_DELETE_AGE_MARGIN
+
+
+@dataclass
+class PurgeProgress:
+    channels_total: int
+    channels_scanned: int = 0
+    messages_found: int = 0
+    messages_deleted: int = 0
+
+
+@dataclass
+class ChannelPurgeResult:
+    channel: discord.TextChannel
+    # The deleted messages, oldest first. Messages that were deleted by ID
+    # without being in the message cache are only partial messages.
+    messages: list[discord.PartialMessage] = field(default_factory=list)
+    # Set, if the channel could not be read or not all messages were deleted
+    error: str | None = None
+
+
+# Deletes the messages in up to 100 per request, or one by one if they are
+# too old or there is only one. Returns the messages that were deleted. The
+# requests are paced by the rate limit handling of discord.py.
+async def delete_channel_messages(
+    channel: discord.TextChannel,
+    messages: list[discord.PartialMessage],
+    reason: str | None = None,
+) -> list[discord.PartialMessage]:
+    now = datetime.now(timezone.utc)
+    bulk = [message for message in messages if is_bulk_deletable(message, now)]
+    single = [message for message in messages if not is_bulk_deletable(message, now)]
+    deleted = []
+    for i in range(0, len(bulk), BULK_DELETE_MAX_COUNT):
+        chunk = bulk[i : i + BULK_DELETE_MAX_COUNT]
+        if len(chunk) == 1:
+            single.extend(chunk)
+            continue
+        try:
+            await channel.delete_messages(chunk, reason=reason)
+            deleted.extend(chunk)
+        except discord.HTTPException as e:
+            if isinstance(e, discord.Forbidden):
+                raise
+            # E.g. a message of the chunk was deleted in the meantime
+            log.warning(
+                "Bulk delete in #%s failed, deleting one by one: %s",
+                channel.name,
+                e,
+                extra={"channel_id": channel.id},
+            )
+            single.extend(chunk)
+    for message in single:
+        try:
+            await message.delete()
+            deleted.append(message)
+        except discord.NotFound:
+            continue
+    deleted.sort(key=lambda message: message.id)
+    return deleted
+
+
+# Pages through the whole history of the channel between the given times and
+# deletes every message for which check returns True. Matching messages are
+# deleted in batches while the history is still being read.
+async def purge_channel(
+    channel: discord.TextChannel,
+    check: Callable[[discord.Message], bool],
+    after: datetime,
+    progress: PurgeProgress,
+    reason: str | None = None,
+    before: datetime | None = None,
+) -> ChannelPurgeResult:
+    result = ChannelPurgeResult(channel)
+    pending = []
+    try:
+        async for message in channel.history(
+            limit=None, after=after, before=before, oldest_first=True
+        ):
+            if not check(message):
+                continue
+            progress.messages_found += 1
+            pending.append(message)
+            if len(pending) >= BULK_DELETE_MAX_COUNT:
+                deleted = await delete_channel_messages(channel, pending, reason)
+                result.messages.extend(deleted)
+                progress.messages_deleted += len(deleted)
+                pending = []
+        if pending:
+            deleted = await delete_channel_messages(channel, pending, reason)
+            result.messages.extend(deleted)
+            progress.messages_deleted += len(deleted)
+    except discord.Forbidden:
+        result.error = "Missing permissions"
+    except discord.HTTPException as e:
+        result.error = str(e)
+    return result
+
+
+# Purges all channels concurrently, at most concurrency channels at a time.
+# The results are in the order of the channels. on_progress is awaited after
+# every channel that was completed.
+async def purge_channels(
+    channels: list[discord.TextChannel],
+    check: Callable[[discord.Message], bool],
+    after: datetime,
+    *,
+    before: datetime | None = None,
+    concurrency: int = 4,
+    reason: str | None = None,
+    on_progress: Callable[[PurgeProgress], Awaitable[None]] | None = None,
+) -> list[ChannelPurgeResult]:
+    progress = PurgeProgress(channels_total=len(channels))
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def purge(channel: discord.TextChannel) -> ChannelPurgeResult:
+        async with semaphore:
+            result = await purge_channel(
+                channel, check, after, progress, reason, before
+            )
+        progress.channels_scanned += 1
+        if on_progress is not None:
+            try:
+                await on_progress(progress)
+            except Exception as e:
+                log.warning("Failed to report purge progress: %s", e)
+        return result
+
+    return await asyncio.gather(*[purge(channel) for channel in channels])
+
+
+# Deletes messages whose channels and IDs are already known, e.g. from the
+# recent message index, without reading any history.
+async def delete_known_messages(
+    messages_by_channel: dict[discord.TextChannel, list[discord.PartialMessage]],
+    *,
+    concurrency: int = 4,
+    reason: str | None = None,
+) -> list[ChannelPurgeResult]:
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def delete(
+        channel: discord.TextChannel, messages: list[discord.PartialMessage]
+    ) -> ChannelPurgeResult:
+        result = ChannelPurgeResult(channel)
+        try:
+            async with semaphore:
+                result.messages = await delete_channel_messages(
+                    channel, messages, reason
+                )
+        except discord.Forbidden:
+            result.error = "Missing permissions"
+        except discord.HTTPException as e:
+            result.error = str(e)
+        return result
+
+    return await asyncio.gather(
+        *[
+            delete(channel, messages)
+            for channel, messages in messages_by_channel.items()
+        ]
+    )
@@ -0,0 +1,145 @@
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import discord
+from discord.utils import snowflake_time, time_snowflake
+
+# Remembers where users posted recently, from the messages the bot receives,
+# so that moderation commands don't have to page through the history of
+# every channel. The creation time of a message is part of its snowflake ID,
+# so only the channel and message IDs are stored, in two arrays per user.
+
+
+class UserMessages:
+    __slots__ = ("channel_ids", "message_ids", "head", "truncated_before")
+
+    def __init__(self):
+        self.channel_ids = array("Q")
+        self.message_ids = array("Q")
+        # Entries before head were dropped and are removed on compaction
+        self.head = 0
+        # ID of the newest message that was dropped because the buffer was full
+        self.truncated_before = 0
+
+    def __len__(self) -> int:
+        return len(self.message_ids) - self.head
+
+    def newest_id(self) -> int:
+        return max(self.message_ids[self.head :], default=0)
+
+    def find(self, message_id: int) -> int:
+        for i in range(self.head, len(self.message_ids)):
+            if self.message_ids[i] == message_id:
+                return i
+        return -1
+
+    def append(self, channel_id: int, message_id: int):
+        self.channel_ids.append(channel_id)
+        self.message_ids.append(message_id)
+
+    # Drops the oldest entry, returns its message ID (0 if it was deleted)
+    def drop_oldest(self) -> int:
+        message_id = self.message_ids[self.head]
+        self.head += 1
+        if self.head >= 64 and self.head * 2 >= len(self.message_ids):
+            del self.channel_ids[: self.head]
+            del self.message_ids[: self.head]
+            self.head = 0
+        return message_id
+
+
+class RecentMessageIndex:
+    def __init__(
+        self,
+        max_messages_per_user: int = 200,
+        max_messages: int = 200_000,
+        max_age: timedelta = timedelta(hours=24),
+    ):
+        self.max_messages_per_user = max(1, max_messages_per_user)
+        self.max_messages = max(1, max_messages)
+        self.max_age = max_age
+        # Least recently active users first
+        self._users: OrderedDict[int, UserMessages] = OrderedDict()
+        self._count = 0
+        # Messages older than this ID may be missing for any user, since the
+        # bot was not running or entries of other users had to be evicted.
+        self._complete_after = time_snowflake(datetime.now(timezone.utc))
+
+    def __len__(self) -> int:
+        return self._count
+
+    def add(self, message: discord.Message):
+        if message.guild is None or message.type == discord.MessageType.new_member:
+            return
+        self.add_ids(message.author.id, message.channel.id, message.id)
+
+    def add_ids(self, user_id: int, channel_id: int, message_id: int):
+        messages = self._users.get(user_id)
+        if messages is None:
+            messages = self._users[user_id] = UserMessages()
+        elif messages.find(message_id) >= 0:
+            return
+        self._users.move_to_end(user_id)
+        messages.append(channel_id, message_id)
+        self._count += 1
+        if len(messages) > self.max_messages_per_user:
+            messages.truncated_before = max(
+                messages.truncated_before, messages.drop_oldest()
+            )
+            self._count -= 1
+        if self._count > self.max_messages:
+            self._evict()
+
+    def remove(self, user_id: int, message_id: int):
+        messages = self._users.get(user_id)
+        if messages is None:
+            return
+        i = messages.find(message_id)
+        if i >= 0:
+            # Kept as a deleted entry, so the order doesn't have to change
+            messages.message_ids[i] = 0
+
+    # Called when the bot missed events, e.g. after a new gateway session
+    def mark_gap(self):
+        self._complete_after = time_snowflake(datetime.now(timezone.utc))
+
+    # Removes users without messages in the last max_age and, if that is not
+    # enough, the least recently active users.
+    def _evict(self):
+        oldest_id = time_snowflake(datetime.now(timezone.utc) - self.max_age)
+        while self._users:
+            user_id, messages = next(iter(self._users.items()))
+            newest_id = messages.newest_id()
+            if newest_id >= oldest_id and self._count <= self.max_messages:
+                break
+            del self._users[user_id]
+            self._count -= len(messages)
+            if newest_id >= oldest_id:
+                self._complete_after = max(self._complete_after, newest_id)
+
+    # The time before which messages of the user may be missing
+    def gap_before(self, user_id: int) -> datetime:
+        complete_after = self._complete_after
+        messages = self._users.get(user_id)
+        if messages is not None:
+            complete_after = max(complete_after, messages.truncated_before)
+        return max(
+            snowflake_time(complete_after),
+            datetime.now(timezone.utc) - self.max_age,
+        )
+
+    # Returns the channel and message IDs of the messages of the user that
+    # were sent after the given time, oldest first.
+    def messages(self, user_id: int, after: datetime) -> list[tuple[int, int]]:
+        messages = self._users.get(user_id)
+        if messages is None:
+            return []
+        after_id = time_snowflake(after, high=True)
+        found = [
+            (messages.channel_ids[i], messages.message_ids[i])
+            for i in range(messages.head, len(messages.message_ids))
+            if messages.message_ids[i] > after_id
+        ]
+        found.sort(key=lambda entry: entry[1])
+        return found
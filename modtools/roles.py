@@ -0,0 +1,156 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Iterable, TypeVar
+
+import discord
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+# Returns the roles the member should have after adding and removing the
+# given roles, or None if nothing changes. Roles that don't exist (None) are
+# ignored. The @everyone role is never part of the list, Discord rejects it.
+def target_roles(
+    member: discord.Member,
+    add: Iterable[discord.Role | None] = (),
+    remove: Iterable[discord.Role | None] = (),
+) -> list[discord.Role] | None:
+    current = [role for role in member.roles if not role.is_default()]
+    remove_ids = {role.id for role in remove if role is not None}
+    roles = [role for role in current if role.id not in remove_ids]
+    for role in add:
+        if role is not None and role.id not in remove_ids and role not in roles:
+            roles.append(role)
+    if {role.id for role in roles} == {role.id for role in current}:
+        return None
+    return roles
+
+
+# Adds and removes roles with a single request, so that either all changes
+# are applied or none. Returns False, if nothing had to be changed.
+async def edit_roles(
+    member: discord.Member,
+    add: Iterable[discord.Role | None] = (),
+    remove: Iterable[discord.Role | None] = (),
+    reason: str | None = None,
+) -> bool:
+    # The request replaces all roles of the member. The member of a message
+    # or an interaction is a snapshot, roles given since then would be lost.
+    member = member.guild.get_member(member.id) or member
+    roles = target_roles(member, add, remove)
+    if roles is None:
+        return False
+    await member.edit(roles=roles, reason=reason)
+    return True
+
+
+# Runs fn for all items, at most concurrency at a time, and returns the
+# results in the order of the items.
+async def run_bounded(
+    items: Iterable[T], fn: Callable[[T], Awaitable[R]], concurrency: int = 4
+) -> list[R]:
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(item: T) -> R:
+        async with semaphore:
+            return await fn(item)
+
+    return await asyncio.gather(*[run(item) for item in items])
+
+
+# Adds and removes roles in the background, so that callers don't wait for
+# the request. Only the latest wanted state of a role per member is kept: an
+# add followed by a remove before the add was sent results in no request at
+# all. Changes to the same member role never run concurrently.
+class RoleActionQueue:
+    def __init__(self, workers: int = 2):
+        self.workers = max(1, workers)
+        # (guild ID, member ID, role ID) -> (member, role, wanted, reason)
+        self._wanted: dict[
+            tuple[int, int, int], tuple[discord.Member, discord.Role, bool, str | None]
+        ] = {}
+        self._in_flight: set[tuple[int, int, int]] = set()
+        # Roles that were added by the queue, before the member update event
+        # arrives that puts them into the member cache
+        self._added: set[tuple[int, int, int]] = set()
+        self._queue: asyncio.Queue | None = None
+        self._tasks: list[asyncio.Task] = []
+
+    def __len__(self) -> int:
+        return len(self._wanted)
+
+    def add(
+        self, member: discord.Member, role: discord.Role, reason: str | None = None
+    ):
+        self._set(member, role, True, reason)
+
+    def remove(
+        self, member: discord.Member, role: discord.Role, reason: str | None = None
+    ):
+        self._set(member, role, False, reason)
+
+    def is_pending(self, member: discord.Member, role: discord.Role) -> bool:
+        key = (member.guild.id, member.id, role.id)
+        return key in self._wanted or key in self._in_flight
+
+    def _set(self, member: discord.Member, role: discord.Role, wanted: bool, reason):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._tasks = [
+                asyncio.create_task(self._work()) for _ in range(self.workers)
+            ]
+        key = (member.guild.id, member.id, role.id)
+        queued = key in self._wanted
+        self._wanted[key] = (member, role, wanted, reason)
+        # Keys in flight are queued again once their request is done
+        if not queued and key not in self._in_flight:
+            self._queue.put_nowait(key)
+
+    async def _apply(self, key, member, role, wanted: bool, reason: str | None):
+        # The cached member is more recent than the one that was queued
+        member = member.guild.get_member(member.id) or member
+        has_role = any(r.id == role.id for r in member.roles)
+        if has_role:
+            self._added.discard(key)
+        elif key in self._added:
+            has_role = True
+        if wanted and not has_role:
+            await member.add_roles(role, reason=reason)
+            self._added.add(key)
+        elif not wanted and has_role:
+            await member.remove_roles(role, reason=reason)
+            self._added.discard(key)
+
+    async def _work(self):
+        while True:
+            key = await self._queue.get()
+            member, role, wanted, reason = self._wanted.pop(key)
+            self._in_flight.add(key)
+            try:
+                await self._apply(key, member, role, wanted, reason)
+            except discord.Forbidden:
+                log.error(
+                    "Failed to update role %s: Missing permissions",
+                    role.name,
+                    extra={"guild_id": key[0], "user_id": key[1], "role_id": key[2]},
+                )
+            except Exception as e:
+                log.error(
+                    "Failed to update role %s: %s",
+                    role.name,
+                    e,
+                    extra={"guild_id": key[0], "user_id": key[1], "role_id": key[2]},
+                )
+            finally:
+                self._in_flight.discard(key)
+                if key in self._wanted:
+                    self._queue.put_nowait(key)
+                self._queue.task_done()
+
+    # Waits until all queued changes were applied
+    async def join(self):
+        if self._queue is not None:
+            await self._queue.join()
@@ -0,0 +1,159 @@
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import math
+import os
+import time
+from typing import Awaitable, Callable
+
+log = logging.getLogger(__name__)
+
+# Runs actions at a later time from a single timer task, instead of one
+# sleeping task per action. Timers are kept in a heap and, if a path is
+# given, in a JSON file, so pending timers survive a restart. Due times are
+# rounded up to whole ticks, and all timers of a tick are handed to on_expire
+# as one batch. Changes are written to the file by the timer task, at most
+# once every save_interval_seconds and off the event loop.
+
+
+class TimerScheduler:
+    def __init__(
+        self,
+        on_expire: Callable[[list[dict]], Awaitable[None]],
+        path: str | None = None,
+        tick_seconds: float = 1.0,
+        save_interval_seconds: float = 5.0,
+    ):
+        self.on_expire = on_expire
+        self.path = path
+        self.tick_seconds = tick_seconds
+        self.save_interval_seconds = save_interval_seconds
+        # Key -> (due time as UNIX timestamp, payload)
+        self._timers: dict[str, tuple[float, dict]] = {}
+        # (due time, sequence number, key), outdated entries are skipped
+        self._heap: list[tuple[float, int, str]] = []
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        # Monotonic time at which unsaved changes are written, None if there
+        # are none
+        self._save_at: float | None = None
+        if path and os.path.exists(path):
+            try:
+                with open(path) as file:
+                    for timer in json.load(file):
+                        self._push(timer["key"], timer["due_at"], timer["payload"])
+            except (OSError, ValueError, KeyError) as e:
+                log.error("Failed to load timers from %s: %s", path, e)
+
+    def __len__(self) -> int:
+        return len(self._timers)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._timers
+
+    def _push(self, key: str, due_at: float, payload: dict):
+        self._timers[key] = (due_at, payload)
+        heapq.heappush(self._heap, (due_at, next(self._sequence), key))
+
+    # Runs on_expire with the payload after delay_seconds. Replaces an
+    # existing timer with the same key.
+    def schedule(self, key: str, delay_seconds: float, payload: dict):
+        self.schedule_many([(key, delay_seconds, payload)])
+
+    # Like schedule for several (key, delay, payload) timers
+    def schedule_many(self, timers: list[tuple[str, float, dict]]):
+        if not timers:
+            return
+        now = time.time()
+        for key, delay_seconds, payload in timers:
+            due_at = now + max(0.0, delay_seconds)
+            if self.tick_seconds > 0:
+                due_at = math.ceil(due_at / self.tick_seconds) * self.tick_seconds
+            self._push(key, due_at, payload)
+            if self._heap[0][2] == key:
+                self._wakeup.set()
+        self._mark_dirty()
+
+    def cancel(self, key: str):
+        if self._timers.pop(key, None) is not None:
+            self._mark_dirty()
+
+    # Starts the timer task, once there is a running event loop. Timers that
+    # became due while the bot was offline expire right away.
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    # Writes unsaved changes right away, e.g. before the bot exits
+    def flush(self):
+        if self._save_at is not None:
+            self._save_at = None
+            self._write(self._snapshot())
+
+    def _mark_dirty(self):
+        if not self.path or self._save_at is not None:
+            return
+        self._save_at = time.monotonic() + self.save_interval_seconds
+        # The timer task may be sleeping until a later due time
+        self._wakeup.set()
+
+    def _snapshot(self) -> list[dict]:
+        return [
+            {"key": key, "due_at": due_at, "payload": payload}
+            for key, (due_at, payload) in self._timers.items()
+        ]
+
+    def _write(self, timers: list[dict]):
+        try:
+            temporary_path = f"{self.path}.tmp"
+            with open(temporary_path, "w") as file:
+                json.dump(timers, file)
+            os.replace(temporary_path, self.path)
+        except OSError as e:
+            log.error("Failed to save timers to %s: %s", self.path, e)
+
+    async def _save(self):
+        self._save_at = None
+        await asyncio.to_thread(self._write, self._snapshot())
+
+    def _pop_due(self, now: float) -> list[dict]:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due_at, _, key = heapq.heappop(self._heap)
+            timer = self._timers.get(key)
+            if timer is None or timer[0] != due_at:
+                continue  # cancelled or rescheduled
+            del self._timers[key]
+            due.append(timer[1])
+        return due
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            # Drop outdated heap entries before deciding how long to sleep
+            while self._heap and (
+                self._timers.get(self._heap[0][2], (None,))[0] != self._heap[0][0]
+            ):
+                heapq.heappop(self._heap)
+            timeouts = []
+            if self._heap:
+                timeouts.append(max(0.0, self._heap[0][0] - time.time()))
+            if self._save_at is not None:
+                timeouts.append(max(0.0, self._save_at - time.monotonic()))
+            try:
+                async with asyncio.timeout(min(timeouts, default=None)):
+                    await self._wakeup.wait()
+            except TimeoutError:
+                pass
+            due = self._pop_due(time.time())
+            if due:
+                self._mark_dirty()
+                try:
+                    await self.on_expire(due)
+                except Exception as e:
+                    log.error("Failed to handle %d expired timers: %s", len(due), e)
+            if self._save_at is not None and time.monotonic() >= self._save_at:
+                await self._save()
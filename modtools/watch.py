@@ -0,0 +1,69 @@
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable
+
+log = logging.getLogger(__name__)
+
+# Checks the modification time and size of a few files at an interval and
+# awaits on_change with the paths that changed. Polling works the same on
+# every platform and for files in bind mounts, where change notifications
+# don't always arrive. A file that is saved while it is read is reported
+# again at the next check.
+
+
+class FileWatcher:
+    def __init__(
+        self,
+        paths: list[str],
+        on_change: Callable[[list[str]], Awaitable[None]],
+        interval_seconds: float = 10.0,
+    ):
+        self.paths = list(paths)
+        self.on_change = on_change
+        self.interval_seconds = interval_seconds
+        self._states = {path: self._state(path) for path in self.paths}
+        self._task: asyncio.Task | None = None
+
+    @staticmethod
+    def _state(path: str) -> tuple[int, int] | None:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    # Returns the paths that changed since the last check, and takes their
+    # current state as the new one
+    def poll(self) -> list[str]:
+        changed = []
+        for path in self.paths:
+            state = self._state(path)
+            if state != self._states.get(path):
+                self._states[path] = state
+                changed.append(path)
+        return changed
+
+    # Starts checking, once there is a running event loop. Does nothing if
+    # the interval is 0 or it is already running.
+    def start(self):
+        if self.interval_seconds <= 0:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            changed = self.poll()
+            if not changed:
+                continue
+            try:
+                await self.on_change(changed)
+            except Exception:
+                log.exception("Failed to handle changed files %s", changed)
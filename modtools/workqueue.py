@@ -0,0 +1,151 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Awaitable, Callable
+
+log = logging.getLogger(__name__)
+
+# Moderation work, from most to least urgent
+PRIORITY_ENFORCE = 0  # deleting messages and quarantining members
+PRIORITY_SCAN = 1  # scanning attachments
+PRIORITY_NOTIFY = 2  # log messages and DMs
+PRIORITY_NAMES = {
+    PRIORITY_ENFORCE: "enforce",
+    PRIORITY_SCAN: "scan",
+    PRIORITY_NOTIFY: "notify",
+}
+
+
+# A bounded priority queue that is worked off by a fixed number of workers,
+# so that a raid can't start an unbounded number of downloads, OCR jobs and
+# requests. When the queue is full, the least urgent job is dropped, which
+# may be the new one. Jobs with a priority up to max_protected_priority are
+# never dropped, they are queued beyond max_size if there is nothing less
+# urgent to drop: a dropped scan would let a scam through unnoticed. Callers
+# can check busy to degrade their work early.
+class WorkQueue:
+    def __init__(
+        self,
+        workers: int = 4,
+        max_size: int = 200,
+        busy_fraction: float = 0.5,
+        max_protected_priority: int = PRIORITY_SCAN,
+    ):
+        self.workers = max(1, workers)
+        self.max_size = max(1, max_size)
+        self.busy_fraction = busy_fraction
+        self.max_protected_priority = max_protected_priority
+        # (priority, sequence number, time queued, function, arguments,
+        # message ID)
+        self._heap: list[tuple[int, int, float, Callable, tuple, int | None]] = []
+        self._sequence = itertools.count()
+        self._available: asyncio.Semaphore | None = None
+        self._tasks: list[asyncio.Task] = []
+        self.running = 0
+        self.processed_count = 0
+        self.shed_count = 0
+        self.shed_by_priority: dict[int, int] = {}
+        self.overflow_count = 0
+        # Moving average and maximum of the time jobs waited in the queue
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    @property
+    def depth(self) -> int:
+        return len(self._heap)
+
+    @property
+    def busy(self) -> bool:
+        return self.depth >= self.max_size * self.busy_fraction
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "depth": self.depth,
+            "running": self.running,
+            "processed": self.processed_count,
+            "shed": self.shed_count,
+            "shed_by_priority": {
+                PRIORITY_NAMES.get(priority, str(priority)): count
+                for priority, count in self.shed_by_priority.items()
+            },
+            "overflow": self.overflow_count,
+            "wait_seconds": self.wait_seconds,
+            "max_wait_seconds": self.max_wait_seconds,
+        }
+
+    # Queues fn(*args). The message ID identifies the job in the log, if it
+    # is dropped. Returns False, if the job was dropped because the queue is
+    # full of jobs that are at least as urgent.
+    def submit(
+        self,
+        priority: int,
+        fn: Callable[..., Awaitable[Any]],
+        *args: Any,
+        message_id: int | None = None,
+    ) -> bool:
+        if self._available is None:
+            self._available = asyncio.Semaphore(0)
+            self._tasks = [
+                asyncio.create_task(self._work()) for _ in range(self.workers)
+            ]
+        entry = (priority, next(self._sequence), time.monotonic(), fn, args, message_id)
+        if len(self._heap) >= self.max_size:
+            # Replace the least urgent, most recent job, if it may be dropped
+            # and the new one is more urgent. The number of jobs stays the same.
+            worst = max(self._heap)
+            if worst[0] > self.max_protected_priority and worst[0] > priority:
+                self._heap.remove(worst)
+                heapq.heapify(self._heap)
+                heapq.heappush(self._heap, entry)
+                self._dropped(worst)
+                return True
+            if priority > self.max_protected_priority:
+                self._dropped(entry)
+                return False
+            self.overflow_count += 1
+            log.warning(
+                "Work queue is full of urgent jobs, queued %s anyway",
+                fn.__name__,
+                extra={
+                    "event": "workqueue.overflow",
+                    "message_id": message_id,
+                    "priority": PRIORITY_NAMES.get(priority, priority),
+                    "depth": self.depth,
+                },
+            )
+        heapq.heappush(self._heap, entry)
+        self._available.release()
+        return True
+
+    def _dropped(self, entry: tuple):
+        priority, _, _, fn, _, message_id = entry
+        self.shed_count += 1
+        self.shed_by_priority[priority] = self.shed_by_priority.get(priority, 0) + 1
+        log.warning(
+            "Work queue is full, dropped %s",
+            fn.__name__,
+            extra={
+                "event": "workqueue.dropped",
+                "message_id": message_id,
+                "priority": PRIORITY_NAMES.get(priority, priority),
+                "depth": self.depth,
+            },
+        )
+
+    async def _work(self):
+        while True:
+            await self._available.acquire()
+            _, _, queued_at, fn, args, _ = heapq.heappop(self._heap)
+            waited = time.monotonic() - queued_at
+            self.wait_seconds = 0.9 * self.wait_seconds + 0.1 * waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+            self.running += 1
+            try:
+                await fn(*args)
+            except Exception as e:
+                log.exception("%s failed: %s", fn.__name__, e)
+            finally:
+                self.running -= 1
+                self.processed_count += 1
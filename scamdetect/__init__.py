@@ -1 +1,17 @@
-from .detect import scan_discord_attachments_for_scams, ScamScanResult
+from .detect import (
+    scan_discord_attachments_for_scams,
+    configure_ocr_executor,
+    configure_ocr_cache,
+    start_ocr_cache,
+    close_ocr_cache,
+    configure_attachment_limits,
+    configure_ocr_pipelines,
+    configure_scam_image_index,
+    configure_blacklist,
+    load_blacklist,
+    BLACKLIST_PATH,
+    remember_scam_images,
+    ScamScanResult,
+)
+from .executor import OcrQueueFull, OcrTimeout
+from .matcher import PatternListMatcher, PhraseMatcher
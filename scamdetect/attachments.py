@@ -0,0 +1,106 @@
+import math
+from dataclasses import dataclass
+from urllib.parse import urlencode, urlsplit, urlunsplit
+
+import discord
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".gif", ".bmp")
+# Image types that Pillow can't decode or that never contain scam text
+SKIPPED_CONTENT_TYPES = ("image/svg+xml",)
+
+
+# Bounds the bandwidth, memory and OCR time spent on the attachments of one
+# message. Images that exceed the byte or pixel budget are fetched as a
+# downscaled preview from Discord's media proxy instead of the original.
+@dataclass
+class AttachmentLimits:
+    max_attachments: int = 10
+    max_image_bytes: int = 8 * 1024 * 1024
+    max_image_pixels: int = 16 * 1024 * 1024
+    preview_max_dimension: int = 2048
+
+
+@dataclass
+class AttachmentDownload:
+    attachment: discord.Attachment
+    url: str
+    # Whether the downscaled preview is downloaded instead of the original
+    preview: bool
+
+
+def is_image_attachment(attachment: discord.Attachment) -> bool:
+    content_type = (attachment.content_type or "").split(";")[0].strip().lower()
+    if content_type:
+        return (
+            content_type.startswith("image/")
+            and content_type not in SKIPPED_CONTENT_TYPES
+        )
+    return attachment.filename.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def preview_url(attachment: discord.Attachment, width: int, height: int) -> str:
+    scheme, netloc, path, query, fragment = urlsplit(attachment.proxy_url)
+    size = urlencode({"width": width, "height": height})
+    query = f"{query}&{size}" if query else size
+    return urlunsplit((scheme, netloc, path, query, fragment))
+
+
+# Decides how an attachment is downloaded for scanning, based on the metadata
+# Discord sends with the message. Returns None, if it should not be scanned.
+def plan_attachment_download(
+    attachment: discord.Attachment, limits: AttachmentLimits
+) -> AttachmentDownload | None:
+    if not is_image_attachment(attachment):
+        return None
+    width = attachment.width or 0
+    height = attachment.height or 0
+    pixels = width * height
+    if attachment.size <= limits.max_image_bytes and pixels <= limits.max_image_pixels:
+        return AttachmentDownload(attachment, attachment.url, preview=False)
+    if pixels == 0:
+        # Too large, and without dimensions a preview can't be requested
+        return None
+    scale = min(
+        1.0,
+        limits.preview_max_dimension / max(width, height),
+        math.sqrt(limits.max_image_pixels / pixels),
+    )
+    preview_width = max(1, int(width * scale))
+    preview_height = max(1, int(height * scale))
+    return AttachmentDownload(
+        attachment,
+        preview_url(attachment, preview_width, preview_height),
+        preview=True,
+    )
+
+
+# Returns the attachments of a message that are scanned, at most
+# max_attachments of them. The last attachments are kept, since the last
+# image usually contains the most blacklisted phrases.
+def plan_attachment_downloads(
+    attachments: list[discord.Attachment], limits: AttachmentLimits
+) -> list[AttachmentDownload]:
+    downloads = []
+    for attachment in attachments:
+        download = plan_attachment_download(attachment, limits)
+        if download is not None:
+            downloads.append(download)
+    if limits.max_attachments > 0:
+        downloads = downloads[-limits.max_attachments :]
+    return downloads
+
+
+async def read_attachment_download(
+    download: AttachmentDownload, limits: AttachmentLimits
+) -> bytes:
+    if download.preview:
+        # Same HTTP client (and session) that Attachment.read() uses
+        data = await download.attachment._http.get_from_cdn(download.url)
+    else:
+        data = await download.attachment.read(use_cached=True)
+    if len(data) > limits.max_image_bytes:
+        raise ValueError(
+            f"Attachment {download.attachment.filename} has {len(data)} bytes, "
+            f"more than the limit of {limits.max_image_bytes}"
+        )
+    return data
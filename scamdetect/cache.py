@@ -0,0 +1,167 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+
+@dataclass
+class CachedOcrResult:
+    text: str
+    phrases: list[str]
+    # Identifies the phrase list the phrases were matched with. The OCR text
+    # stays valid when the phrase list changes, only the phrases are outdated.
+    matcher_version: str
+
+
+# Caches OCR results by the hash of the image data, so that reposted images
+# don't have to be OCR'd again. An in-memory LRU sits in front of an optional
+# SQLite database, which keeps the results across restarts. Entries expire
+# after ttl_seconds, both stores are bounded in size. Writes to the database
+# are committed in batches, by count and by a periodic task, so that a scan
+# doesn't wait for the disk.
+class OcrCache:
+    PRUNE_INTERVAL = 256
+    # Number of writes after which they are committed
+    COMMIT_INTERVAL = 64
+
+    def __init__(
+        self,
+        max_entries: int = 4096,
+        ttl_seconds: float = 7 * 24 * 3600,
+        path: str | None = None,
+        max_disk_entries: int = 100000,
+        commit_interval_seconds: float = 5.0,
+    ):
+        self.max_entries = max(0, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_entries = max(0, max_disk_entries)
+        self.commit_interval_seconds = commit_interval_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[float, CachedOcrResult]] = OrderedDict()
+        self._puts_since_prune = 0
+        self._pending = 0
+        self._task: asyncio.Task | None = None
+        self._db: sqlite3.Connection | None = None
+        if path:
+            self._db = sqlite3.connect(path)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS ocr_results ("
+                "key TEXT PRIMARY KEY, text TEXT NOT NULL, phrases TEXT NOT NULL, "
+                "matcher_version TEXT NOT NULL, stored_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS ocr_results_stored_at "
+                "ON ocr_results (stored_at)"
+            )
+            self._db.commit()
+            self._prune_disk()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def key(data: bytes, pipeline_version: str) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        return f"{pipeline_version}:{len(data)}:{digest}"
+
+    def get(self, key: str) -> CachedOcrResult | None:
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            stored_at, result = entry
+            if now - stored_at <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return result
+            del self._entries[key]
+        if self._db is not None:
+            row = self._db.execute(
+                "SELECT text, phrases, matcher_version, stored_at "
+                "FROM ocr_results WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is not None and now - row[3] <= self.ttl_seconds:
+                result = CachedOcrResult(
+                    text=row[0], phrases=json.loads(row[1]), matcher_version=row[2]
+                )
+                self._remember(key, row[3], result)
+                self.hits += 1
+                return result
+        self.misses += 1
+        return None
+
+    def put(self, key: str, result: CachedOcrResult):
+        stored_at = time.time()
+        self._remember(key, stored_at, result)
+        if self._db is None:
+            return
+        self._db.execute(
+            "INSERT OR REPLACE INTO ocr_results "
+            "(key, text, phrases, matcher_version, stored_at) VALUES (?, ?, ?, ?, ?)",
+            (
+                key,
+                result.text,
+                json.dumps(result.phrases),
+                result.matcher_version,
+                stored_at,
+            ),
+        )
+        self._pending += 1
+        self._puts_since_prune += 1
+        if self._puts_since_prune >= self.PRUNE_INTERVAL:
+            self._prune_disk()
+        elif self._pending >= self.COMMIT_INTERVAL:
+            self.commit()
+
+    def _remember(self, key: str, stored_at: float, result: CachedOcrResult):
+        if self.max_entries == 0:
+            return
+        self._entries[key] = (stored_at, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _prune_disk(self):
+        self._puts_since_prune = 0
+        self._db.execute(
+            "DELETE FROM ocr_results WHERE stored_at < ?",
+            (time.time() - self.ttl_seconds,),
+        )
+        self._db.execute(
+            "DELETE FROM ocr_results WHERE key IN (SELECT key FROM ocr_results "
+            "ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,),
+        )
+        self.commit()
+
+    def commit(self):
+        self._pending = 0
+        if self._db is not None:
+            self._db.commit()
+
+    # Starts committing writes every commit_interval_seconds, once there is a
+    # running event loop
+    def start(self):
+        if self._db is not None and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.commit_interval_seconds)
+            if self._pending > 0:
+                self.commit()
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._db is not None:
+            self.commit()
+            self._db.close()
+            self._db = None
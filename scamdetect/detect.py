@@ -1,14 +1,32 @@
+import asyncio
+import hashlib
+import importlib.util
 import os
-import regex
 import sys
-import json
-from dataclasses import dataclass
+import logging
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
 from io import BytesIO
+from typing import Any, Callable, Coroutine
 import warnings
 
 import discord
 import pytesseract
-from PIL import Image, ImageEnhance, ImageFilter, ImageOps
+import regex
+from PIL import Image
+
+from .attachments import (
+    AttachmentDownload,
+    AttachmentLimits,
+    plan_attachment_downloads,
+    read_attachment_download,
+)
+from .cache import CachedOcrResult, OcrCache
+from .executor import OcrExecutor, OcrQueueFull, OcrTimeout
+from .matcher import PhraseMatcher
+from .phash import ScamImageIndex, image_data_dhash
+from .preprocess import DEFAULT_PIPELINES, Pipeline, build_pipeline
 
 warnings.filterwarnings(
     "ignore",
@@ -16,33 +34,49 @@ warnings.filterwarnings(
     category=UserWarning,
 )
 
+log = logging.getLogger(__name__)
+
 
 SCAM_PHRASE_COUNT_THRESHOLD = 3
+# Share of the OCR executor's slots that the jobs of one message may take at
+# once, so that a message with many images can't starve concurrent scans
+MESSAGE_OCR_SHARE = 0.25
 BLACKLIST_FILENAME = "blacklist.txt"
+# Bump this whenever a change to the image processing or OCR changes the
+# resulting text, so that cached results of the old pipeline are not reused.
+PIPELINE_VERSION = "2"
 
 
-with open(os.path.join(os.path.dirname(__file__), BLACKLIST_FILENAME)) as file:
-    blacklist_phrases = [
-        line.strip() for line in file.readlines() if len(line.strip()) > 0
-    ]
-    blacklist_patterns = [
-        regex.compile(
-            # Allow errors, if there are no symbols in the phrase and if the
-            # phrase exceeds a certain minimum length.
-            (
-                phrase
-                if (
-                    "\\." in phrase
-                    or "," in phrase
-                    or "\\$" in phrase
-                    or len(phrase) <= 6
-                )
-                else f"({phrase}){{e<=1}}"
-            ),
-            regex.MULTILINE | regex.IGNORECASE,
-        )
-        for phrase in blacklist_phrases
-    ]
+BLACKLIST_PATH = os.path.join(os.path.dirname(__file__), BLACKLIST_FILENAME)
+
+
+# Reads and compiles the phrases of a blacklist file. Raises OSError or
+# ValueError if the file can't be used, so that it is never swapped in.
+# Compiling a long list takes a while, reloads call this off the event loop.
+def load_blacklist(path: str = BLACKLIST_PATH) -> tuple[list[str], PhraseMatcher]:
+    with open(path) as file:
+        phrases = [line.strip() for line in file.readlines() if len(line.strip()) > 0]
+    if not phrases:
+        raise ValueError(f"{path} contains no phrases")
+    try:
+        matcher = PhraseMatcher(phrases)
+    except regex.error as e:
+        raise ValueError(f"Invalid phrase in {path}: {e}") from e
+    return phrases, matcher
+
+
+# Replaces the blacklist for all scans from now on. Cached OCR results of the
+# old phrases are matched again when they are used.
+def configure_blacklist(phrases: list[str], matcher: PhraseMatcher):
+    global blacklist_phrases, blacklist_matcher, blacklist_patterns
+    global BLACKLIST_VERSION
+    blacklist_phrases = phrases
+    blacklist_matcher = matcher
+    blacklist_patterns = matcher.patterns
+    BLACKLIST_VERSION = hashlib.sha256("\n".join(phrases).encode()).hexdigest()
+
+
+configure_blacklist(*load_blacklist())
 
 # print(json.dumps([p.pattern for p in blacklist_patterns], indent=2))
 
@@ -51,89 +85,536 @@ def image_from_data(data: bytes) -> Image:
     return Image.open(BytesIO(data))
 
 
-def enhanced_image(image: Image) -> Image:
-    image = image.filter(ImageFilter.UnsharpMask(radius=5, percent=100, threshold=3))
-    return image
+# https://pyimagesearch.com/2021/11/15/tesseract-page-segmentation-modes-psms-explained-how-to-improve-your-ocr-accuracy/
+# PSM 11: Sparse text. Find as much text as possible in no particular order.
+TESSERACT_PSM = 11
+
+
+class OcrBackend(ABC):
+    name = ""
+
+    @abstractmethod
+    def image_to_text(self, image: Image, timeout: float = 0) -> str: ...
+
+
+# Runs the tesseract command for every image. Each call writes the image to a
+# temporary file, starts a process and loads the language data again.
+class PytesseractBackend(OcrBackend):
+    name = "pytesseract"
+
+    def image_to_text(self, image: Image, timeout: float = 0) -> str:
+        config = f"--psm {TESSERACT_PSM}"
+        # The resolution set by preprocessing, so that tesseract doesn't guess it.
+        dpi = image.info.get("dpi")
+        if dpi:
+            config += f" --dpi {int(dpi[0])}"
+        # A timeout kills the tesseract process, so a stuck job can't hold a
+        # worker.
+        return pytesseract.image_to_string(image, config=config, timeout=timeout)
+
+
+# Calls the tesseract library in-process through the tesserocr binding. The
+# engine and the language data are loaded once per worker process and then
+# reused for every image, which is passed in memory.
+class TesserocrBackend(OcrBackend):
+    name = "tesserocr"
+
+    def __init__(self):
+        import tesserocr
+
+        self._api = tesserocr.PyTessBaseAPI(psm=TESSERACT_PSM)
+
+    def image_to_text(self, image: Image, timeout: float = 0) -> str:
+        self._api.SetImage(image)
+        dpi = image.info.get("dpi")
+        if dpi:
+            self._api.SetSourceResolution(int(dpi[0]))
+        if not self._api.Recognize(timeout=int(timeout * 1000)):
+            raise TimeoutError(f"OCR did not finish within {timeout} seconds")
+        return self._api.GetUTF8Text()
+
+
+OCR_BACKENDS: dict[str, type[OcrBackend]] = {
+    backend.name: backend for backend in (PytesseractBackend, TesserocrBackend)
+}
 
+# The backend of the current process. OCR worker processes replace it in
+# init_ocr_worker with the configured one.
+ocr_backend: OcrBackend = PytesseractBackend()
 
-def image_to_text(image: Image) -> str:
-    # https://pyimagesearch.com/2021/11/15/tesseract-page-segmentation-modes-psms-explained-how-to-improve-your-ocr-accuracy/
-    # PSM 11: Sparse text. Find as much text as possible in no particular order.
-    text = pytesseract.image_to_string(image, config="--psm 11")
+
+# Creates the backend once, so that a missing library or language data shows
+# up at startup instead of failing every job in the worker processes.
+def is_ocr_backend_available(name: str) -> bool:
+    if name not in OCR_BACKENDS:
+        return False
+    if name == TesserocrBackend.name:
+        if importlib.util.find_spec("tesserocr") is None:
+            log.warning("OCR backend %s is not installed", name)
+            return False
+        try:
+            OCR_BACKENDS[name]()
+        except Exception as e:
+            log.warning("OCR backend %s failed to initialize: %s", name, e)
+            return False
+    return True
+
+
+def init_ocr_worker(backend_name: str):
+    global ocr_backend
+    try:
+        ocr_backend = OCR_BACKENDS[backend_name]()
+    except Exception as e:
+        # Keeps the worker usable for the other jobs (e.g. image hashes)
+        log.error(
+            "OCR backend %s failed to initialize in a worker, using %s: %s",
+            backend_name,
+            PytesseractBackend.name,
+            e,
+        )
+        ocr_backend = PytesseractBackend()
+
+
+def image_to_text(image: Image, timeout: float = 0) -> str:
+    text = ocr_backend.image_to_text(image, timeout=timeout)
     # Normalize whitespace, just in case.
     return " ".join(text.split())
 
 
 def find_text_scam_phrases(text: str, debug_log: bool = False) -> list[str]:
-    matches = []
-    for pattern in blacklist_patterns:
-        match = pattern.search(text)
-        if match is not None:
-            i, j = match.span()
-            match_text = text[i:j].lower().strip()
-            if debug_log:
-                print(f"MATCH {match_text}")
-            matches.append(match_text)
-    return matches
+    return blacklist_matcher.find(text, debug_log=debug_log)
+
+
+@dataclass
+class OcrJobResult:
+    text: str
+    # Seconds spent decoding, in each preprocessing stage and in OCR, and the
+    # CPU seconds of the whole job as "cpu"
+    timings: dict[str, float]
+
+
+# CPU time of this process and of its finished child processes, which
+# includes the tesseract processes started by pytesseract.
+def cpu_time() -> float:
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+# Runs in a worker process of the OCR executor, so that decoding,
+# preprocessing and OCR of an image never block the event loop.
+def ocr_job(data: bytes, pipeline: Pipeline, timeout: float = 0) -> OcrJobResult:
+    cpu_start = cpu_time()
+    start = time.perf_counter()
+    image = image_from_data(data)
+    image.load()
+    timings = {"decode": time.perf_counter() - start}
+    image, stage_timings = pipeline.run(image)
+    timings.update(stage_timings)
+    start = time.perf_counter()
+    text = image_to_text(image, timeout=timeout)
+    timings["ocr"] = time.perf_counter() - start
+    timings["cpu"] = cpu_time() - cpu_start
+    return OcrJobResult(text=text, timings=timings)
+
+
+ocr_executor = OcrExecutor()
+# The backend of the OCR worker processes. Backends read the same image
+# differently, so it is part of the cache key.
+ocr_backend_name = PytesseractBackend.name
+
+
+def configure_ocr_executor(
+    workers: int = 2,
+    queue_size: int = 16,
+    timeout_seconds: float = 30.0,
+    queue_timeout_seconds: float = 60.0,
+    backend: str = PytesseractBackend.name,
+):
+    global ocr_executor, ocr_backend_name
+    if backend not in OCR_BACKENDS:
+        raise ValueError(
+            f"Unknown OCR backend {backend}, expected one of {', '.join(OCR_BACKENDS)}"
+        )
+    if not is_ocr_backend_available(backend):
+        log.warning(
+            "OCR backend %s is not available, falling back to %s",
+            backend,
+            PytesseractBackend.name,
+        )
+        backend = PytesseractBackend.name
+    ocr_backend_name = backend
+    ocr_executor.shutdown()
+    ocr_executor = OcrExecutor(
+        workers=workers,
+        queue_size=queue_size,
+        timeout_seconds=timeout_seconds,
+        queue_timeout_seconds=queue_timeout_seconds,
+        initializer=init_ocr_worker,
+        initargs=(backend,),
+    )
+
+
+async def ocr_attachment_data(data: bytes, pipeline: Pipeline) -> OcrJobResult:
+    result = await ocr_executor.run(
+        ocr_job, data, pipeline, ocr_executor.timeout_seconds
+    )
+    log.debug(
+        "OCR %s",
+        pipeline.name,
+        extra={"event": "scamdetect.ocr", "timings": result.timings},
+    )
+    return result
+
+
+ocr_pipelines = dict(DEFAULT_PIPELINES)
+
+
+# Replaces the pipelines of the first and second pass with the configured
+# ones. Raises ValueError for invalid configurations, without changing
+# anything.
+def configure_ocr_pipelines(specs: dict[str, list]):
+    global ocr_pipelines
+    pipelines = dict(DEFAULT_PIPELINES)
+    for name, spec in specs.items():
+        if name not in DEFAULT_PIPELINES:
+            raise ValueError(
+                f"Unknown pipeline {name}, expected one of "
+                f"{', '.join(DEFAULT_PIPELINES)}"
+            )
+        pipelines[name] = build_pipeline(name, spec)
+    ocr_pipelines = pipelines
+
+
+ocr_cache = OcrCache()
+
+
+def configure_ocr_cache(
+    max_entries: int = 4096,
+    ttl_seconds: float = 7 * 24 * 3600,
+    path: str | None = None,
+):
+    global ocr_cache
+    ocr_cache.close()
+    ocr_cache = OcrCache(max_entries=max_entries, ttl_seconds=ttl_seconds, path=path)
+
+
+# Starts committing cache writes periodically, once there is a running event
+# loop
+def start_ocr_cache():
+    ocr_cache.start()
+
+
+def close_ocr_cache():
+    ocr_cache.close()
+
+
+# Adds the CPU seconds of the OCR job to timings, under the name of the
+# pipeline. Cached results add nothing.
+async def find_attachment_data_scam_phrases(
+    data: bytes, pipeline: Pipeline, timings: dict[str, float] | None = None
+) -> list[str]:
+    key = OcrCache.key(
+        data, f"{PIPELINE_VERSION}-{ocr_backend_name}-{pipeline.fingerprint}"
+    )
+    cached = ocr_cache.get(key)
+    if cached is not None:
+        if cached.matcher_version != BLACKLIST_VERSION:
+            # The phrase list changed since, but the OCR text is still valid.
+            cached = CachedOcrResult(
+                text=cached.text,
+                phrases=find_text_scam_phrases(cached.text),
+                matcher_version=BLACKLIST_VERSION,
+            )
+            ocr_cache.put(key, cached)
+        return list(cached.phrases)
+    ocr_result = await ocr_attachment_data(data, pipeline)
+    if timings is not None:
+        timing_key = f"{pipeline.name}_cpu"
+        timings[timing_key] = timings.get(timing_key, 0.0) + ocr_result.timings["cpu"]
+    text = ocr_result.text
+    phrases = find_text_scam_phrases(text)
+    ocr_cache.put(
+        key,
+        CachedOcrResult(
+            text=text, phrases=list(phrases), matcher_version=BLACKLIST_VERSION
+        ),
+    )
+    return phrases
+
+
+attachment_limits = AttachmentLimits()
+
+
+def configure_attachment_limits(
+    max_attachments: int = 10,
+    max_image_bytes: int = 8 * 1024 * 1024,
+    max_image_pixels: int = 16 * 1024 * 1024,
+    preview_max_dimension: int = 2048,
+):
+    global attachment_limits
+    attachment_limits = AttachmentLimits(
+        max_attachments=max_attachments,
+        max_image_bytes=max_image_bytes,
+        max_image_pixels=max_image_pixels,
+        preview_max_dimension=preview_max_dimension,
+    )
+
+
+scam_image_index = ScamImageIndex()
+
+
+def configure_scam_image_index(path: str | None = None, max_distance: int = 12):
+    global scam_image_index
+    scam_image_index = ScamImageIndex(path=path, max_distance=max_distance)
+    log.info("Loaded %d known scam image hashes", len(scam_image_index))
+
+
+# Called once a scan result was confirmed by deleting the message, so that
+# reposts of the same images are recognized without OCR.
+def remember_scam_images(image_hashes: list[int]) -> int:
+    return sum(1 for value in image_hashes if scam_image_index.add(value))
+
+
+class KnownScamImage(Exception):
+    def __init__(self, distance: int, phrases: list[str]):
+        super().__init__(f"Image matches a known scam image (distance {distance})")
+        self.distance = distance
+        self.phrases = phrases
 
 
 @dataclass
 class ScamScanResult:
     is_scam: bool
     phrases: list[str]
+    # Perceptual hashes of the attachments in which scam phrases were found.
+    # Empty for a known scam image, whose hash is already in the index.
+    image_hashes: list[int] = field(default_factory=list)
+    # Set, if an attachment with a scam phrase was a near match of a known
+    # scam image
+    known_image_distance: int | None = None
+    # Number of attachments whose scan was not finished, because the OCR
+    # workers were overloaded or too slow. A result that is not a scam can
+    # only be relied on if this is 0, otherwise the scan should be repeated.
+    unscanned: int = 0
+    # Wall clock seconds of each pass and the summed download seconds, and
+    # the CPU seconds of the OCR workers per pass ("first_pass_cpu")
+    timings: dict[str, float] = field(default_factory=dict)
 
 
+def count_phrases(phrases_by_attachment: dict[int, list[str]]) -> int:
+    return sum(len(phrases) for phrases in phrases_by_attachment.values())
+
+
+# Runs the jobs of all (attachment index, job) pairs concurrently and stores
+# the found phrases of each attachment in phrases_by_attachment, keeping the
+# longer list if the attachment already has phrases from a previous pass.
+# Attachments whose job was rejected or timed out by the OCR executor are
+# added to unscanned, unlike images that can't be read, they may still be a
+# scam. Once the combined phrase count reaches the threshold, all
+# outstanding jobs are cancelled.
+async def run_scan_jobs(
+    jobs: list[tuple[int, Coroutine[Any, Any, list[str]]]],
+    phrases_by_attachment: dict[int, list[str]],
+    unscanned: set[int],
+    error_label: str,
+    limit: asyncio.Semaphore | None = None,
+) -> int:
+    async def run(job: Coroutine[Any, Any, list[str]]) -> list[str]:
+        try:
+            if limit is None:
+                return await job
+            async with limit:
+                return await job
+        finally:
+            # A job that was cancelled while it waited never started
+            job.close()
+
+    tasks = {asyncio.create_task(run(job)): index for index, job in jobs}
+    pending = set(tasks)
+    completed_count = 0
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                index = tasks[task]
+                try:
+                    scam_phrases = task.result()
+                except KnownScamImage:
+                    raise
+                except (OcrQueueFull, OcrTimeout) as e:
+                    unscanned.add(index)
+                    log.warning(
+                        "Could not scan %s %d for scam phrases: %s",
+                        error_label,
+                        index,
+                        e,
+                    )
+                    continue
+                except Exception as e:
+                    log.warning(
+                        "Failed to read %s for scam phrase detection: %s",
+                        error_label,
+                        e,
+                    )
+                    continue
+                completed_count += 1
+                if len(scam_phrases) >= len(phrases_by_attachment.get(index, [])):
+                    phrases_by_attachment[index] = scam_phrases
+                if count_phrases(phrases_by_attachment) >= SCAM_PHRASE_COUNT_THRESHOLD:
+                    return completed_count
+    finally:
+        for task in tasks:
+            task.cancel()
+    return completed_count
+
+
+# With enhanced_pass=False, the second pass is skipped, to save OCR time
+# when the bot is under load. Scams are then only detected by the first pass.
+# on_download is called with every original attachment that was downloaded,
+# so that the caller can keep the data instead of downloading it again.
 async def scan_discord_attachments_for_scams(
     attachments: list[discord.Attachment],
+    enhanced_pass: bool = True,
+    on_download: Callable[[discord.Attachment, bytes], None] | None = None,
 ) -> ScamScanResult:
-    if len(attachments) == 0:
-        return False
-    # Count the number of scam phrases and once we reach a specific threshold,
-    # consider the list of attachments a scam. Start with the last image, since
-    # that is usually the "success" one that contains lots of blacklisted
-    # phrases. This should improve scam recognition times.
-    found_scam_phrases = []
-    attachment_images = []
-    detection_count = 0
-    for attachment in reversed(attachments):
-        try:
-            data = await attachment.read(use_cached=True)
-            image = image_from_data(data)
-            attachment_images.append(image)
-            scam_phrases = find_text_scam_phrases(image_to_text(image))
-            detection_count += 1
-            found_scam_phrases.extend(scam_phrases)
-        except Exception as e:
-            print(f"Error: Failed to read attachment for scam phrase detection: {e}")
-            continue
-        if len(found_scam_phrases) >= SCAM_PHRASE_COUNT_THRESHOLD:
-            break
-    second_pass = False
-    if len(found_scam_phrases) < SCAM_PHRASE_COUNT_THRESHOLD:
-        found_scam_phrases = []
-        second_pass = True
-        for image in attachment_images:
-            try:
-                image = enhanced_image(image)
-                scam_phrases = find_text_scam_phrases(image_to_text(image))
-                detection_count += 1
-                found_scam_phrases.extend(scam_phrases)
-            except Exception as e:
-                print(
-                    f"Error: Failed to read enhanced attachment for scam phrase detection: {e}"
-                )
-            continue
-            found_scam_phrases.extend(scam_phrases)
-            if len(found_scam_phrases) >= SCAM_PHRASE_COUNT_THRESHOLD:
-                break
+    # Only images are downloaded, and those that are too large are replaced
+    # by a downscaled preview, according to the attachment metadata.
+    limits = attachment_limits
+    pipelines = ocr_pipelines
+    downloads = plan_attachment_downloads(attachments, limits)
+    if len(downloads) < len(attachments):
+        log.info(
+            "Skipped %d of %d attachments for scam phrase detection",
+            len(attachments) - len(downloads),
+            len(attachments),
+        )
+    if len(downloads) == 0:
+        return ScamScanResult(is_scam=False, phrases=[])
+    # Download and OCR all attachments concurrently. Count the number of scam
+    # phrases and once we reach a specific threshold, consider the list of
+    # attachments a scam and cancel the remaining jobs. Jobs are submitted
+    # starting with the last image, since that is usually the "success" one
+    # that contains lots of blacklisted phrases.
+    attachment_data: dict[int, bytes] = {}
+    image_hashes: dict[int, int] = {}
+    phrases_by_attachment: dict[int, list[str]] = {}
+    unscanned: set[int] = set()
+    timings: dict[str, float] = {}
+    # Attachments are downloaded and scanned a few at a time, starting with
+    # the last one. The rest waits here instead of in the OCR executor.
+    limit = asyncio.Semaphore(max(1, int(ocr_executor.capacity * MESSAGE_OCR_SHARE)))
+
+    async def first_pass(index: int, download: AttachmentDownload):
+        start = time.perf_counter()
+        data = await read_attachment_download(download, limits)
+        timings["download"] = timings.get("download", 0.0) + (
+            time.perf_counter() - start
+        )
+        if on_download is not None and not download.preview:
+            on_download(download.attachment, data)
+        # Reposts of known scam images are recognized by their perceptual
+        # hash. Similar looking images aren't always scams, a match still
+        # needs a scam phrase from the first pass, but not the threshold.
+        image_hashes[index] = await ocr_executor.run(image_data_dhash, data)
+        distance = scam_image_index.find(image_hashes[index])
+        scam_phrases = await find_attachment_data_scam_phrases(
+            data, pipelines["first_pass"], timings
+        )
+        if distance is not None and scam_phrases:
+            raise KnownScamImage(distance, scam_phrases)
+        attachment_data[index] = data
+        return scam_phrases
+
+    async def second_pass(index: int):
+        data = attachment_data[index]
+        return await find_attachment_data_scam_phrases(
+            data, pipelines["second_pass"], timings
+        )
+
+    indices = reversed(range(len(downloads)))
+    start = time.perf_counter()
+    try:
+        detection_count = await run_scan_jobs(
+            [(i, first_pass(i, downloads[i])) for i in indices],
+            phrases_by_attachment,
+            unscanned,
+            "attachment",
+            limit,
+        )
+    except KnownScamImage as e:
+        timings["first_pass"] = time.perf_counter() - start
+        result = ScamScanResult(
+            is_scam=True,
+            phrases=e.phrases,
+            known_image_distance=e.distance,
+            timings=timings,
+        )
+        log.info(
+            "Scanned Discord attachments",
+            extra={
+                "event": "scamdetect.scan",
+                "is_scam": result.is_scam,
+                "known_image_distance": e.distance,
+                "phrases": e.phrases,
+                "timings": timings,
+            },
+        )
+        return result
+    timings["first_pass"] = time.perf_counter() - start
+    # Only images that were read successfully but whose first pass didn't
+    # find enough phrases get a second pass with an enhanced image.
+    second_pass_indices = [
+        i
+        for i in sorted(attachment_data, reverse=True)
+        if len(phrases_by_attachment.get(i, [])) < SCAM_PHRASE_COUNT_THRESHOLD
+    ]
+    second_pass_done = False
+    if (
+        enhanced_pass
+        and count_phrases(phrases_by_attachment) < SCAM_PHRASE_COUNT_THRESHOLD
+        and len(second_pass_indices) > 0
+    ):
+        second_pass_done = True
+        start = time.perf_counter()
+        detection_count += await run_scan_jobs(
+            [(i, second_pass(i)) for i in second_pass_indices],
+            phrases_by_attachment,
+            unscanned,
+            "enhanced attachment",
+            limit,
+        )
+        timings["second_pass"] = time.perf_counter() - start
+    found_scam_phrases = [
+        phrase
+        for i in sorted(phrases_by_attachment, reverse=True)
+        for phrase in phrases_by_attachment[i]
+    ]
     result = ScamScanResult(
         is_scam=len(found_scam_phrases) >= SCAM_PHRASE_COUNT_THRESHOLD,
         phrases=found_scam_phrases,
+        # Other images of the message, e.g. a harmless meme, must not make
+        # future posts of them look like scams.
+        image_hashes=[
+            image_hashes[i]
+            for i in sorted(phrases_by_attachment, reverse=True)
+            if phrases_by_attachment[i] and i in image_hashes
+        ],
+        unscanned=len(unscanned),
+        timings=timings,
     )
-    print(
-        f"Scanned Discord attachments: "
-        f"is_scam={result.is_scam} detection_count={detection_count} "
-        f"second_pass={second_pass} phrases={found_scam_phrases}"
+    log.info(
+        "Scanned Discord attachments",
+        extra={
+            "event": "scamdetect.scan",
+            "is_scam": result.is_scam,
+            "detection_count": detection_count,
+            "second_pass": second_pass_done,
+            "unscanned": len(unscanned),
+            "phrases": found_scam_phrases,
+            "timings": timings,
+        },
     )
     return result
 
@@ -143,15 +624,10 @@ if __name__ == "__main__":
     print(path)
     with open(path, "rb") as file:
         data = file.read()
-        image = image_from_data(data)
-        text = image_to_text(image)
-        print("NORMAL", len(text), text)
-        n = find_text_scam_phrases(text, debug_log=True)
-        print(n)
-
-        eimage = enhanced_image(image)
-        eimage.save("out.jpg")
-        etext = image_to_text(eimage)
-        print("ENHANCED", len(etext), etext)
-        m = find_text_scam_phrases(etext, debug_log=True)
-        print(m)
+        for name, pipeline in DEFAULT_PIPELINES.items():
+            image, timings = pipeline.run(image_from_data(data))
+            image.save(f"out-{name}.png")
+            text = image_to_text(image)
+            print(name.upper(), len(text), text)
+            print(timings)
+            print(find_text_scam_phrases(text, debug_log=True))
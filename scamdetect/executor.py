@@ -0,0 +1,112 @@
+import asyncio
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable
+
+
+class OcrQueueFull(Exception):
+    pass
+
+
+class OcrTimeout(Exception):
+    pass
+
+
+# Runs CPU-bound image work in a pool of worker processes, so that the event
+# loop never blocks on it. At most `workers + queue_size` jobs are submitted
+# at once, further jobs wait for a free slot. A job that didn't get a slot
+# within `queue_timeout_seconds` is rejected with OcrQueueFull, which means
+# that the executor is overloaded and the job should be tried again later.
+# Each job is awaited for at most `timeout_seconds`. A job that is given up
+# keeps its slot until its worker is really done with it, so that the pool
+# never gets more work than it can take.
+class OcrExecutor:
+    def __init__(
+        self,
+        workers: int = 2,
+        queue_size: int = 16,
+        timeout_seconds: float = 30.0,
+        queue_timeout_seconds: float = 60.0,
+        initializer: Callable[..., None] | None = None,
+        initargs: tuple = (),
+    ):
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self.timeout_seconds = timeout_seconds
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self._initializer = initializer
+        self._initargs = initargs
+        self._pool: ProcessPoolExecutor | None = None
+        self._slots = asyncio.Semaphore(self.capacity)
+        self._pending = 0
+
+    # Number of jobs that can be submitted without waiting
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.queue_size
+
+    # Number of jobs that wait for a slot or were submitted
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # Created lazily, so that importing the module doesn't spawn processes.
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=self._initializer,
+                initargs=self._initargs,
+            )
+        return self._pool
+
+    def _submit(self, fn: Callable[..., Any], *args: Any) -> Future:
+        try:
+            return self._get_pool().submit(fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory), start with a fresh pool.
+            self.shutdown()
+            return self._get_pool().submit(fn, *args)
+
+    def _release_later(self, loop: asyncio.AbstractEventLoop, future: Future):
+        def release(_):
+            try:
+                loop.call_soon_threadsafe(self._slots.release)
+            except RuntimeError:
+                pass  # The event loop is closed
+
+        future.add_done_callback(release)
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        self._pending += 1
+        try:
+            try:
+                async with asyncio.timeout(self.queue_timeout_seconds):
+                    await self._slots.acquire()
+            except TimeoutError:
+                raise OcrQueueFull(
+                    f"No OCR worker became available within "
+                    f"{self.queue_timeout_seconds} seconds "
+                    f"({self._pending} pending jobs)"
+                )
+            try:
+                future = self._submit(fn, *args)
+            except BaseException:
+                self._slots.release()
+                raise
+            self._release_later(asyncio.get_running_loop(), future)
+            try:
+                return await asyncio.wait_for(
+                    asyncio.wrap_future(future), self.timeout_seconds
+                )
+            except asyncio.TimeoutError:
+                raise OcrTimeout(
+                    f"OCR job did not finish within {self.timeout_seconds} seconds"
+                )
+        finally:
+            self._pending -= 1
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,284 @@
+import re
+
+import regex
+
+
+def is_fuzzy_phrase(phrase: str) -> bool:
+    # Allow errors, if there are no symbols in the phrase and if the
+    # phrase exceeds a certain minimum length.
+    return not ("\\." in phrase or "," in phrase or "\\$" in phrase or len(phrase) <= 6)
+
+
+def compile_phrase(phrase: str) -> regex.Pattern:
+    return regex.compile(
+        f"({phrase}){{e<=1}}" if is_fuzzy_phrase(phrase) else phrase,
+        regex.MULTILINE | regex.IGNORECASE,
+    )
+
+
+# Returns the runs of literal characters that every match of the pattern must
+# contain, or None if that can't be determined (e.g. top-level alternations or
+# unsupported syntax). Anything that isn't a plain character ends a run.
+def required_literal_runs(pattern: str) -> list[str] | None:
+    if "(?" in pattern:
+        return None  # inline flags (e.g. verbose) change how literals are read
+    runs = []
+    current = ""
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        literal = None
+        if c == "\\":
+            if i + 1 >= len(pattern):
+                return None
+            escaped = pattern[i + 1]
+            if escaped.isdigit() or escaped in "xuUNpPgLQE":
+                return None  # escapes with a payload or backreferences
+            if not escaped.isalnum():
+                literal = escaped
+            i += 2
+        elif c == "[":
+            j = i + 1
+            if j < len(pattern) and pattern[j] == "^":
+                j += 1
+            if j < len(pattern) and pattern[j] == "]":
+                j += 1
+            while j < len(pattern) and pattern[j] != "]":
+                j += 2 if pattern[j] == "\\" else 1
+            if j >= len(pattern):
+                return None
+            i = j + 1
+        elif c == "(":
+            depth = 0
+            j = i
+            while j < len(pattern):
+                if pattern[j] == "\\":
+                    j += 2
+                    continue
+                if pattern[j] == "[":
+                    j += 1
+                    while j < len(pattern) and pattern[j] != "]":
+                        j += 2 if pattern[j] == "\\" else 1
+                elif pattern[j] == "(":
+                    depth += 1
+                elif pattern[j] == ")":
+                    depth -= 1
+                    if depth == 0:
+                        break
+                j += 1
+            if j >= len(pattern):
+                return None
+            i = j + 1
+        elif c == "|" or c in ")]{}*+?":
+            return None  # alternation or a stray quantifier
+        elif c in ".^$":
+            i += 1
+        else:
+            literal = c
+            i += 1
+        # Look at the quantifier that follows the atom
+        quantifier = pattern[i] if i < len(pattern) else ""
+        if quantifier == "{":
+            end = pattern.find("}", i)
+            if end < 0:
+                return None
+            minimum = pattern[i + 1 : end].split(",")[0].strip()
+            i = end + 1
+        elif quantifier in ("?", "*", "+"):
+            minimum = "1" if quantifier == "+" else "0"
+            i += 1
+        else:
+            minimum = None
+        if quantifier and i < len(pattern) and pattern[i] in "?+":
+            i += 1  # lazy or possessive quantifier
+        if literal is not None and minimum not in ("0", ""):
+            current += literal
+        if literal is None or minimum is not None:
+            if current:
+                runs.append(current)
+            current = ""
+    if current:
+        runs.append(current)
+    return runs
+
+
+# Returns the longest literal that every match of the pattern contains.
+def pattern_anchors(pattern: str) -> list[str]:
+    runs = required_literal_runs(pattern)
+    if not runs:
+        return []
+    return [max(runs, key=len)]
+
+
+# Returns literals of which at least one is contained in every match of the
+# phrase pattern. An empty list means the phrase can't be filtered.
+def phrase_anchors(phrase: str) -> list[str]:
+    runs = required_literal_runs(phrase)
+    if not runs:
+        return []
+    runs = sorted(runs, key=len, reverse=True)
+    if not is_fuzzy_phrase(phrase):
+        return pattern_anchors(phrase)
+    # A single error breaks at most one of two disjoint literals, so one of
+    # them is always intact. Use the two longest runs or the two halves of the
+    # longest run, whichever has the longer shorter literal.
+    longest = runs[0]
+    half = len(longest) // 2
+    if len(runs) >= 2 and len(runs[1]) >= half:
+        return runs[:2]
+    if half == 0:
+        return []
+    return [longest[:half], longest[half:]]
+
+
+def is_same_char_ignorecase(a: str, b: str) -> bool:
+    return a == b or re.fullmatch(re.escape(a), b, re.IGNORECASE) is not None
+
+
+def build_trie(literals: list[str]) -> dict:
+    trie: dict = {}
+    for literal in literals:
+        node = trie
+        for c in literal:
+            node = node.setdefault(c, {})
+        node[""] = True
+    return trie
+
+
+# Regular expression that matches the longest literal of a trie at a
+# position. Built from the trie, so that its cost grows with the length of the
+# literals rather than with their number.
+def trie_regex(trie: dict) -> str:
+    alternatives = [
+        re.escape(c) + trie_regex(child) for c, child in sorted(trie.items()) if c
+    ]
+    if not alternatives:
+        return ""
+    if len(alternatives) == 1:
+        combined = alternatives[0]
+        optional = f"(?:{combined})?"
+    else:
+        combined = "(?:" + "|".join(alternatives) + ")"
+        optional = combined + "?"
+    # Greedy, so that the longer literal wins
+    return optional if "" in trie else combined
+
+
+# Finds which of many items may match a text in one pass over the text. Each
+# item has anchors, literals of which at least one is contained in every match
+# of the item. All anchors in the text are found with one regular expression,
+# items without anchors are candidates for every text.
+class LiteralPrefilter:
+    def __init__(self, anchors_by_item: list[list[str]]):
+        # Items that are candidates for every text
+        self._unfiltered: list[int] = []
+        # Items that are candidates, if one of their anchors is found
+        self._items_by_anchor: dict[str, list[int]] = {}
+        # Characters that match each other ignoring case are stored as the
+        # same character, so that only one path of the trie matches a text.
+        self._chars: dict[str, str] = {}
+        for index, anchors in enumerate(anchors_by_item):
+            anchors = [self._canonical(anchor) for anchor in anchors]
+            if not anchors:
+                self._unfiltered.append(index)
+            for anchor in anchors:
+                self._items_by_anchor.setdefault(anchor, []).append(index)
+        self._trie = build_trie(list(self._items_by_anchor))
+        self._regex = (
+            re.compile(f"(?=({trie_regex(self._trie)}))", re.IGNORECASE)
+            if self._items_by_anchor
+            else None
+        )
+
+    def _canonical(self, literal: str) -> str:
+        result = ""
+        for c in literal:
+            if c not in self._chars:
+                self._chars[c] = next(
+                    (
+                        other
+                        for other in self._chars.values()
+                        if is_same_char_ignorecase(other, c)
+                    ),
+                    c,
+                )
+            result += self._chars[c]
+        return result
+
+    # The regex only reports the longest anchor at each position. The shorter
+    # anchors at the same position are the ones on its trie path.
+    def _anchors_on_path(self, found: str) -> list[str]:
+        anchors = []
+        node = self._trie
+        prefix = ""
+        for c in found:
+            node_char = next(
+                (x for x in node if x and is_same_char_ignorecase(x, c)), None
+            )
+            if node_char is None:
+                break
+            node = node[node_char]
+            prefix += node_char
+            if "" in node:
+                anchors.append(prefix)
+        return anchors
+
+    # Returns the indices of the items that may match, in ascending order.
+    def candidates(self, text: str) -> list[int]:
+        indices = set(self._unfiltered)
+        if self._regex is not None:
+            found = set()
+            for match in self._regex.finditer(text):
+                found.add(match.group(1))
+            for longest in found:
+                for anchor in self._anchors_on_path(longest):
+                    indices.update(self._items_by_anchor[anchor])
+        return sorted(indices)
+
+
+# Finds the blacklisted phrases in a text in one pass over the text. Only the
+# patterns of phrases with a found anchor are searched for, the result is the
+# same as searching for every pattern one after another.
+class PhraseMatcher:
+    def __init__(self, phrases: list[str]):
+        self.phrases = phrases
+        self.patterns = [compile_phrase(phrase) for phrase in phrases]
+        self._prefilter = LiteralPrefilter([phrase_anchors(p) for p in phrases])
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+    def candidates(self, text: str) -> list[int]:
+        return self._prefilter.candidates(text)
+
+    def find(self, text: str, debug_log: bool = False) -> list[str]:
+        matches = []
+        for index in self.candidates(text):
+            match = self.patterns[index].search(text)
+            if match is not None:
+                i, j = match.span()
+                match_text = text[i:j].lower().strip()
+                if debug_log:
+                    print(f"MATCH {match_text}")
+                matches.append(match_text)
+        return matches
+
+
+# Finds the first of a list of regular expressions that matches a text, with
+# one pass over the text for texts that can't match any of them. The result is
+# the same as searching for every pattern one after another.
+class PatternListMatcher:
+    def __init__(self, patterns: list[str], flags: int = 0):
+        self.patterns = [re.compile(pattern, flags) for pattern in patterns]
+        self._prefilter = LiteralPrefilter(
+            [pattern_anchors(pattern) for pattern in patterns]
+        )
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+    def first_match(self, text: str) -> re.Pattern | None:
+        for index in self._prefilter.candidates(text):
+            if self.patterns[index].search(text):
+                return self.patterns[index]
+        return None
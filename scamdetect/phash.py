@@ -0,0 +1,152 @@
+import logging
+import os
+from io import BytesIO
+
+from PIL import Image
+
+log = logging.getLogger(__name__)
+
+# 16 x 16 = 256 bits. Discord screenshots share their layout, so 8 x 8 hashes
+# of different screenshots are often only a few bits apart.
+HASH_SIZE = 16
+HASH_BYTES = HASH_SIZE * HASH_SIZE // 8
+# Hashes of nearly uniform images (blank screenshots, solid colors) have only
+# a handful of set or unset bits and are close to each other regardless of
+# the content, so they are never used for matching.
+MIN_HASH_BITS = HASH_SIZE * HASH_SIZE // 8
+
+
+# Difference hash: shrink the image to (HASH_SIZE + 1) x HASH_SIZE grayscale
+# pixels and set one bit per pixel that is brighter than its right neighbour.
+# Re-encoding, rescaling and small crops only flip a few bits.
+def dhash(image: Image.Image) -> int:
+    image = image.convert("L").resize(
+        (HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS
+    )
+    pixels = image.tobytes()
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for column in range(HASH_SIZE):
+            left = pixels[offset + column]
+            right = pixels[offset + column + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+# Runs in a worker process of the OCR executor.
+def image_data_dhash(data: bytes) -> int:
+    image = Image.open(BytesIO(data))
+    # Lets the JPEG decoder skip most of the work for the tiny target size.
+    image.draft("L", (HASH_SIZE * 8, HASH_SIZE * 8))
+    return dhash(image)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def is_informative_hash(value: int) -> bool:
+    bits = value.bit_count()
+    return MIN_HASH_BITS <= bits <= HASH_SIZE * HASH_SIZE - MIN_HASH_BITS
+
+
+# BK-tree over the Hamming distance. Each child edge is labelled with the
+# distance between parent and child, so a search within max_distance only has
+# to descend into edges within max_distance of the distance to the parent.
+class BKTree:
+    __slots__ = ("_root", "_size")
+
+    def __init__(self):
+        # Nodes are [value, {distance: child node}]
+        self._root: list | None = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, value: int) -> bool:
+        if self._root is None:
+            self._root = [value, {}]
+            self._size += 1
+            return True
+        node = self._root
+        while True:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                return False
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = [value, {}]
+                self._size += 1
+                return True
+            node = child
+
+    # Returns the closest value within max_distance and its distance.
+    def find(self, value: int, max_distance: int) -> tuple[int, int] | None:
+        if self._root is None:
+            return None
+        best: tuple[int, int] | None = None
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(value, node[0])
+            if distance <= max_distance and (best is None or distance < best[1]):
+                best = (node[0], distance)
+                if distance == 0:
+                    break
+            for edge, child in node[1].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        return best
+
+
+# The perceptual hashes of images that were confirmed to be scams. They are
+# appended to a file of raw big-endian integers after a header, which loads
+# in one read. A match is only a hint, the scan still has to find a scam
+# phrase in the image before it counts as a known scam image.
+class ScamImageIndex:
+    MAGIC = b"dhash16\n"
+
+    def __init__(self, path: str | None = None, max_distance: int = 12):
+        self.path = path
+        self.max_distance = max_distance
+        self._tree = BKTree()
+        if path and os.path.exists(path):
+            with open(path, "rb") as file:
+                data = file.read()
+            if data.startswith(self.MAGIC):
+                data = data[len(self.MAGIC) :]
+                # Ignore a partially written hash at the end of the file.
+                for offset in range(0, len(data) - HASH_BYTES + 1, HASH_BYTES):
+                    self._tree.add(
+                        int.from_bytes(data[offset : offset + HASH_BYTES], "big")
+                    )
+            elif data:
+                # Hashes of another size can't be compared with the current ones
+                log.warning(
+                    "%s contains hashes of an older version, moved it to %s.old",
+                    path,
+                    path,
+                )
+                os.replace(path, f"{path}.old")
+
+    def __len__(self) -> int:
+        return len(self._tree)
+
+    def add(self, value: int) -> bool:
+        if not is_informative_hash(value) or not self._tree.add(value):
+            return False
+        if self.path:
+            with open(self.path, "ab") as file:
+                if file.tell() == 0:
+                    file.write(self.MAGIC)
+                file.write(value.to_bytes(HASH_BYTES, "big"))
+        return True
+
+    # Returns the distance to the closest known scam image, if it is close enough.
+    def find(self, value: int) -> int | None:
+        if not is_informative_hash(value):
+            return None
+        match = self._tree.find(value, self.max_distance)
+        return match[1] if match is not None else None
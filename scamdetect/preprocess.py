@@ -0,0 +1,252 @@
+import hashlib
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field, fields
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+# Image preprocessing before OCR. Tesseract time grows with the number of
+# pixels, so images are converted to grayscale and scaled to a size that is
+# just large enough for the text. Each pass of the scan runs its own named
+# pipeline of stages, which can be configured in config.yaml.
+
+
+class Stage(ABC):
+    name = ""
+
+    @abstractmethod
+    def __call__(self, image: Image.Image) -> Image.Image: ...
+
+
+@dataclass
+class Grayscale(Stage):
+    name = "grayscale"
+
+    def __call__(self, image: Image.Image) -> Image.Image:
+        return image.convert("L")
+
+
+# Scales the image so that its longer side is at most max_dimension and its
+# shorter side at least min_dimension pixels. The resolution is stored in the
+# image, so that tesseract doesn't have to guess it.
+@dataclass
+class Resize(Stage):
+    name = "resize"
+    max_dimension: int = 2048
+    min_dimension: int = 0
+    dpi: int = 300
+
+    def __call__(self, image: Image.Image) -> Image.Image:
+        width, height = image.size
+        scale = 1.0
+        if self.max_dimension > 0 and max(width, height) > self.max_dimension:
+            scale = self.max_dimension / max(width, height)
+        elif self.min_dimension > 0 and min(width, height) < self.min_dimension:
+            scale = self.min_dimension / min(width, height)
+        if scale != 1.0:
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            image = image.resize(size, Image.Resampling.LANCZOS)
+        if self.dpi > 0:
+            image.info["dpi"] = (self.dpi, self.dpi)
+        return image
+
+
+@dataclass
+class Crop(Stage):
+    name = "crop"
+    # Fractions of the width or height to cut off at each side
+    left: float = 0.0
+    top: float = 0.0
+    right: float = 0.0
+    bottom: float = 0.0
+
+    def __call__(self, image: Image.Image) -> Image.Image:
+        width, height = image.size
+        box = (
+            round(width * self.left),
+            round(height * self.top),
+            round(width * (1 - self.right)),
+            round(height * (1 - self.bottom)),
+        )
+        if box[2] <= box[0] or box[3] <= box[1]:
+            return image
+        return image.crop(box)
+
+
+@dataclass
+class UnsharpMask(Stage):
+    name = "unsharp_mask"
+    radius: float = 5
+    percent: int = 100
+    threshold: int = 3
+
+    def __call__(self, image: Image.Image) -> Image.Image:
+        return image.filter(
+            ImageFilter.UnsharpMask(
+                radius=self.radius, percent=self.percent, threshold=self.threshold
+            )
+        )
+
+
+def grayscale_array(image: Image.Image) -> np.ndarray:
+    return np.asarray(image.convert("L"), dtype=np.float32)
+
+
+# Stretches the brightness so that the given percentiles become black and
+# white. Produces a grayscale image.
+@dataclass
+class Contrast(Stage):
+    name = "contrast"
+    low_percentile: float = 2.0
+    high_percentile: float = 98.0
+
+    def __call__(self, image: Image.Image) -> Image.Image:
+        pixels = grayscale_array(image)
+        low, high = np.percentile(pixels, (self.low_percentile, self.high_percentile))
+        if high - low < 1:
+            return image.convert("L")
+        pixels = np.clip((pixels - low) * (255.0 / (high - low)), 0, 255)
+        return Image.fromarray(pixels.astype(np.uint8))
+
+
+# Tesseract works best with dark text on a light background. Inverts images
+# with a dark background (e.g. Discord's dark theme), or every image with
+# always set.
+@dataclass
+class Invert(Stage):
+    name = "invert"
+    always: bool = False
+
+    def __call__(self, image: Image.Image) -> Image.Image:
+        pixels = grayscale_array(image)
+        if not self.always and pixels.mean() >= 128:
+            return image.convert("L")
+        return Image.fromarray((255 - pixels).astype(np.uint8))
+
+
+def otsu_threshold(pixels: np.ndarray) -> float:
+    histogram = np.bincount(pixels.astype(np.uint8).ravel(), minlength=256)
+    histogram = histogram.astype(np.float64)
+    levels = np.arange(256, dtype=np.float64)
+    weight_background = np.cumsum(histogram)
+    weight_foreground = weight_background[-1] - weight_background
+    sum_background = np.cumsum(histogram * levels)
+    mean_background = sum_background / np.maximum(weight_background, 1)
+    mean_foreground = (sum_background[-1] - sum_background) / np.maximum(
+        weight_foreground, 1
+    )
+    variance = (
+        weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+    )
+    return float(np.argmax(variance))
+
+
+# Turns the image into black and white. With a level of 0 the level is chosen
+# per image with Otsu's method.
+@dataclass
+class Threshold(Stage):
+    name = "threshold"
+    level: int = 0
+
+    def __call__(self, image: Image.Image) -> Image.Image:
+        pixels = grayscale_array(image)
+        level = self.level if self.level > 0 else otsu_threshold(pixels)
+        binary = np.where(pixels > level, 255, 0).astype(np.uint8)
+        return Image.fromarray(binary)
+
+
+STAGES: dict[str, type[Stage]] = {
+    stage.name: stage
+    for stage in (Grayscale, Resize, Crop, UnsharpMask, Contrast, Invert, Threshold)
+}
+
+
+@dataclass
+class Pipeline:
+    name: str
+    stages: list[Stage] = field(default_factory=list)
+
+    # Changes whenever a stage or one of its settings changes, so that cached
+    # OCR results of a differently configured pipeline are not reused.
+    @property
+    def fingerprint(self) -> str:
+        description = ";".join(repr(stage) for stage in self.stages)
+        return hashlib.sha256(description.encode()).hexdigest()[:16]
+
+    # Returns the processed image and the time each stage took in seconds.
+    def run(self, image: Image.Image) -> tuple[Image.Image, dict[str, float]]:
+        timings = {}
+        for stage in self.stages:
+            start = time.perf_counter()
+            image = stage(image)
+            timings[stage.name] = timings.get(stage.name, 0.0) + (
+                time.perf_counter() - start
+            )
+        return image, timings
+
+
+# YAML reads 2 as an int, which is fine for a float setting, but a bool is
+# not a number here.
+def is_setting_value(expected: type, value) -> bool:
+    if isinstance(value, bool):
+        return expected is bool
+    if expected is float:
+        return isinstance(value, (int, float))
+    return isinstance(value, expected)
+
+
+# Builds a pipeline from its configuration, a list of stage names or of
+# mappings with a "stage" key and the settings of the stage, e.g.
+# [grayscale, {stage: resize, max_dimension: 2048}]
+def build_pipeline(name: str, spec: list) -> Pipeline:
+    if not isinstance(spec, list):
+        raise ValueError(f"Pipeline {name} must be a list of stages")
+    stages = []
+    for item in spec:
+        options = dict(item) if isinstance(item, dict) else {"stage": item}
+        stage_name = options.pop("stage", None)
+        if stage_name not in STAGES:
+            raise ValueError(
+                f"Unknown stage {stage_name!r} in pipeline {name}, "
+                f"expected one of {', '.join(STAGES)}"
+            )
+        stage_type = STAGES[stage_name]
+        known = {f.name for f in fields(stage_type)}
+        unknown = set(options) - known
+        if unknown:
+            raise ValueError(
+                f"Unknown settings for stage {stage_name} in pipeline {name}: "
+                f"{', '.join(sorted(unknown))}"
+            )
+        for setting in fields(stage_type):
+            if setting.name in options and not is_setting_value(
+                setting.type, options[setting.name]
+            ):
+                raise ValueError(
+                    f"Setting {setting.name} of stage {stage_name} in pipeline "
+                    f"{name} must be of type {setting.type.__name__}, "
+                    f"not {options[setting.name]!r}"
+                )
+        stages.append(stage_type(**options))
+    pipeline = Pipeline(name=name, stages=stages)
+    # Settings of the right type can still fail, e.g. a percentile above 100.
+    # A failing pipeline would fail every OCR job, so it is rejected here.
+    try:
+        pipeline.run(Image.new("RGB", (64, 64), "white"))
+    except Exception as e:
+        raise ValueError(f"Pipeline {name} fails on a test image: {e}") from e
+    return pipeline
+
+
+DEFAULT_PIPELINES = {
+    "first_pass": Pipeline(
+        name="first_pass",
+        stages=[Grayscale(), Resize()],
+    ),
+    # The first pass found too few phrases, sharpen the image and try again
+    "second_pass": Pipeline(
+        name="second_pass",
+        stages=[Grayscale(), UnsharpMask(), Resize()],
+    ),
+}
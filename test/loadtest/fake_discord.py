@@ -0,0 +1,868 @@
+import asyncio
+import itertools
+import json
+import random
+import re
+import time
+import zlib
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+import yarl
+from aiohttp import WSMsgType, web
+from discord.gateway import DiscordWebSocket
+from discord.http import Route
+from discord.utils import time_snowflake
+
+# A local stand-in for the Discord REST API and gateway, just enough of both
+# for the bot to log in, sync its commands, receive messages and
+# interactions, and moderate them. Every REST call is recorded with the time
+# it was made, so the replay harness can measure how long a detection took
+# and how many calls a moderation action needed. Rate limits are simulated
+# per route bucket with the same headers as Discord, plus optional random
+# 429s like the ones caused by shared buckets.
+
+API_PREFIX = "/api/v10"
+ADMINISTRATOR = 1 << 3
+ALL_PERMISSIONS = (1 << 50) - 1
+
+try:
+    from compression import zstd
+
+    def zstd_compressor():
+        compressor = zstd.ZstdCompressor()
+        return lambda data: compressor.compress(
+            data, mode=zstd.ZstdCompressor.FLUSH_BLOCK
+        )
+
+except ImportError:
+    try:
+        import zstandard
+
+        def zstd_compressor():
+            compressor = zstandard.ZstdCompressor().compressobj()
+            return lambda data: compressor.compress(data) + compressor.flush(
+                zstandard.COMPRESSOBJ_FLUSH_BLOCK
+            )
+
+    except ImportError:
+        zstd_compressor = None
+
+
+def zlib_compressor():
+    compressor = zlib.compressobj()
+    return lambda data: compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+# discord.py only decodes responses with exactly this content type
+def json_response(data, status: int = 200, headers: dict | None = None):
+    return web.Response(
+        body=json.dumps(data).encode(),
+        status=status,
+        headers=headers,
+        content_type="application/json",
+    )
+
+
+def snowflake() -> int:
+    return time_snowflake(datetime.now(timezone.utc)) + next(SEQUENCE)
+
+
+SEQUENCE = itertools.count()
+
+
+def iso_now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+@dataclass
+class RestCall:
+    method: str
+    route: str
+    at: float
+    status: int
+    # Message IDs that the call deleted
+    deleted: list[int] = field(default_factory=list)
+
+
+@dataclass
+class RateLimit:
+    limit: int
+    window: float
+    remaining: int = 0
+    reset_at: float = 0.0
+
+
+# Route templates and what they are for, matched in order
+ROUTES = [
+    ("GET", r"/users/@me", "users/@me"),
+    ("GET", r"/gateway/bot", "gateway/bot"),
+    ("GET", r"/gateway", "gateway"),
+    ("GET", r"/oauth2/applications/@me", "applications/@me"),
+    ("GET", r"/applications/@me", "applications/@me"),
+    (
+        "PUT",
+        r"/applications/(?P<app>\d+)/guilds/(?P<guild>\d+)/commands",
+        "commands/sync",
+    ),
+    ("GET", r"/applications/(?P<app>\d+)/guilds/(?P<guild>\d+)/commands", "commands"),
+    ("POST", r"/users/@me/channels", "dm/create"),
+    ("POST", r"/channels/(?P<channel>\d+)/messages/bulk-delete", "messages/bulk"),
+    (
+        "DELETE",
+        r"/channels/(?P<channel>\d+)/messages/(?P<message>\d+)",
+        "messages/delete",
+    ),
+    ("GET", r"/channels/(?P<channel>\d+)/messages", "messages/history"),
+    ("POST", r"/channels/(?P<channel>\d+)/messages", "messages/send"),
+    ("PATCH", r"/guilds/(?P<guild>\d+)/members/(?P<user>\d+)", "members/edit"),
+    (
+        "PUT",
+        r"/guilds/(?P<guild>\d+)/members/(?P<user>\d+)/roles/(?P<role>\d+)",
+        "roles/add",
+    ),
+    (
+        "DELETE",
+        r"/guilds/(?P<guild>\d+)/members/(?P<user>\d+)/roles/(?P<role>\d+)",
+        "roles/remove",
+    ),
+    (
+        "POST",
+        r"/interactions/(?P<id>\d+)/(?P<token>[^/]+)/callback",
+        "interaction/callback",
+    ),
+    ("POST", r"/webhooks/(?P<app>\d+)/(?P<token>[^/]+)", "interaction/followup"),
+    (
+        "PATCH",
+        r"/webhooks/(?P<app>\d+)/(?P<token>[^/]+)/messages/@original",
+        "interaction/edit",
+    ),
+]
+COMPILED_ROUTES = [
+    (method, re.compile(pattern + "$"), name) for method, pattern, name in ROUTES
+]
+# Calls that are made once at startup or to answer commands, not as part of
+# moderating messages
+SETUP_ROUTES = {
+    "users/@me",
+    "gateway/bot",
+    "gateway",
+    "applications/@me",
+    "commands/sync",
+    "commands",
+}
+
+
+class FakeDiscord:
+    def __init__(
+        self,
+        *,
+        channels: int = 5,
+        users: int = 200,
+        bucket_limit: int = 5,
+        bucket_window: float = 1.0,
+        global_limit: int = 50,
+        random_429_rate: float = 0.0,
+        rest_latency: float = 0.0,
+        seed: int = 0,
+    ):
+        self.bucket_limit = bucket_limit
+        self.bucket_window = bucket_window
+        self.global_limit = global_limit
+        self.random_429_rate = random_429_rate
+        self.rest_latency = rest_latency
+        self.random = random.Random(seed)
+        self.url = ""
+        self.calls: list[RestCall] = []
+        self.rate_limited: Counter = Counter()
+        self._buckets: dict[tuple[str, str], RateLimit] = {}
+        self._global: RateLimit = RateLimit(global_limit, 1.0)
+        self._sockets: list[tuple[web.WebSocketResponse, object]] = []
+        self._sequence = 0
+        self._runner: web.AppRunner | None = None
+        # Files served as attachments, by path
+        self.files: dict[str, bytes] = {}
+
+        self.application_id = snowflake()
+        self.guild_id = snowflake()
+        self.bot_user = self.user_payload(self.application_id, "ModBot", bot=True)
+        self.roles = {
+            "everyone": self.role_payload(self.guild_id, "@everyone", 0, 0x640),
+            "bot": self.role_payload(snowflake(), "Bot", 10, ADMINISTRATOR),
+            "moderator": self.role_payload(snowflake(), "Moderator", 8, ADMINISTRATOR),
+            "quarantine": self.role_payload(snowflake(), "Quarantined", 2, 0),
+            "quarantine_write": self.role_payload(snowflake(), "Quarantine Chat", 2, 0),
+            "timeout_remove": self.role_payload(snowflake(), "Verified", 1, 0),
+            "attachment_cooldown": self.role_payload(snowflake(), "Cooldown", 1, 0),
+        }
+        self.channels = [
+            self.channel_payload(snowflake(), f"general-{i}", i)
+            for i in range(channels)
+        ]
+        self.notify_channel = self.channel_payload(snowflake(), "mod-log", channels)
+        self.quarantine_channel = self.channel_payload(
+            snowflake(), "quarantine", channels + 1
+        )
+        self.members: dict[int, dict] = {}
+        self.add_member(self.bot_user, [self.roles["bot"]["id"]])
+        self.moderator = self.add_member(
+            self.user_payload(snowflake(), "moderator"), [self.roles["moderator"]["id"]]
+        )
+        self.user_ids = [
+            int(
+                self.add_member(
+                    self.user_payload(snowflake(), f"user{i}"),
+                    [self.roles["timeout_remove"]["id"]],
+                )["user"]["id"]
+            )
+            for i in range(users)
+        ]
+        # Message ID -> message payload, for history requests
+        self.messages: dict[int, dict] = {}
+        self.commands: dict[str, dict] = {}
+        self.dm_channels: dict[int, dict] = {}
+
+    # Payloads
+
+    def user_payload(self, user_id: int, name: str, bot: bool = False) -> dict:
+        return {
+            "id": str(user_id),
+            "username": name,
+            "global_name": name,
+            "discriminator": "0",
+            "avatar": None,
+            "bot": bot,
+        }
+
+    def role_payload(self, role_id: int, name: str, position: int, permissions: int):
+        return {
+            "id": str(role_id),
+            "name": name,
+            "color": 0,
+            "hoist": False,
+            "position": position,
+            "permissions": str(permissions),
+            "managed": False,
+            "mentionable": False,
+            "flags": 0,
+        }
+
+    def channel_payload(self, channel_id: int, name: str, position: int) -> dict:
+        return {
+            "id": str(channel_id),
+            "type": 0,
+            "guild_id": str(self.guild_id),
+            "name": name,
+            "position": position,
+            "permission_overwrites": [],
+            "nsfw": False,
+            "parent_id": None,
+            "last_message_id": None,
+        }
+
+    def add_member(self, user: dict, role_ids: list[str]) -> dict:
+        member = {
+            "user": user,
+            "roles": list(role_ids),
+            "joined_at": iso_now(),
+            "deaf": False,
+            "mute": False,
+            "flags": 0,
+            "communication_disabled_until": None,
+        }
+        self.members[int(user["id"])] = member
+        return member
+
+    def guild_payload(self) -> dict:
+        channels = self.channels + [self.notify_channel, self.quarantine_channel]
+        return {
+            "id": str(self.guild_id),
+            "name": "Load Test",
+            "icon": None,
+            "owner_id": self.moderator["user"]["id"],
+            "roles": list(self.roles.values()),
+            "channels": channels,
+            "threads": [],
+            "members": list(self.members.values()),
+            "member_count": len(self.members),
+            "presences": [],
+            "voice_states": [],
+            "emojis": [],
+            "stickers": [],
+            "features": [],
+            "large": False,
+            "unavailable": False,
+            "joined_at": iso_now(),
+            "premium_tier": 0,
+            "preferred_locale": "en-US",
+            "verification_level": 0,
+            "explicit_content_filter": 0,
+            "default_message_notifications": 0,
+            "mfa_level": 0,
+            "nsfw_level": 0,
+            "system_channel_flags": 0,
+        }
+
+    def message_payload(
+        self,
+        channel_id: int,
+        author_id: int,
+        content: str,
+        attachments: list[dict] | None = None,
+        embeds: list[dict] | None = None,
+        message_id: int | None = None,
+    ) -> dict:
+        member = self.members.get(author_id)
+        user = member["user"] if member else self.bot_user
+        payload = {
+            "id": str(message_id or snowflake()),
+            "channel_id": str(channel_id),
+            "guild_id": str(self.guild_id),
+            "author": user,
+            "content": content,
+            "timestamp": iso_now(),
+            "edited_timestamp": None,
+            "tts": False,
+            "mention_everyone": False,
+            "mentions": [],
+            "mention_roles": [],
+            "attachments": attachments or [],
+            "embeds": embeds or [],
+            "pinned": False,
+            "type": 0,
+            "flags": 0,
+        }
+        if member is not None and channel_id not in self.dm_channels:
+            payload["member"] = {k: v for k, v in member.items() if k != "user"}
+        return payload
+
+    def attachment_payload(self, filename: str, data: bytes, width: int, height: int):
+        attachment_id = snowflake()
+        path = f"/attachments/{attachment_id}/{filename}"
+        self.files[path] = data
+        extension = filename.rsplit(".", 1)[-1].lower()
+        content_type = {"jpg": "image/jpeg"}.get(extension, f"image/{extension}")
+        return {
+            "id": str(attachment_id),
+            "filename": filename,
+            "size": len(data),
+            "url": self.url + path,
+            "proxy_url": self.url + path,
+            "content_type": content_type,
+            "width": width,
+            "height": height,
+        }
+
+    # Gateway
+
+    async def dispatch(self, event: str, data: dict):
+        self._sequence += 1
+        payload = {"op": 0, "t": event, "s": self._sequence, "d": data}
+        for socket, compress in list(self._sockets):
+            await self._send(socket, compress, payload)
+
+    async def _send(self, socket: web.WebSocketResponse, compress, payload: dict):
+        data = json.dumps(payload).encode()
+        try:
+            if compress is None:
+                await socket.send_str(data.decode())
+            else:
+                await socket.send_bytes(compress(data))
+        except ConnectionResetError:
+            pass
+
+    async def handle_gateway(self, request: web.Request) -> web.WebSocketResponse:
+        socket = web.WebSocketResponse(max_msg_size=0)
+        await socket.prepare(request)
+        compression = request.query.get("compress")
+        if compression == "zlib-stream":
+            compress = zlib_compressor()
+        elif compression == "zstd-stream" and zstd_compressor is not None:
+            compress = zstd_compressor()
+        else:
+            compress = None
+        entry = (socket, compress)
+        await self._send(
+            socket, compress, {"op": 10, "d": {"heartbeat_interval": 41250}}
+        )
+        async for message in socket:
+            if message.type != WSMsgType.TEXT:
+                continue
+            payload = json.loads(message.data)
+            op = payload.get("op")
+            if op == 1:
+                await self._send(socket, compress, {"op": 11})
+            elif op == 2:
+                self._sockets.append(entry)
+                await self.dispatch(
+                    "READY",
+                    {
+                        "v": 10,
+                        "user": self.bot_user,
+                        "guilds": [{"id": str(self.guild_id), "unavailable": True}],
+                        "session_id": "loadtest",
+                        "resume_gateway_url": self.url.replace("http", "ws", 1)
+                        + "/gateway",
+                        "application": {"id": str(self.application_id), "flags": 0},
+                        "private_channels": [],
+                        "relationships": [],
+                    },
+                )
+                # With all members included, discord.py doesn't request
+                # member chunks before the guild is ready
+                await self.dispatch("GUILD_CREATE", self.guild_payload())
+            elif op == 6:
+                # No resume, the client identifies again
+                await self._send(socket, compress, {"op": 9, "d": False})
+            elif op == 8:
+                await self.dispatch(
+                    "GUILD_MEMBERS_CHUNK",
+                    {
+                        "guild_id": str(self.guild_id),
+                        "members": list(self.members.values()),
+                        "chunk_index": 0,
+                        "chunk_count": 1,
+                        "nonce": payload["d"].get("nonce"),
+                    },
+                )
+        if entry in self._sockets:
+            self._sockets.remove(entry)
+        return socket
+
+    # REST
+
+    def _check_rate_limit(self, bucket: tuple[str, str]) -> tuple[dict, float | None]:
+        now = time.monotonic()
+        limits = []
+        for key, limit in ((None, self._global), (bucket, None)):
+            if limit is None:
+                limit = self._buckets.get(key)
+                if limit is None:
+                    limit = RateLimit(self.bucket_limit, self.bucket_window)
+                    self._buckets[key] = limit
+            if now >= limit.reset_at:
+                limit.remaining = limit.limit
+                limit.reset_at = now + limit.window
+            limits.append(limit)
+        global_limit, route_limit = limits
+        headers = {
+            # discord.py treats a 429 without it as a Cloudflare ban
+            "Via": "1.1 google",
+            "X-RateLimit-Limit": str(route_limit.limit),
+            "X-RateLimit-Bucket": f"{bucket[0]}:{bucket[1]}".replace("/", "-"),
+        }
+        retry_after = None
+        if global_limit.remaining <= 0:
+            retry_after = global_limit.reset_at - now
+            headers["X-RateLimit-Global"] = "true"
+            headers["X-RateLimit-Scope"] = "global"
+        elif route_limit.remaining <= 0:
+            retry_after = route_limit.reset_at - now
+            headers["X-RateLimit-Scope"] = "user"
+        elif self.random.random() < self.random_429_rate:
+            # Like a shared bucket that the headers don't announce
+            retry_after = self.random.uniform(0.1, 1.0)
+            headers["X-RateLimit-Scope"] = "shared"
+        else:
+            global_limit.remaining -= 1
+            route_limit.remaining -= 1
+        headers["X-RateLimit-Remaining"] = str(max(0, route_limit.remaining))
+        reset_after = max(0.0, route_limit.reset_at - now)
+        headers["X-RateLimit-Reset-After"] = f"{reset_after:.3f}"
+        headers["X-RateLimit-Reset"] = f"{time.time() + reset_after:.3f}"
+        return headers, retry_after
+
+    async def handle_rest(self, request: web.Request) -> web.StreamResponse:
+        path = request.path[len(API_PREFIX) :]
+        for method, pattern, name in COMPILED_ROUTES:
+            match = pattern.match(path)
+            if match and method == request.method:
+                break
+        else:
+            return json_response(
+                {"message": f"Unknown route {request.method} {path}", "code": 0},
+                status=404,
+            )
+        params = match.groupdict()
+        major = (
+            params.get("channel") or params.get("guild") or params.get("token") or ""
+        )
+        headers, retry_after = self._check_rate_limit((name, major))
+        if self.rest_latency > 0:
+            await asyncio.sleep(self.rest_latency)
+        if retry_after is not None:
+            self.rate_limited[name] += 1
+            self.calls.append(RestCall(request.method, name, time.monotonic(), 429))
+            headers["Retry-After"] = f"{retry_after:.3f}"
+            return json_response(
+                {
+                    "message": "You are being rate limited.",
+                    "retry_after": retry_after,
+                    "global": headers.get("X-RateLimit-Global") == "true",
+                },
+                status=429,
+                headers=headers,
+            )
+        call = RestCall(request.method, name, time.monotonic(), 200)
+        self.calls.append(call)
+        response = await getattr(
+            self, "rest_" + name.replace("/", "_").replace("@", "")
+        )(request, call, **params)
+        response.headers.update(headers)
+        call.status = response.status
+        return response
+
+    async def read_payload(self, request: web.Request) -> dict:
+        if request.content_type.startswith("multipart/"):
+            reader = await request.multipart()
+            payload = {}
+            files = []
+            async for part in reader:
+                if part.name == "payload_json":
+                    payload = json.loads(await part.text())
+                else:
+                    data = await part.read()
+                    files.append((part.filename, len(data)))
+            payload["_files"] = files
+            return payload
+        if request.can_read_body:
+            return await request.json()
+        return {}
+
+    async def rest_users_me(self, request, call):
+        return json_response(self.bot_user)
+
+    async def rest_gateway_bot(self, request, call):
+        return json_response(
+            {
+                "url": self.url.replace("http", "ws", 1) + "/gateway",
+                "shards": 1,
+                "session_start_limit": {
+                    "total": 1000,
+                    "remaining": 1000,
+                    "reset_after": 0,
+                    "max_concurrency": 1,
+                },
+            }
+        )
+
+    async def rest_gateway(self, request, call):
+        return json_response({"url": self.url.replace("http", "ws", 1) + "/gateway"})
+
+    async def rest_applications_me(self, request, call):
+        return json_response(
+            {
+                "id": str(self.application_id),
+                "name": "ModBot",
+                "icon": None,
+                "description": "",
+                "bot_public": False,
+                "bot_require_code_grant": False,
+                "verify_key": "",
+                "flags": 0,
+                "owner": self.moderator["user"],
+            }
+        )
+
+    async def rest_commands_sync(self, request, call, app, guild):
+        commands = []
+        for command in await request.json():
+            command = dict(command)
+            command.setdefault("type", 1)
+            existing = self.commands.get(command["name"])
+            command["id"] = existing["id"] if existing else str(snowflake())
+            command["application_id"] = str(self.application_id)
+            command["guild_id"] = guild
+            command["version"] = str(snowflake())
+            self.commands[command["name"]] = command
+            commands.append(command)
+        return json_response(commands)
+
+    async def rest_commands(self, request, call, app, guild):
+        return json_response(list(self.commands.values()))
+
+    async def rest_dm_create(self, request, call):
+        recipient_id = int((await request.json())["recipient_id"])
+        channel = self.dm_channels.get(recipient_id)
+        if channel is None:
+            channel = {
+                "id": str(snowflake()),
+                "type": 1,
+                "recipients": [self.members[recipient_id]["user"]],
+                "last_message_id": None,
+            }
+            self.dm_channels[recipient_id] = channel
+        return json_response(channel)
+
+    async def rest_messages_delete(self, request, call, channel, message):
+        deleted = self.messages.pop(int(message), None)
+        if deleted is None:
+            return json_response(
+                {"message": "Unknown Message", "code": 10008}, status=404
+            )
+        call.deleted.append(int(message))
+        await self.dispatch(
+            "MESSAGE_DELETE",
+            {"id": message, "channel_id": channel, "guild_id": str(self.guild_id)},
+        )
+        return web.Response(status=204)
+
+    async def rest_messages_bulk(self, request, call, channel):
+        ids = [int(i) for i in (await request.json())["messages"]]
+        for message_id in ids:
+            if self.messages.pop(message_id, None) is not None:
+                call.deleted.append(message_id)
+        await self.dispatch(
+            "MESSAGE_DELETE_BULK",
+            {
+                "ids": [str(i) for i in ids],
+                "channel_id": channel,
+                "guild_id": str(self.guild_id),
+            },
+        )
+        return web.Response(status=204)
+
+    async def rest_messages_history(self, request, call, channel):
+        limit = int(request.query.get("limit", 50))
+        after = int(request.query.get("after", 0))
+        before = int(request.query.get("before", 1 << 63))
+        messages = [
+            message
+            for message_id, message in self.messages.items()
+            if message["channel_id"] == channel and after < message_id < before
+        ]
+        # Newest first, unless only after is given
+        if "after" in request.query and "before" not in request.query:
+            messages = sorted(messages, key=lambda m: int(m["id"]))[:limit]
+            messages.reverse()
+        else:
+            messages = sorted(messages, key=lambda m: -int(m["id"]))[:limit]
+        return json_response(messages)
+
+    async def rest_messages_send(self, request, call, channel):
+        payload = await self.read_payload(request)
+        message = self.message_payload(
+            int(channel),
+            self.application_id,
+            payload.get("content") or "",
+            embeds=payload.get("embeds"),
+        )
+        message["attachments"] = [
+            {
+                "id": str(snowflake()),
+                "filename": filename,
+                "size": size,
+                "url": self.url + f"/attachments/{filename}",
+                "proxy_url": self.url + f"/attachments/{filename}",
+            }
+            for filename, size in payload.get("_files", [])
+        ]
+        return json_response(message)
+
+    async def _member_updated(self, member: dict):
+        await self.dispatch(
+            "GUILD_MEMBER_UPDATE", {"guild_id": str(self.guild_id), **member}
+        )
+
+    async def rest_members_edit(self, request, call, guild, user):
+        member = self.members[int(user)]
+        payload = await request.json()
+        if "roles" in payload:
+            member["roles"] = [str(role) for role in payload["roles"]]
+        if "communication_disabled_until" in payload:
+            member["communication_disabled_until"] = payload[
+                "communication_disabled_until"
+            ]
+        await self._member_updated(member)
+        return json_response(member)
+
+    async def rest_roles_add(self, request, call, guild, user, role):
+        member = self.members[int(user)]
+        if role not in member["roles"]:
+            member["roles"].append(role)
+        await self._member_updated(member)
+        return web.Response(status=204)
+
+    async def rest_roles_remove(self, request, call, guild, user, role):
+        member = self.members[int(user)]
+        if role in member["roles"]:
+            member["roles"].remove(role)
+        await self._member_updated(member)
+        return web.Response(status=204)
+
+    async def rest_interaction_callback(self, request, call, id, token):
+        await self.read_payload(request)
+        return json_response(
+            {
+                "interaction": {
+                    "id": id,
+                    "type": 2,
+                    "response_message_loading": True,
+                    "response_message_ephemeral": True,
+                },
+            }
+        )
+
+    async def rest_interaction_followup(self, request, call, app, token):
+        payload = await self.read_payload(request)
+        channel_id = int(self.notify_channel["id"])
+        return json_response(
+            self.message_payload(
+                channel_id, self.application_id, payload.get("content") or ""
+            )
+        )
+
+    rest_interaction_edit = rest_interaction_followup
+
+    async def handle_attachment(self, request: web.Request) -> web.Response:
+        data = self.files.get(request.path)
+        if data is None:
+            return web.Response(status=404)
+        return web.Response(body=data)
+
+    # Events for the replay
+
+    async def send_message(
+        self,
+        channel_index: int,
+        user_index: int,
+        content: str,
+        files: list[tuple[str, bytes, int, int]] = (),
+    ) -> dict:
+        channel = self.channels[channel_index % len(self.channels)]
+        user_id = self.user_ids[user_index % len(self.user_ids)]
+        attachments = [self.attachment_payload(*file) for file in files]
+        message = self.message_payload(
+            int(channel["id"]), user_id, content, attachments
+        )
+        self.messages[int(message["id"])] = message
+        await self.dispatch("MESSAGE_CREATE", message)
+        return message
+
+    async def edit_message(self, message_id: int, content: str):
+        message = self.messages.get(message_id)
+        if message is None:
+            return
+        message["content"] = content
+        message["edited_timestamp"] = iso_now()
+        await self.dispatch("MESSAGE_UPDATE", message)
+
+    async def delete_message(self, message_id: int):
+        message = self.messages.pop(message_id, None)
+        if message is None:
+            return
+        await self.dispatch(
+            "MESSAGE_DELETE",
+            {
+                "id": message["id"],
+                "channel_id": message["channel_id"],
+                "guild_id": str(self.guild_id),
+            },
+        )
+
+    # Runs a slash command as the moderator. Options named user or users
+    # refer to replayed users by their index.
+    async def run_command(self, name: str, options: dict) -> bool:
+        command = self.commands.get(name)
+        if command is None:
+            return False
+        resolved_users = {}
+        resolved_members = {}
+        values = []
+        types = {o["name"]: o["type"] for o in command.get("options", [])}
+        for option, value in options.items():
+            option_type = types.get(option, 3)
+            if option_type == 6:
+                member = self.members[self.user_ids[value % len(self.user_ids)]]
+                value = member["user"]["id"]
+                resolved_users[value] = member["user"]
+                resolved_members[value] = {
+                    k: v for k, v in member.items() if k != "user"
+                } | {"permissions": "0"}
+            elif option == "users" and isinstance(value, list):
+                value = " ".join(
+                    str(self.user_ids[i % len(self.user_ids)]) for i in value
+                )
+            values.append({"name": option, "type": option_type, "value": value})
+        interaction_id = snowflake()
+        await self.dispatch(
+            "INTERACTION_CREATE",
+            {
+                "id": str(interaction_id),
+                "application_id": str(self.application_id),
+                "type": 2,
+                "token": f"token{interaction_id}",
+                "version": 1,
+                "guild_id": str(self.guild_id),
+                "channel_id": self.channels[0]["id"],
+                "channel": self.channels[0],
+                "member": self.moderator | {"permissions": str(ALL_PERMISSIONS)},
+                "app_permissions": str(ALL_PERMISSIONS),
+                "locale": "en-US",
+                "guild_locale": "en-US",
+                "entitlements": [],
+                "attachment_size_limit": 10 * 1024 * 1024,
+                "authorizing_integration_owners": {},
+                "context": 0,
+                "data": {
+                    "id": command["id"],
+                    "name": name,
+                    "type": 1,
+                    "guild_id": str(self.guild_id),
+                    "options": values,
+                    "resolved": {
+                        "users": resolved_users,
+                        "members": resolved_members,
+                    },
+                },
+            },
+        )
+        return True
+
+    # Statistics
+
+    def calls_since(self, start: float) -> list[RestCall]:
+        return [call for call in self.calls if call.at >= start]
+
+    def deleted_at(self) -> dict[int, float]:
+        deleted = {}
+        for call in self.calls:
+            for message_id in call.deleted:
+                deleted.setdefault(message_id, call.at)
+        return deleted
+
+    def calls_by_route(self, start: float) -> dict[str, int]:
+        counts = defaultdict(int)
+        for call in self.calls_since(start):
+            if call.route not in SETUP_ROUTES:
+                counts[call.route] += 1
+        return dict(counts)
+
+    # Server
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_get("/gateway", self.handle_gateway)
+        app.router.add_get("/attachments/{tail:.*}", self.handle_attachment)
+        app.router.add_route("*", API_PREFIX + "/{tail:.*}", self.handle_rest)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+
+    # Points discord.py at this server instead of Discord, for all clients of
+    # the process
+    def patch_discord(self):
+        Route.BASE = self.url + API_PREFIX
+        DiscordWebSocket.DEFAULT_GATEWAY = yarl.URL(
+            self.url.replace("http", "ws", 1) + "/gateway"
+        )
+
+    async def stop(self):
+        for socket, _ in list(self._sockets):
+            await socket.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
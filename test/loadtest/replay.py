@@ -0,0 +1,451 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import string
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+
+import yaml
+from PIL import Image
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_discord import SETUP_ROUTES, FakeDiscord
+from scamdetect.attachments import IMAGE_EXTENSIONS
+
+# Replays a stream of message events into the real bot, which talks to the
+# local stand-in of Discord in fake_discord.py instead of Discord. Reports
+# the sustained message rate, how long it took from a message being sent to
+# the bot deleting it, and how many REST calls each moderation action took.
+#
+# The stream is a JSONL file with one event per line:
+#   {"type": "message", "id": "m1", "channel": 0, "user": 3, "content": "hi",
+#    "attachments": ["downloads/1/0_scam.png"], "expect": "delete"}
+#   {"type": "edit", "id": "m1", "content": "edited"}
+#   {"type": "delete", "id": "m1"}
+#   {"type": "command", "name": "moddelmsg", "options": {"user": 3, "hours": 1}}
+# Channels and users are indices into the fake guild. An event may have an
+# "at" in seconds since the start, otherwise events are sent at --rate.
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    position = (len(values) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def image_paths(directory: str) -> list[str]:
+    paths = []
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+
+def random_word(rng: random.Random) -> str:
+    return "".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9)))
+
+
+# Chat messages with a share of forbidden phrases and images, plus edits,
+# deletes and the occasional /moddelmsg of a user that posted a scam
+def synthetic_stream(
+    count: int,
+    rng: random.Random,
+    forbidden_phrases: list[str],
+    scam_images: list[str],
+    clean_images: list[str],
+    forbidden_ratio: float,
+    image_ratio: float,
+    users: int,
+    channels: int,
+) -> list[dict]:
+    vocabulary = [random_word(rng) for _ in range(2000)]
+    events = []
+    sent = []
+    for i in range(count):
+        user = rng.randrange(users)
+        words = [rng.choice(vocabulary) for _ in range(rng.randint(1, 30))]
+        event = {
+            "type": "message",
+            "id": f"m{i}",
+            "channel": rng.randrange(channels),
+            "user": user,
+            "expect": "keep",
+        }
+        kind = rng.random()
+        if kind < forbidden_ratio and forbidden_phrases:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(forbidden_phrases))
+            event["expect"] = "delete"
+        elif kind < forbidden_ratio + image_ratio and (scam_images or clean_images):
+            scam = bool(scam_images) and (not clean_images or rng.random() < 0.5)
+            event["attachments"] = [rng.choice(scam_images if scam else clean_images)]
+            event["expect"] = "delete" if scam else "keep"
+            words = words[: rng.randint(0, 3)]
+        event["content"] = " ".join(words)
+        events.append(event)
+        if event["expect"] == "keep":
+            sent.append(event["id"])
+        # Only messages that stay are edited or deleted, so that the
+        # expectations of the other messages still hold
+        if sent and rng.random() < 0.05:
+            events.append(
+                {
+                    "type": "edit",
+                    "id": rng.choice(sent),
+                    "content": " ".join(rng.choices(vocabulary, k=5)),
+                }
+            )
+        if sent and rng.random() < 0.02:
+            events.append({"type": "delete", "id": sent.pop(rng.randrange(len(sent)))})
+        if event["expect"] == "delete" and rng.random() < 0.01:
+            events.append(
+                {"type": "command", "name": "moddelmsg", "options": {"user": user}}
+            )
+    return events
+
+
+def load_stream(path: str) -> list[dict]:
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+# Writes the config.yaml that the bot reads from the working directory, with
+# the IDs of the fake guild. State files end up in the same directory.
+def write_config(source: str, directory: str, fake: FakeDiscord) -> dict:
+    with open(source) as file:
+        config = yaml.safe_load(file)
+    moddelmsg = config.setdefault("moddelmsg", {})
+    moddelmsg.update(
+        {
+            "timeout_remove_roleid": int(fake.roles["timeout_remove"]["id"]),
+            "notify_channelid": int(fake.notify_channel["id"]),
+            "notify_user_id": int(fake.moderator["user"]["id"]),
+            "quarantine_roleid": int(fake.roles["quarantine"]["id"]),
+            "quarantine_channelid": int(fake.quarantine_channel["id"]),
+            "quarantine_writepermission_roleid": int(
+                fake.roles["quarantine_write"]["id"]
+            ),
+            "attachment_cooldown_roleid": int(fake.roles["attachment_cooldown"]["id"]),
+        }
+    )
+    config["logging"] = {"level": "WARNING"}
+    config.pop("metrics", None)
+    with open(os.path.join(directory, "config.yaml"), "w") as file:
+        yaml.safe_dump(config, file)
+    return config
+
+
+def image_file(path: str) -> tuple[str, bytes, int, int]:
+    with open(path, "rb") as file:
+        data = file.read()
+    try:
+        with Image.open(path) as image:
+            width, height = image.size
+    except Exception:
+        width, height = 0, 0
+    return os.path.basename(path), data, width, height
+
+
+# Waits until the work queue is empty and no REST calls were made for
+# settle_seconds, since logs and DMs are sent after the coalescing and log
+# windows. Returns whether that happened before the timeout.
+async def wait_until_idle(
+    bot, fake: FakeDiscord, settle_seconds: float, timeout: float
+) -> bool:
+    deadline = time.monotonic() + timeout
+    idle_since = time.monotonic()
+    while time.monotonic() < deadline:
+        stats = bot.MODERATION_QUEUE.stats()
+        if stats["depth"] > 0 or stats["running"] > 0:
+            idle_since = time.monotonic()
+        last_call = fake.calls[-1].at if fake.calls else 0
+        if time.monotonic() - max(last_call, idle_since) >= settle_seconds:
+            return True
+        await asyncio.sleep(0.05)
+    return False
+
+
+# The bot is ready to handle commands once it synced them
+async def wait_for_commands(fake: FakeDiscord):
+    while not fake.commands:
+        await asyncio.sleep(0.05)
+
+
+@dataclass
+class SentMessage:
+    message_id: int
+    user: int
+    sent_at: float
+    expect: str
+
+
+async def replay(args, events: list[dict], fake: FakeDiscord) -> dict:
+    files = {}
+    sent: dict[str, SentMessage] = {}
+    # User index -> when the last command against the user was run
+    commands: dict[int, float] = {}
+    dispatched = 0
+    start = time.monotonic()
+    for index, event in enumerate(events):
+        at = event.get("at", index / args.rate)
+        delay = start + at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        kind = event.get("type", "message")
+        if kind == "message":
+            attachments = []
+            for path in event.get("attachments", []):
+                if path not in files:
+                    files[path] = image_file(path)
+                attachments.append(files[path])
+            message = await fake.send_message(
+                event.get("channel", 0),
+                event.get("user", 0),
+                event.get("content", ""),
+                attachments,
+            )
+            sent[event.get("id", message["id"])] = SentMessage(
+                int(message["id"]),
+                event.get("user", 0),
+                time.monotonic(),
+                event.get("expect", "keep"),
+            )
+        elif kind == "edit" and event["id"] in sent:
+            await fake.edit_message(sent[event["id"]].message_id, event["content"])
+        elif kind == "delete" and event["id"] in sent:
+            await fake.delete_message(sent[event["id"]].message_id)
+        elif kind == "command":
+            options = event.get("options", {})
+            if await fake.run_command(event["name"], options) and "user" in options:
+                commands[options["user"]] = time.monotonic()
+        dispatched += 1
+        # Lets the bot handle the events even when dispatching falls behind
+        if index % 50 == 0:
+            await asyncio.sleep(0)
+    dispatch_seconds = time.monotonic() - start
+    return {
+        "sent": sent,
+        "commands": commands,
+        "dispatched": dispatched,
+        "start": start,
+        "dispatch_seconds": dispatch_seconds,
+    }
+
+
+def summarize(fake: FakeDiscord, run: dict, drained: bool) -> dict:
+    deleted_at = fake.deleted_at()
+    latencies = []
+    handled_at = run["start"] + run["dispatch_seconds"]
+    missed = []
+    false_positives = []
+    for name, message in run["sent"].items():
+        deleted = deleted_at.get(message.message_id)
+        if message.expect == "delete":
+            if deleted is None:
+                missed.append(name)
+            else:
+                latencies.append(deleted - message.sent_at)
+                # Clean messages are handled as they arrive, the others
+                # when they were deleted
+                handled_at = max(handled_at, deleted)
+        elif deleted is not None:
+            # Messages of a user that a command was run against are
+            # expected to be deleted by it
+            command_at = run["commands"].get(message.user)
+            if command_at is None or deleted < command_at:
+                false_positives.append(name)
+    elapsed = handled_at - run["start"]
+    messages = len(run["sent"])
+    calls = fake.calls_since(run["start"])
+    moderation_calls = [
+        call
+        for call in calls
+        if call.route not in SETUP_ROUTES and not call.route.startswith("interaction/")
+    ]
+    actions = len(latencies) + len(false_positives)
+    return {
+        "messages": messages,
+        "events": run["dispatched"],
+        "commands": len(run["commands"]),
+        "dispatch_rate": run["dispatched"] / max(run["dispatch_seconds"], 1e-9),
+        "messages_per_second": messages / max(elapsed, 1e-9),
+        "elapsed_seconds": elapsed,
+        "drained": drained,
+        "detections": len(latencies),
+        "missed": missed,
+        "false_positives": false_positives,
+        "detection_latency": {
+            "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies, default=0.0),
+        },
+        "rest_calls": len(calls),
+        "rest_calls_by_route": fake.calls_by_route(run["start"]),
+        "rate_limited_by_route": dict(fake.rate_limited),
+        "moderation_calls_per_action": (
+            len(moderation_calls) / actions if actions else None
+        ),
+    }
+
+
+def print_summary(summary: dict):
+    latency = summary["detection_latency"]
+    print(
+        f"messages: {summary['messages']} in {summary['elapsed_seconds']:.1f}s, "
+        f"{summary['messages_per_second']:.1f} msg/s sustained "
+        f"(dispatched at {summary['dispatch_rate']:.1f} events/s)"
+    )
+    if not summary["drained"]:
+        print("warning: the moderation queue did not drain before the timeout")
+    print(
+        f"detections: {summary['detections']}, missed: {len(summary['missed'])}, "
+        f"false positives: {len(summary['false_positives'])}"
+    )
+    print(
+        f"detection latency ms: mean {latency['mean'] * 1000:.0f}  "
+        f"p50 {latency['p50'] * 1000:.0f}  p95 {latency['p95'] * 1000:.0f}  "
+        f"p99 {latency['p99'] * 1000:.0f}  max {latency['max'] * 1000:.0f}"
+    )
+    per_action = summary["moderation_calls_per_action"]
+    print(
+        f"REST calls: {summary['rest_calls']}, per moderation action: "
+        f"{'n/a' if per_action is None else f'{per_action:.2f}'}"
+    )
+    for route, count in sorted(summary["rest_calls_by_route"].items()):
+        limited = summary["rate_limited_by_route"].get(route, 0)
+        print(f"  {route:24s} {count:6d}  429s: {limited}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("stream", nargs="?", help="JSONL file of events")
+    parser.add_argument("--synthetic", type=int, default=1000, metavar="MESSAGES")
+    parser.add_argument("--images", help="directory of scam images to attach")
+    parser.add_argument("--negatives", help="directory of clean images to attach")
+    parser.add_argument("--forbidden-ratio", type=float, default=0.02)
+    parser.add_argument("--image-ratio", type=float, default=0.05)
+    parser.add_argument("--write-stream", help="write the synthetic stream here")
+    parser.add_argument("--rate", type=float, default=50, help="events per second")
+    parser.add_argument("--channels", type=int, default=5)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--bucket-limit", type=int, default=5)
+    parser.add_argument("--bucket-window", type=float, default=1.0)
+    parser.add_argument("--global-limit", type=int, default=50)
+    parser.add_argument("--random-429-rate", type=float, default=0.0)
+    parser.add_argument("--rest-latency", type=float, default=0.0)
+    parser.add_argument("--config", default=os.path.join(ROOT, "config.example.yaml"))
+    parser.add_argument("--settle", type=float, default=8.0)
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="loadtest-results.json")
+    args = parser.parse_args()
+    args.output = os.path.abspath(args.output)
+
+    fake = FakeDiscord(
+        channels=args.channels,
+        users=args.users,
+        bucket_limit=args.bucket_limit,
+        bucket_window=args.bucket_window,
+        global_limit=args.global_limit,
+        random_429_rate=args.random_429_rate,
+        rest_latency=args.rest_latency,
+        seed=args.seed,
+    )
+    await fake.start()
+    fake.patch_discord()
+
+    directory = tempfile.mkdtemp(prefix="loadtest-")
+    config = write_config(args.config, directory, fake)
+
+    if args.stream:
+        events = load_stream(args.stream)
+    else:
+        rng = random.Random(args.seed)
+        # Only patterns without special characters can be used as phrases
+        forbidden = config["moddelmsg"].get("forbidden_regexes") or []
+        phrases = [pattern for pattern in forbidden if pattern.isalnum()]
+        events = synthetic_stream(
+            args.synthetic,
+            rng,
+            phrases,
+            image_paths(args.images) if args.images else [],
+            image_paths(args.negatives) if args.negatives else [],
+            args.forbidden_ratio,
+            args.image_ratio,
+            args.users,
+            args.channels,
+        )
+        if args.write_stream:
+            with open(args.write_stream, "w") as file:
+                for event in events:
+                    file.write(json.dumps(event) + "\n")
+
+    # The bot reads config.yaml from the working directory when it is
+    # imported. It logs JSON lines on stdout, at WARNING and above.
+    os.chdir(directory)
+    import bot
+
+    bot.setup()
+    task = asyncio.create_task(bot.client.start("loadtest"))
+    try:
+        await asyncio.wait_for(wait_for_commands(fake), 60)
+        run = await replay(args, events, fake)
+        drained = await wait_until_idle(bot, fake, args.settle, args.timeout)
+        summary = summarize(fake, run, drained)
+    finally:
+        await bot.client.close()
+        task.cancel()
+        bot.LOG_LISTENER.stop()
+        await fake.stop()
+    print_summary(summary)
+
+    with open(args.output, "w") as file:
+        json.dump(
+            {
+                "commit": git_commit(),
+                "settings": {
+                    key: value
+                    for key, value in vars(args).items()
+                    if key not in ("output", "write_stream")
+                },
+                "queue": {
+                    "workers": config["moddelmsg"].get("queue_workers"),
+                    "max_size": config["moddelmsg"].get("queue_max_size"),
+                },
+                "summary": summary,
+            },
+            file,
+            indent=2,
+        )
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,326 @@
+import argparse
+import asyncio
+import io
+import json
+import logging
+import mimetypes
+import os
+import subprocess
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from urllib.parse import parse_qs, urlsplit
+
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from scamdetect import (
+    configure_ocr_cache,
+    configure_ocr_executor,
+    scan_discord_attachments_for_scams,
+)
+from scamdetect.attachments import IMAGE_EXTENSIONS
+from scamdetect.detect import SCAM_PHRASE_COUNT_THRESHOLD
+
+# Runs the complete scan of scan_discord_attachments_for_scams over a local
+# corpus of messages, without any network access, and reports latency,
+# throughput, CPU time per pass and the precision and recall against the
+# labels of the messages. The results are written as JSON, so that runs of
+# different commits can be compared.
+
+
+# Serves what Discord's media proxy would return for a preview URL: the
+# image scaled down to the requested width and height.
+class LocalHttp:
+    def __init__(self, path: str):
+        self.path = path
+
+    async def get_from_cdn(self, url: str) -> bytes:
+        query = parse_qs(urlsplit(url).query)
+        size = (int(query["width"][0]), int(query["height"][0]))
+        with Image.open(self.path) as image:
+            image.thumbnail(size)
+            output = io.BytesIO()
+            image.save(output, format="PNG")
+        return output.getvalue()
+
+
+# Stands in for a discord.Attachment of an image file on disk, with the
+# metadata that Discord sends with a message.
+class LocalAttachment:
+    def __init__(self, path: str):
+        self.path = path
+        self.filename = os.path.basename(path)
+        self.content_type = mimetypes.guess_type(path)[0]
+        self.size = os.path.getsize(path)
+        try:
+            with Image.open(path) as image:
+                self.width, self.height = image.size
+        except Exception:
+            self.width = self.height = None
+        self.url = f"https://cdn.discordapp.com/attachments/0/0/{self.filename}"
+        self.proxy_url = f"https://media.discordapp.net/attachments/0/0/{self.filename}"
+        self._http = LocalHttp(path)
+
+    async def read(self, *, use_cached: bool = False) -> bytes:
+        with open(self.path, "rb") as file:
+            return file.read()
+
+
+@dataclass
+class Sample:
+    name: str
+    # Whether the message is a scam, according to its label
+    scam: bool
+    paths: list[str]
+
+
+@dataclass
+class SampleResult:
+    name: str
+    scam: bool
+    detected: bool
+    images: int
+    latency: float
+    phrases: list[str] = field(default_factory=list)
+    timings: dict[str, float] = field(default_factory=dict)
+    error: str | None = None
+
+
+def image_paths(directory: str) -> list[str]:
+    return sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+# Every directory with images is one message, like the folders that
+# download.py creates for each message ID.
+def samples_from_directory(directory: str, scam: bool) -> list[Sample]:
+    samples = []
+    for root, dirs, _ in os.walk(directory):
+        dirs.sort()
+        paths = image_paths(root)
+        if paths:
+            samples.append(Sample(os.path.relpath(root, directory), scam, paths))
+    return samples
+
+
+# A JSON list of messages, with paths relative to the manifest, e.g.
+# [{"name": "20240101120000", "scam": true, "files": ["0-a.png", "1-b.png"]}]
+def samples_from_manifest(path: str) -> list[Sample]:
+    base = os.path.dirname(path)
+    with open(path) as file:
+        entries = json.load(file)
+    return [
+        Sample(
+            name=entry.get("name", str(index)),
+            scam=bool(entry["scam"]),
+            paths=[os.path.join(base, name) for name in entry["files"]],
+        )
+        for index, entry in enumerate(entries)
+    ]
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    position = (len(values) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+async def scan_sample(sample: Sample) -> SampleResult:
+    attachments = [LocalAttachment(path) for path in sample.paths]
+    start = time.perf_counter()
+    try:
+        result = await scan_discord_attachments_for_scams(attachments)
+    except Exception as e:
+        return SampleResult(
+            name=sample.name,
+            scam=sample.scam,
+            detected=False,
+            images=len(attachments),
+            latency=time.perf_counter() - start,
+            error=str(e),
+        )
+    return SampleResult(
+        name=sample.name,
+        scam=sample.scam,
+        detected=result.is_scam,
+        images=len(attachments),
+        latency=time.perf_counter() - start,
+        phrases=result.phrases,
+        timings=result.timings,
+    )
+
+
+def summarize(results: list[SampleResult], elapsed: float, cpu: float) -> dict:
+    latencies = [result.latency for result in results]
+    images = sum(result.images for result in results)
+    true_positives = sum(1 for r in results if r.scam and r.detected)
+    false_positives = sum(1 for r in results if not r.scam and r.detected)
+    false_negatives = sum(1 for r in results if r.scam and not r.detected)
+    true_negatives = sum(1 for r in results if not r.scam and not r.detected)
+    detected = true_positives + false_positives
+    scams = true_positives + false_negatives
+    passes = {}
+    for name in ("download", "first_pass", "second_pass"):
+        seconds = [r.timings[name] for r in results if name in r.timings]
+        passes[name] = {
+            "runs": len(seconds),
+            "mean_seconds": sum(seconds) / len(seconds) if seconds else 0.0,
+        }
+        if name != "download":
+            passes[name]["worker_cpu_seconds"] = sum(
+                r.timings.get(f"{name}_cpu", 0.0) for r in results
+            )
+    return {
+        "messages": len(results),
+        "images": images,
+        "errors": sum(1 for r in results if r.error is not None),
+        "elapsed_seconds": elapsed,
+        "images_per_second": images / elapsed if elapsed > 0 else 0.0,
+        "main_cpu_seconds": cpu,
+        "latency_seconds": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies, default=0.0),
+        },
+        "passes": passes,
+        "true_positives": true_positives,
+        "false_positives": false_positives,
+        "false_negatives": false_negatives,
+        "true_negatives": true_negatives,
+        "precision": true_positives / detected if detected else None,
+        "recall": true_positives / scams if scams else None,
+    }
+
+
+def print_summary(summary: dict):
+    latency = summary["latency_seconds"]
+    print(
+        f"{summary['messages']} messages, {summary['images']} images, "
+        f"{summary['errors']} errors in {summary['elapsed_seconds']:.1f}s"
+    )
+    print(
+        f"{summary['images_per_second']:.2f} images/s, "
+        f"latency p50={latency['p50'] * 1000:.0f}ms "
+        f"p95={latency['p95'] * 1000:.0f}ms p99={latency['p99'] * 1000:.0f}ms"
+    )
+    for name, stats in summary["passes"].items():
+        line = (
+            f"{name}: {stats['runs']} runs, "
+            f"mean {stats['mean_seconds'] * 1000:.0f}ms"
+        )
+        if "worker_cpu_seconds" in stats:
+            line += f", {stats['worker_cpu_seconds']:.1f}s worker CPU"
+        print(line)
+    print(f"main process CPU: {summary['main_cpu_seconds']:.1f}s")
+    print(
+        f"tp={summary['true_positives']} fp={summary['false_positives']} "
+        f"fn={summary['false_negatives']} tn={summary['true_negatives']}"
+    )
+    for name in ("precision", "recall"):
+        value = summary[name]
+        print(f"{name}: {'n/a' if value is None else f'{value:.3f}'}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directory", nargs="?", default="downloads")
+    parser.add_argument("--manifest", help="labelled JSON list of messages")
+    parser.add_argument("--negatives", help="directory of messages that are no scam")
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--backend", default="pytesseract")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--cache", action="store_true", help="use the OCR cache")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if args.manifest:
+        samples = samples_from_manifest(args.manifest)
+    else:
+        # Images downloaded with download.py were all sent by compromised
+        # accounts, so they are labelled as scams.
+        samples = samples_from_directory(args.directory, scam=True)
+    if args.negatives:
+        samples += samples_from_directory(args.negatives, scam=False)
+    if not samples:
+        print("No messages with images found", file=sys.stderr)
+        sys.exit(1)
+
+    configure_ocr_executor(
+        workers=args.workers,
+        queue_size=max(16, args.concurrency * 20),
+        timeout_seconds=120,
+        backend=args.backend,
+    )
+    configure_ocr_cache(max_entries=4096 if args.cache else 0)
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def run(sample: Sample) -> SampleResult:
+        async with semaphore:
+            result = await scan_sample(sample)
+        mark = "ok" if result.detected == result.scam else "WRONG"
+        if result.error is not None:
+            mark = f"ERROR {result.error}"
+        print(
+            f"{result.latency * 1000:7.0f}ms  {mark:5s}  {sample.name}",
+            file=sys.stderr,
+        )
+        return result
+
+    # The scan logs a few lines for every message
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING, stream=sys.stderr
+    )
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    results = await asyncio.gather(*[run(sample) for sample in samples])
+    elapsed = time.perf_counter() - start
+    summary = summarize(results, elapsed, time.process_time() - cpu_start)
+    print_summary(summary)
+
+    with open(args.output, "w") as file:
+        json.dump(
+            {
+                "commit": git_commit(),
+                "settings": {
+                    "backend": args.backend,
+                    "workers": args.workers,
+                    "concurrency": args.concurrency,
+                    "cache": args.cache,
+                    "scam_phrase_count_threshold": SCAM_PHRASE_COUNT_THRESHOLD,
+                },
+                "summary": summary,
+                "results": [asdict(result) for result in results],
+            },
+            file,
+            indent=2,
+        )
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,92 @@
+import argparse
+import os
+import random
+import re
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from scamdetect.matcher import PatternListMatcher
+
+# Compares PatternListMatcher with searching for every forbidden regex one
+# after another, like on_message did, on a synthetic corpus of chat messages.
+# Both have to report the same pattern for every message.
+
+FLAGS = re.IGNORECASE | re.MULTILINE
+
+
+def random_word(rng: random.Random) -> str:
+    return "".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 10)))
+
+
+def synthetic_pattern(rng: random.Random) -> str:
+    kind = rng.random()
+    if kind < 0.6:
+        return random_word(rng)
+    if kind < 0.8:
+        return rf"{random_word(rng)}\s*(\.|dot)\s*{random_word(rng)}"
+    if kind < 0.9:
+        return rf"\b{random_word(rng)}s?\b"
+    return rf"(https?://)?{random_word(rng)}\.(gg|com)/\w+"
+
+
+def synthetic_message(rng: random.Random, vocabulary: list[str], hits: list[str]):
+    words = [rng.choice(vocabulary) for _ in range(rng.randint(1, 40))]
+    if rng.random() < 0.01:
+        words.insert(rng.randrange(len(words) + 1), rng.choice(hits))
+    return " ".join(words)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10,100,1000")
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vocabulary = [random_word(rng) for _ in range(5000)]
+
+    print("patterns  loop us/msg  matcher us/msg  speedup")
+    for size in [int(size) for size in args.sizes.split(",")]:
+        patterns = [synthetic_pattern(rng) for _ in range(size)]
+        hits = [
+            pattern.replace(r"\s*(\.|dot)\s*", ".")
+            for pattern in patterns
+            if re.fullmatch(r"[a-z\\s*(.|)]+", pattern)
+        ]
+        messages = [
+            synthetic_message(rng, vocabulary, hits) for _ in range(args.messages)
+        ]
+
+        compiled = [re.compile(pattern, flags=FLAGS) for pattern in patterns]
+        matcher = PatternListMatcher(patterns, flags=FLAGS)
+
+        start = time.perf_counter()
+        expected = [
+            next((pattern for pattern in compiled if pattern.search(m)), None)
+            for m in messages
+        ]
+        loop_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = [matcher.first_match(message) for message in messages]
+        matcher_seconds = time.perf_counter() - start
+
+        for message, a, b in zip(messages, actual, expected):
+            if (a and a.pattern) != (b and b.pattern):
+                print(f"MISMATCH {a} != {b} in {message!r}", file=sys.stderr)
+                sys.exit(1)
+
+        loop_us = loop_seconds * 1e6 / len(messages)
+        matcher_us = matcher_seconds * 1e6 / len(messages)
+        print(
+            f"{size:8d}  {loop_us:11.1f}  {matcher_us:14.1f}  "
+            f"{loop_us / matcher_us:6.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from scamdetect.detect import blacklist_phrases
+from scamdetect.matcher import PhraseMatcher, compile_phrase
+
+# Compares the single-pass PhraseMatcher with searching for every blacklist
+# pattern one after another, on synthetic OCR-like texts. Both have to find
+# exactly the same phrases.
+
+
+def random_word(rng: random.Random) -> str:
+    return "".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 10)))
+
+
+def synthetic_phrase(rng: random.Random, vocabulary: list[str]) -> str:
+    words = rng.sample(vocabulary, rng.randint(1, 3))
+    phrase = r"\s*".join(words) if rng.random() < 0.2 else " ".join(words)
+    if rng.random() < 0.2:
+        phrase += "(s)?"
+    if rng.random() < 0.1:
+        phrase += r"(\.com)?"
+    return phrase
+
+
+def with_typo(rng: random.Random, text: str) -> str:
+    i = rng.randrange(len(text))
+    operation = rng.choice(["insert", "delete", "substitute", "none"])
+    if operation == "insert":
+        return text[:i] + rng.choice(string.ascii_lowercase) + text[i:]
+    if operation == "delete":
+        return text[:i] + text[i + 1 :]
+    if operation == "substitute":
+        return text[:i] + rng.choice(string.ascii_lowercase) + text[i + 1 :]
+    return text
+
+
+def synthetic_text(rng: random.Random, vocabulary: list[str], samples: list[str]):
+    words = []
+    while sum(len(word) + 1 for word in words) < 1500:
+        if rng.random() < 0.03:
+            words.append(with_typo(rng, rng.choice(samples)))
+        else:
+            words.append(rng.choice(vocabulary))
+    if rng.random() < 0.5:
+        words = [word.upper() if rng.random() < 0.1 else word for word in words]
+    return " ".join(words)
+
+
+def naive_find(patterns, text: str) -> list[str]:
+    matches = []
+    for pattern in patterns:
+        match = pattern.search(text)
+        if match is not None:
+            i, j = match.span()
+            matches.append(text[i:j].lower().strip())
+    return matches
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="40,100,1000,3000")
+    parser.add_argument("--texts", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vocabulary = [random_word(rng) for _ in range(5000)]
+    samples = [
+        "withdrawal",
+        "$ 250.00",
+        "1,500 USDT",
+        "transferred",
+        "vip club",
+        "kai cenat",
+        "luckywin.com",
+        "promo code",
+        "network fee",
+        "dropshipping",
+    ]
+    texts = [synthetic_text(rng, vocabulary, samples) for _ in range(args.texts)]
+
+    print("phrases  naive ms/text  matcher ms/text  speedup  compile s")
+    for size in [int(size) for size in args.sizes.split(",")]:
+        phrases = list(blacklist_phrases)
+        while len(phrases) < size:
+            phrases.append(synthetic_phrase(rng, vocabulary))
+        phrases = phrases[:size]
+        samples_with_synthetic = samples + [
+            phrase.replace(r"\s*", " ").replace("(s)?", "s").replace(r"(\.com)?", "")
+            for phrase in phrases[len(blacklist_phrases) :][:200]
+        ]
+        size_texts = [
+            synthetic_text(rng, vocabulary, samples_with_synthetic) for _ in texts
+        ]
+
+        start = time.perf_counter()
+        matcher = PhraseMatcher(phrases)
+        compile_seconds = time.perf_counter() - start
+        patterns = [compile_phrase(phrase) for phrase in phrases]
+
+        start = time.perf_counter()
+        expected = [naive_find(patterns, text) for text in size_texts]
+        naive_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = [matcher.find(text) for text in size_texts]
+        matcher_seconds = time.perf_counter() - start
+
+        if actual != expected:
+            for text, a, b in zip(size_texts, actual, expected):
+                if a != b:
+                    print(f"MISMATCH {a} != {b} in {text!r}", file=sys.stderr)
+            sys.exit(1)
+
+        naive_ms = naive_seconds * 1000 / len(size_texts)
+        matcher_ms = matcher_seconds * 1000 / len(size_texts)
+        print(
+            f"{size:7d}  {naive_ms:13.2f}  {matcher_ms:15.2f}  "
+            f"{naive_ms / matcher_ms:6.1f}x  {compile_seconds:9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from scamdetect.attachments import IMAGE_EXTENSIONS
+from scamdetect.detect import (
+    OCR_BACKENDS,
+    init_ocr_worker,
+    is_ocr_backend_available,
+    ocr_job,
+    ocr_pipelines,
+)
+from scamdetect.executor import OcrExecutor
+
+# Compares the images per second of each OCR backend, running the first pass
+# pipeline over all images in a directory with the same process pool the bot
+# uses.
+
+
+def find_images(directory: str) -> list[str]:
+    paths = []
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+
+async def benchmark_backend(
+    backend: str, images: list[bytes], workers: int, repeat: int, pipeline_name: str
+):
+    jobs = images * repeat
+    executor = OcrExecutor(
+        workers=workers,
+        queue_size=len(jobs),
+        timeout_seconds=120,
+        initializer=init_ocr_worker,
+        initargs=(backend,),
+    )
+    pipeline = ocr_pipelines[pipeline_name]
+    try:
+        # Start the workers and load the engines before measuring
+        await asyncio.gather(
+            *[executor.run(ocr_job, images[0], pipeline) for _ in range(workers)]
+        )
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *[executor.run(ocr_job, data, pipeline) for data in jobs]
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        executor.shutdown()
+    ocr_seconds = [result.timings["ocr"] for result in results]
+    print(
+        f"{backend:12s}  {len(jobs) / elapsed:8.2f}  "
+        f"{statistics.mean(ocr_seconds) * 1000:11.0f}  "
+        f"{statistics.median(ocr_seconds) * 1000:13.0f}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directory", nargs="?", default="downloads")
+    parser.add_argument("--backends", default=",".join(OCR_BACKENDS))
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--pipeline", default="first_pass")
+    args = parser.parse_args()
+
+    paths = find_images(args.directory)
+    if not paths:
+        print(f"No images found in {args.directory}", file=sys.stderr)
+        sys.exit(1)
+    images = []
+    for path in paths:
+        with open(path, "rb") as file:
+            images.append(file.read())
+    print(f"{len(images)} images, {args.workers} workers, {args.pipeline}")
+
+    print("backend       images/s  mean ocr ms  median ocr ms")
+    for backend in args.backends.split(","):
+        if not is_ocr_backend_available(backend):
+            print(f"{backend:12s}  not installed")
+            continue
+        await benchmark_backend(
+            backend, images, args.workers, args.repeat, args.pipeline
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
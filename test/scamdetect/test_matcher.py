@@ -0,0 +1,154 @@
+import os
+import random
+import re
+import string
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from scamdetect.detect import blacklist_phrases
+from scamdetect.matcher import (
+    LiteralPrefilter,
+    PatternListMatcher,
+    PhraseMatcher,
+    compile_phrase,
+    pattern_anchors,
+    phrase_anchors,
+    required_literal_runs,
+)
+
+# The matchers only search the patterns whose anchors are found in a text, so
+# a wrong anchor silently hides a phrase. These compare them with searching
+# for every pattern one after another. Run with: python -m pytest test
+
+
+def naive_find(phrases: list[str], text: str) -> list[str]:
+    matches = []
+    for phrase in phrases:
+        match = compile_phrase(phrase).search(text)
+        if match is not None:
+            i, j = match.span()
+            matches.append(text[i:j].lower().strip())
+    return matches
+
+
+def with_typo(rng: random.Random, text: str) -> str:
+    i = rng.randrange(len(text))
+    operation = rng.choice(["insert", "delete", "substitute"])
+    if operation == "insert":
+        return text[:i] + rng.choice(string.ascii_lowercase) + text[i:]
+    if operation == "delete":
+        return text[:i] + text[i + 1 :]
+    return text[:i] + rng.choice(string.ascii_lowercase) + text[i + 1 :]
+
+
+def test_required_literal_runs():
+    assert required_literal_runs("abc?d") == ["ab", "d"]
+    assert required_literal_runs(r"foo\s*bar") == ["foo", "bar"]
+    assert required_literal_runs("ab(cd)?ef") == ["ab", "ef"]
+    assert required_literal_runs(r"\$\s*250") == ["$", "250"]
+    assert required_literal_runs("wit+hdraw") == ["wit", "hdraw"]
+    assert required_literal_runs("a|b") is None
+    assert required_literal_runs("(?x)a b") is None
+    assert required_literal_runs(r"(a)\1") is None
+
+
+def test_fuzzy_phrase_anchors_survive_one_error():
+    for phrase in ["withdrawal", r"gift\s*card", "successfully", "transferred"]:
+        anchors = phrase_anchors(phrase)
+        assert anchors
+        for i in range(len(phrase)):
+            deleted = phrase[:i] + phrase[i + 1 :]
+            assert any(anchor in deleted for anchor in anchors), (phrase, i)
+
+
+def test_prefilter_candidates():
+    prefilter = LiteralPrefilter([["abc"], ["ab"], [], ["xyz", "bc"]])
+    assert prefilter.candidates("nothing here") == [2]
+    assert prefilter.candidates("ABC") == [0, 1, 2, 3]
+    assert prefilter.candidates("xab") == [1, 2]
+    assert prefilter.candidates("xYz") == [2, 3]
+
+
+def test_phrase_matcher_handcrafted():
+    phrases = [
+        "withdrawal",
+        r"gift\s*card(s)?",
+        r"\$\s*250",
+        "usdt",
+        "ab|cd",
+        "straße",
+    ]
+    matcher = PhraseMatcher(phrases)
+    for text in [
+        "",
+        "your WITHDRAWL was successful",
+        "claim your giftcards",
+        "you received $ 250.00",
+        "1,500 USDT transferred",
+        "cd",
+        "STRASSE und Straße",
+        "nothing to see",
+    ]:
+        assert matcher.find(text) == naive_find(phrases, text), text
+
+
+def test_phrase_matcher_blacklist():
+    rng = random.Random(1)
+    phrases = list(blacklist_phrases)
+    matcher = PhraseMatcher(phrases)
+    vocabulary = ["".join(rng.choices(string.ascii_lowercase, k=6)) for _ in range(500)]
+    samples = [p.replace(r"\s*", " ").replace("\\", "") for p in phrases]
+    for _ in range(200):
+        words = [rng.choice(vocabulary) for _ in range(50)]
+        for _ in range(rng.randint(0, 3)):
+            sample = with_typo(rng, rng.choice(samples))
+            words.insert(rng.randrange(len(words) + 1), sample)
+        text = " ".join(words)
+        if rng.random() < 0.5:
+            text = text.upper()
+        assert matcher.find(text) == naive_find(phrases, text), text
+
+
+def naive_first_match(patterns: list[str], text: str, flags: int) -> str | None:
+    return next(
+        (pattern for pattern in patterns if re.search(pattern, text, flags)), None
+    )
+
+
+def test_pattern_anchors():
+    assert pattern_anchors(r"discord\s*(\.|dot)\s*gg") == ["discord"]
+    assert pattern_anchors(r"\bfree\s+nitro\b") == ["nitro"]
+    assert pattern_anchors(r"(https?://)?steam\w*\.com") == ["steam"]
+    assert pattern_anchors("nitro|boost") == []
+
+
+def test_pattern_list_matcher():
+    rng = random.Random(1)
+    flags = re.IGNORECASE | re.MULTILINE
+    words = ["".join(rng.choices(string.ascii_lowercase, k=5)) for _ in range(200)]
+    patterns = [
+        r"discord\s*(\.|dot)\s*gg/\w+",
+        r"\bfree\s+nitro\b",
+        r"(https?://)?steam\w*\.com",
+        "nitro|boost",
+        r"^\s*@everyone",
+        "ǅemal",
+    ] + [rf"{word}s?\b" for word in words[:50]]
+    matcher = PatternListMatcher(patterns, flags=flags)
+    texts = [
+        "",
+        "join DISCORD dot gg/abc",
+        "Free  Nitro for everyone",
+        "https://steamcommunlty.com/gift",
+        "  @everyone look",
+        "hello\n@everyone",
+        "ǆemal",
+        "nothing to see",
+    ]
+    for _ in range(500):
+        texts.append(" ".join(rng.choices(words, k=rng.randint(1, 20))))
+    for text in texts:
+        match = matcher.first_match(text)
+        expected = naive_first_match(patterns, text, flags)
+        assert (match and match.pattern) == expected, text